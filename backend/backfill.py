@@ -0,0 +1,343 @@
+"""
+Re-assess the issues table in bulk, e.g. after a prompt or model change.
+
+Issues are read in id order with keyset pagination and flow through a bounded
+pipeline: image downloads, the batching scheduler (the same batched and
+pipelined generate path the API uses) and coalesced bulk writes. Progress is
+checkpointed after every fully written page, so an interrupted run picks up
+where it stopped. Memory stays flat: only a few pages are held at any time,
+however large the table is.
+
+Usage:
+    python backfill.py --status Assessed --since 2025-01-01 --checkpoint rescore.json
+    python backfill.py --checkpoint rescore.json          # resume after an interruption
+    python backfill.py --checkpoint rescore.json --restart
+
+Only priority_score, assessment_reasoning, assessed_at and (with ASSESS_DEGRADE)
+assessment_tier are written, the status is left alone. Issues whose assessment fails keep their
+previous score; their ids are appended to <checkpoint>.failed.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from batching import BatchScheduler
+from fetcher import ImageFetcher
+from img import InfrastructureDamageAssessor, combine_image_results, PROMPT_VERSION
+from issue_store import IssueStore
+from worker_pool import RemoteAssessor
+from config import (
+    ASSESS_BATCH_SIZE,
+    ASSESS_BATCH_WAIT_MS,
+    ASSESS_DEGRADE,
+    ASSESS_PIPELINE,
+    ASSESS_PREFETCH_BATCHES,
+    ASSESS_QUEUE_SIZE,
+    DB_MAX_CONNECTIONS,
+    DB_TIMEOUT,
+    DB_WRITE_BATCH_SIZE,
+    IMAGE_FETCH_CONNECT_TIMEOUT,
+    IMAGE_FETCH_MAX_BYTES,
+    IMAGE_FETCH_MAX_CONNECTIONS,
+    IMAGE_FETCH_MAX_PER_HOST,
+    IMAGE_FETCH_READ_TIMEOUT,
+    INFERENCE_AUTHKEY,
+    INFERENCE_WORKERS,
+    MAX_IMAGES_PER_ISSUE,
+    MULTI_IMAGE_COMBINE,
+    SUPABASE_REST_URL,
+    SUPABASE_SERVICE_KEY,
+    assessor_options,
+    require_inference_authkey,
+)
+
+logger = logging.getLogger("backfill")
+
+
+def _duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m{seconds % 60:02d}s"
+
+
+class Checkpoint:
+    """Progress of a backfill run in a small JSON file, replaced atomically on every save"""
+
+    def __init__(self, path):
+        self.path = path
+        self.failed_path = f"{path}.failed"
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as handle:
+            return json.load(handle)
+
+    def save(self, state):
+        state["updated_at"] = datetime.utcnow().isoformat()
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as handle:
+            json.dump(state, handle, indent=2)
+        # A crash mid-write leaves the previous checkpoint intact
+        os.replace(temporary, self.path)
+
+    def record_failure(self, issue_id, reason):
+        with open(self.failed_path, "a") as handle:
+            handle.write(f"{issue_id}\t{reason}\n")
+
+
+class Backfill:
+    """Streams issues from the store through assessment and back.
+
+    A producer reads pages into a queue of ``queue_size`` issues, which
+    ``concurrency`` workers assess; the producer waits while the queue is full,
+    so reading never runs ahead of inference. Workers finish out of order, so
+    the checkpoint only moves past a page once every issue in it and in all
+    earlier pages is written; a resumed run repeats at most the pages that were
+    in flight.
+    """
+
+    def __init__(self, store, fetcher, batcher, checkpoint, state, page_size=100, concurrency=16,
+                 queue_size=200, limit=None, report_seconds=30):
+        self.store = store
+        self.fetcher = fetcher
+        self.batcher = batcher
+        self.checkpoint = checkpoint
+        self.state = state
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.limit = limit
+        self.report_seconds = report_seconds
+        self.total = None
+        self.done = 0
+        self._queue = asyncio.Queue(queue_size)
+        # Page number -> id of its last issue and the number of its issues not done yet
+        self._pages = {}
+        self._next_page = 0
+        self._exhausted = False
+
+    async def run(self):
+        filters = self.state["filters"]
+        try:
+            self.total = await self.store.count_issues(self.state["after_id"], **filters)
+        except Exception as e:
+            logger.warning(f"Could not count the remaining issues, no ETA: {str(e)}")
+        if self.total is not None and self.limit:
+            self.total = min(self.total, self.limit)
+        logger.info(f"{'?' if self.total is None else self.total} issues to assess"
+                    f"{' after ' + self.state['after_id'] if self.state['after_id'] else ''}")
+
+        self._started = time.perf_counter()
+        tasks = [asyncio.create_task(self._produce())]
+        tasks += [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        reporter = asyncio.create_task(self._report_periodically())
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks + [reporter]:
+                task.cancel()
+            await asyncio.gather(*tasks, reporter, return_exceptions=True)
+        # A run stopped by --limit can be continued
+        self.state["finished"] = self._exhausted
+        self.checkpoint.save(self.state)
+        self._report()
+
+    async def _produce(self):
+        after_id = self.state["after_id"]
+        queued = 0
+        page = 0
+        while not self.limit or queued < self.limit:
+            limit = min(self.page_size, self.limit - queued) if self.limit else self.page_size
+            rows = await self.store.page_issues(after_id, limit, **self.state["filters"])
+            if not rows:
+                self._exhausted = True
+                break
+            after_id = rows[-1]["id"]
+            self._pages[page] = {"last_id": after_id, "pending": len(rows)}
+            for row in rows:
+                await self._queue.put((page, row))
+            queued += len(rows)
+            page += 1
+        for _ in range(self.concurrency):
+            await self._queue.put(None)
+
+    async def _work(self):
+        while (item := await self._queue.get()) is not None:
+            page, issue = item
+            outcome = await self._assess(issue)
+            self.state[outcome] += 1
+            self.done += 1
+            self._pages[page]["pending"] -= 1
+            self._advance()
+
+    async def _assess(self, issue):
+        """Assess and save one issue; returns the counter it goes to"""
+        image_urls = (issue.get("image_urls") or [])[:MAX_IMAGES_PER_ISSUE]
+        if not image_urls:
+            # Nothing for the model to look at, the API's default score stands
+            return "skipped"
+        title, description = issue["title"], issue.get("description") or ""
+        try:
+            images = await self.fetcher.fetch_many(image_urls)
+            results = await asyncio.gather(*[
+                self.batcher.submit(title, description, image) for image in images if image is not None
+            ])
+            if not results:
+                raise RuntimeError("Failed to load image")
+            result = combine_image_results(results, MULTI_IMAGE_COMBINE)
+            if "error" in result:
+                raise RuntimeError(result["error"])
+            saved = await self.store.save_assessment(issue["id"], title, {
+                "priority_score": result.get("priority_score", 50),
+                "assessment_reasoning": result.get("reasoning", "Assessment completed"),
+                "assessed_at": datetime.utcnow().isoformat(),
+                "assessment_tier": result.get("assessment_tier"),
+            })
+        except Exception as e:
+            logger.error(f"Assessment of issue {issue['id']} failed: {str(e)}")
+            self.checkpoint.record_failure(issue["id"], str(e))
+            return "failed"
+        return "assessed" if saved else "skipped"
+
+    def _advance(self):
+        """Move the checkpoint past every leading page that is completely done"""
+        advanced = False
+        while self._pages.get(self._next_page, {}).get("pending") == 0:
+            self.state["after_id"] = self._pages.pop(self._next_page)["last_id"]
+            self._next_page += 1
+            advanced = True
+        if advanced:
+            self.checkpoint.save(self.state)
+
+    async def _report_periodically(self):
+        while True:
+            await asyncio.sleep(self.report_seconds)
+            self._report()
+
+    def _report(self):
+        elapsed = time.perf_counter() - self._started
+        rate = self.done / elapsed if elapsed else 0
+        progress = f"{self.done}" if self.total is None else f"{self.done}/{self.total} ({self.done / max(self.total, 1):.1%})"
+        eta = ""
+        if self.total is not None and rate:
+            eta = f", ETA {_duration(max(self.total - self.done, 0) / rate)}"
+        batching = self.batcher.stats()
+        logger.info(
+            f"{progress} issues in {_duration(elapsed)}, {rate:.2f} issues/s{eta} | assessed {self.state['assessed']}, "
+            f"failed {self.state['failed']}, skipped {self.state['skipped']} | generate busy "
+            f"{batching['utilisation']['generate']:.0%}, average batch {batching['average_batch_size']}"
+        )
+
+
+def _load_state(args, checkpoint, identity):
+    """Checkpointed state to resume from, or a fresh one for these arguments"""
+    filters = {"statuses": args.status, "created_after": args.since, "created_before": args.until}
+    state = None if args.restart else checkpoint.load()
+    if state is None:
+        return {
+            "filters": filters,
+            "prompt_version": PROMPT_VERSION,
+            "assessor": identity,
+            "after_id": None,
+            "assessed": 0,
+            "failed": 0,
+            "skipped": 0,
+            "finished": False,
+            "started_at": datetime.utcnow().isoformat(),
+        }
+    if any([args.status, args.since, args.until]) and filters != state["filters"]:
+        raise SystemExit(f"{checkpoint.path} was written with filters {state['filters']}; "
+                         f"resume without filters or pass --restart")
+    if state["finished"]:
+        raise SystemExit(f"{checkpoint.path} records a finished run; pass --restart to run again")
+    if (state["prompt_version"], state["assessor"]) != (PROMPT_VERSION, identity):
+        logger.warning("The prompt or model changed since this run started; "
+                       "issues assessed before the change keep their earlier scores")
+    return state
+
+
+async def run(args):
+    store = IssueStore(
+        SUPABASE_REST_URL,
+        SUPABASE_SERVICE_KEY,
+        max_connections=DB_MAX_CONNECTIONS,
+        timeout=DB_TIMEOUT,
+        # Results are always written in bulk here; an issue deleted during the run can be re-created
+        coalesce_ms=args.write_window_ms,
+        write_batch_size=DB_WRITE_BATCH_SIZE,
+        # Rescored issues replace a degraded tier recorded by the API
+        track_tier=ASSESS_DEGRADE,
+    )
+    fetcher = ImageFetcher(
+        max_connections=IMAGE_FETCH_MAX_CONNECTIONS,
+        max_connections_per_host=IMAGE_FETCH_MAX_PER_HOST,
+        max_bytes=IMAGE_FETCH_MAX_BYTES,
+        connect_timeout=IMAGE_FETCH_CONNECT_TIMEOUT,
+        read_timeout=IMAGE_FETCH_READ_TIMEOUT,
+    )
+    if INFERENCE_WORKERS:
+        require_inference_authkey()
+        # Reuse the deployment's inference workers instead of loading another model copy
+        assessor = RemoteAssessor(INFERENCE_WORKERS, INFERENCE_AUTHKEY, **assessor_options())
+    else:
+        assessor = await asyncio.to_thread(InfrastructureDamageAssessor, **assessor_options())
+    checkpoint = Checkpoint(args.checkpoint)
+    state = _load_state(args, checkpoint, assessor.cache_identity())
+    if args.restart and os.path.exists(checkpoint.failed_path):
+        os.remove(checkpoint.failed_path)
+
+    batcher = BatchScheduler(
+        assessor,
+        ASSESS_BATCH_SIZE,
+        ASSESS_BATCH_WAIT_MS,
+        concurrency=len(INFERENCE_WORKERS) or 1,
+        pipelined=ASSESS_PIPELINE,
+        prefetch_batches=ASSESS_PREFETCH_BATCHES,
+        queue_size=ASSESS_QUEUE_SIZE,
+    )
+    await store.start()
+    await fetcher.start()
+    batcher.start()
+    try:
+        await Backfill(
+            store, fetcher, batcher, checkpoint, state,
+            page_size=args.page_size,
+            concurrency=args.concurrency,
+            queue_size=args.queue_size,
+            limit=args.limit,
+            report_seconds=args.report_seconds,
+        ).run()
+    finally:
+        await batcher.stop()
+        await fetcher.close()
+        # Flushes the writes still being coalesced
+        await store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-assess issues in bulk with a resumable checkpoint")
+    parser.add_argument("--status", nargs="+", help="Only issues in these statuses")
+    parser.add_argument("--since", help="Only issues created at or after this ISO date/time")
+    parser.add_argument("--until", help="Only issues created before this ISO date/time")
+    parser.add_argument("--checkpoint", default="backfill_checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start over")
+    parser.add_argument("--limit", type=int, help="Stop after this many issues")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16, help="Issues being assessed at once")
+    parser.add_argument("--queue-size", type=int, default=200, help="Issues read ahead of the assessment")
+    parser.add_argument("--write-window-ms", type=int, default=200, help="How long results are gathered per bulk write")
+    parser.add_argument("--report-seconds", type=float, default=30)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        logger.info(f"Interrupted, resume with --checkpoint {args.checkpoint}")
+
+
+if __name__ == "__main__":
+    main()
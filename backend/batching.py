@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import time
+
+import metrics
+from degradation import TIERS
+
+logger = logging.getLogger(__name__)
+
+
+class BatchScheduler:
+    """Gathers concurrent assessment requests into batched generate calls.
+
+    By default a single worker owns the model, so requests never fight over the
+    device; with out-of-process inference ``concurrency`` batches can be in
+    flight at once, one per inference worker. Each batch closes when it reaches
+    ``max_batch_size`` or when ``max_wait_ms`` has passed since its first request
+    arrived, whichever comes first.
+
+    With ``pipelined`` a batch goes through two stages joined by a queue of
+    ``prefetch_batches`` slots: prepare (decode, preprocess, collate and start the
+    copy to the GPU, on the assessor's preprocessing threads) and generate. The
+    next batches are prepared while the current one generates, so the model does
+    not sit idle during CPU work. ``queue_size`` bounds the requests waiting for
+    a batch; submit then waits for room, which slows down the downloads feeding
+    it instead of piling up images in memory.
+
+    With a ``controller`` (see degradation.LoadController) each batch runs at
+    the quality tier it picks when the batch closes, and every request's
+    latency is fed back to it. Successful results carry the tier as
+    ``assessment_tier``; error results carry none, so they are never recorded
+    as an assessment at some tier.
+    """
+
+    def __init__(self, assessor, max_batch_size=4, max_wait_ms=50, concurrency=1, pipelined=True,
+                 prefetch_batches=2, queue_size=0, controller=None):
+        self.assessor = assessor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0, max_wait_ms) / 1000
+        self.concurrency = max(1, concurrency)
+        self.pipelined = pipelined
+        self.prefetch_batches = max(1, prefetch_batches)
+        self.queue_size = max(0, queue_size)
+        self.controller = controller
+        self.batches_run = 0
+        self.requests_run = 0
+        self.busy_seconds = {"prepare": 0.0, "generate": 0.0}
+        self._started = None
+        self._queue = None
+        self._prepared = None
+        self._workers = []
+
+    def start(self):
+        """Start the batching workers on the running event loop"""
+        self._queue = asyncio.Queue(self.queue_size)
+        self._started = time.perf_counter()
+        self.busy_seconds = {"prepare": 0.0, "generate": 0.0}
+        if self.pipelined:
+            self._prepared = asyncio.Queue(self.prefetch_batches)
+            self._workers = [asyncio.create_task(self._prepare_stage()) for _ in range(self.concurrency)]
+            self._workers += [asyncio.create_task(self._generate_stage()) for _ in range(self.concurrency)]
+        else:
+            self._workers = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        """Stop the workers and fail any requests still waiting"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        error = RuntimeError("Batch scheduler stopped")
+        while self._prepared and not self._prepared.empty():
+            batch, *_ = self._prepared.get_nowait()
+            self._fail(batch, error)
+        while self._queue and not self._queue.empty():
+            self._fail([self._queue.get_nowait()], error)
+
+    async def submit(self, heading, description, image_source):
+        """Queue one report and wait for its own assessment result"""
+        future = asyncio.get_running_loop().create_future()
+        started = time.perf_counter()
+        await self._queue.put((heading, description, image_source, future))
+        result = await future
+        if self.controller:
+            self.controller.observe_latency(time.perf_counter() - started)
+        return result
+
+    def stats(self):
+        """Batching counters for health reporting"""
+        elapsed = time.perf_counter() - self._started if self._started else 0
+        return {
+            "batches": self.batches_run,
+            "requests": self.requests_run,
+            "average_batch_size": round(self.requests_run / self.batches_run, 2) if self.batches_run else 0,
+            "pipelined": self.pipelined,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "prepared": self._prepared.qsize() if self._prepared else 0,
+            # Share of wall time each stage was working; generate is the model's utilisation
+            "utilisation": {
+                stage: round(seconds / elapsed, 3) if elapsed else 0 for stage, seconds in self.busy_seconds.items()
+            },
+        }
+
+    async def _collect(self):
+        """Wait for one request, then keep gathering until the batch is full or the window closes"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        # Anything that arrived while we were waiting rides along for free
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+        return batch
+
+    async def _timed(self, stage, function, *args):
+        """Run a blocking stage off the event loop and count its time as busy"""
+        started = time.perf_counter()
+        try:
+            return await asyncio.to_thread(function, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.busy_seconds[stage] += elapsed
+            metrics.PIPELINE_BUSY_SECONDS.inc(elapsed, stage=stage)
+
+    def _fail(self, batch, error):
+        for *_, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def _tier(self):
+        """Quality tier for the batch about to run and its settings"""
+        tier = self.controller.tier() if self.controller else "full"
+        return tier, TIERS[tier]
+
+    def _deliver(self, batch, results, tier):
+        self.batches_run += 1
+        self.requests_run += len(batch)
+        logger.info(f"Assessed batch of {len(batch)} requests ({tier} tier)")
+
+        assessed = 0
+        for (*_, future), result in zip(batch, results):
+            if "error" not in result:
+                result["assessment_tier"] = tier
+                assessed += 1
+            if not future.done():
+                future.set_result(result)
+        metrics.TIER_ASSESSMENTS.inc(assessed, tier=tier)
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            requests = [item[:3] for item in batch]
+            tier, settings = self._tier()
+
+            try:
+                # Generation is synchronous, keep it off the event loop
+                results = await self._timed(
+                    "generate", self.assessor.assess_batch, requests,
+                    settings["resolution_mode"], settings["max_new_tokens"], settings["output_mode"],
+                )
+            except Exception as e:
+                logger.error(f"Batched assessment of {len(batch)} requests failed: {str(e)}")
+                self._fail(batch, e)
+                continue
+            self._deliver(batch, results, tier)
+
+    async def _prepare_stage(self):
+        while True:
+            batch = await self._collect()
+            requests = [item[:3] for item in batch]
+            tier, settings = self._tier()
+
+            try:
+                prepared = await self._timed(
+                    "prepare", self.assessor.prepare_batch, requests,
+                    settings["resolution_mode"], settings["output_mode"],
+                )
+            except Exception as e:
+                logger.error(f"Preparing a batch of {len(batch)} requests failed: {str(e)}")
+                self._fail(batch, e)
+                continue
+            # Waits while prefetch_batches batches are already ready, which in turn
+            # leaves requests in the bounded input queue
+            await self._prepared.put((batch, prepared, tier))
+
+    async def _generate_stage(self):
+        while True:
+            batch, prepared, tier = await self._prepared.get()
+
+            try:
+                results = await self._timed(
+                    "generate", self.assessor.finish_batch, prepared, TIERS[tier]["max_new_tokens"]
+                )
+            except Exception as e:
+                logger.error(f"Batched assessment of {len(batch)} requests failed: {str(e)}")
+                self._fail(batch, e)
+                continue
+            self._deliver(batch, results, tier)
@@ -0,0 +1,741 @@
+"""
+Performance benchmarks for the damage assessment pipeline.
+
+Usage:
+    python benchmark.py batching --image sample.jpg --requests 16 --batch-sizes 1 4 8
+    python benchmark.py resolution --images ./samples --labels ./samples/labels.json
+    python benchmark.py prefix --image sample.jpg --runs 10
+    python benchmark.py output --images ./samples
+    python benchmark.py --draft-model-path ./draft decode --corpus ./samples
+    python benchmark.py --tiny pipeline --synthetic 32 --download-ms 40
+    python benchmark.py image-decode --megapixels 12 --count 16
+    python benchmark.py --tiny suite --synthetic 32 --output results.json
+    python benchmark.py compare baseline.json results.json
+    python benchmark.py --backend cpu-int8 suite --output cpu-int8.json
+
+--tiny swaps the 7B model for a tiny random LLaVA-Next (see tiny_model.py) so
+every benchmark runs on a CPU-only machine without downloads. --backend picks
+the inference backend (see inference_backends.py); with --tiny it is applied to
+the tiny model, which otherwise stays plain float32. A benchmark in which any
+assessment fails exits with status 1, its timings are not worth reading.
+"""
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import torch
+from PIL import Image, ImageDraw
+
+from img import InfrastructureDamageAssessor, RESOLUTION_MODES, OUTPUT_MODES, DECODE_MODES
+from inference_backends import BACKENDS
+from batching import BatchScheduler
+from image_decode import decode_image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SAMPLE_HEADING = "Tree fell, wall broken"
+SAMPLE_DESCRIPTION = "A large tree came down in the storm and broke the boundary wall onto the footpath"
+
+
+async def _run_burst(assessor, image, requests, batch_size, wait_ms):
+    """Submit a burst of concurrent requests through a scheduler and time it"""
+    scheduler = BatchScheduler(assessor, batch_size, wait_ms)
+    scheduler.start()
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            scheduler.submit(SAMPLE_HEADING, SAMPLE_DESCRIPTION, image)
+            for _ in range(requests)
+        ])
+        elapsed = time.perf_counter() - start
+    finally:
+        await scheduler.stop()
+    return elapsed, scheduler.stats()
+
+
+def _record_failures(assessor):
+    """Count every failed result of the assessor; returns the list the errors are collected in"""
+    errors = []
+    finish_batch = assessor.finish_batch
+
+    def checked(prepared, max_new_tokens=None):
+        results = finish_batch(prepared, max_new_tokens)
+        errors.extend(result["error"] for result in results if "error" in result)
+        return results
+
+    # Every path, batch scheduler included, ends in finish_batch
+    assessor.finish_batch = checked
+    return errors
+
+
+def _exit_on_failures(errors):
+    """Timings of failed assessments mean nothing, so a run with any of them fails"""
+    if errors:
+        print(f"{len(errors)} assessments failed, the timings above are not valid; first error: {errors[0]}")
+        raise SystemExit(1)
+
+
+def bench_batching(assessor, args):
+    """Compare burst throughput across batch sizes; batch size 1 is single-request generation"""
+    # Warm up kernels and allocator so the first row isn't penalised
+    assessor.assess_damage(SAMPLE_HEADING, SAMPLE_DESCRIPTION, args.image)
+
+    print(f"{'batch size':>10} {'requests':>9} {'seconds':>9} {'req/s':>8} {'speed-up':>9}")
+    baseline = None
+    for batch_size in args.batch_sizes:
+        elapsed, stats = asyncio.run(
+            _run_burst(assessor, args.image, args.requests, batch_size, args.wait_ms)
+        )
+        throughput = args.requests / elapsed
+        baseline = baseline or throughput
+        print(f"{batch_size:>10} {args.requests:>9} {elapsed:>9.2f} {throughput:>8.2f} {throughput / baseline:>8.2f}x"
+              f"  (avg batch {stats['average_batch_size']})")
+
+
+async def _run_pipeline(assessor, corpus, args, pipelined):
+    """Download (simulated), submit and assess the corpus through a scheduler, timing the whole run"""
+    scheduler = BatchScheduler(assessor, args.batch_size, args.wait_ms, pipelined=pipelined,
+                               prefetch_batches=args.prefetch_batches, queue_size=args.queue_size)
+    downloads = asyncio.Semaphore(args.connections)
+
+    async def fetch_and_submit(item):
+        async with downloads:
+            await asyncio.sleep(args.download_ms / 1000)
+        return await scheduler.submit(*item)
+
+    scheduler.start()
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*[fetch_and_submit(item) for item in corpus])
+        elapsed = time.perf_counter() - start
+        stats = scheduler.stats()
+    finally:
+        await scheduler.stop()
+    return elapsed, stats
+
+
+class _GpuSampler:
+    """Samples NVML GPU utilisation in the background; reports None without CUDA or pynvml"""
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if torch.cuda.is_available():
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.samples.append(torch.cuda.utilization())
+            except Exception:  # pynvml missing
+                return
+
+    def mean(self):
+        return statistics.mean(self.samples) if self.samples else None
+
+
+def bench_pipeline(assessor, args):
+    """Throughput and device utilisation with and without overlapping preprocessing and generation"""
+    corpus = _load_corpus(args)
+    # Warm up kernels, allocator and the prefix cache
+    assessor.assess_batch(corpus[:args.batch_size])
+
+    print(f"{'pipeline':>9} {'images':>7} {'seconds':>8} {'img/s':>7} {'generate busy':>14} "
+          f"{'prepare busy':>13} {'GPU util':>9}")
+    baseline = None
+    for pipelined in (False, True):
+        with _GpuSampler() as sampler:
+            elapsed, stats = asyncio.run(_run_pipeline(assessor, corpus, args, pipelined))
+        throughput = len(corpus) / elapsed
+        baseline = baseline or throughput
+        gpu = sampler.mean()
+        print(f"{'on' if pipelined else 'off':>9} {len(corpus):>7} {elapsed:>8.2f} {throughput:>7.2f} "
+              f"{stats['utilisation']['generate']:>14.0%} {stats['utilisation']['prepare']:>13.0%} "
+              f"{'-' if gpu is None else f'{gpu:.0f}%':>9}  ({throughput / baseline:.2f}x)")
+
+
+def _image_files(folder):
+    extensions = (".jpg", ".jpeg", ".png", ".webp")
+    return sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(extensions)
+    )
+
+
+def bench_resolution(assessor, args):
+    """Image tokens, latency and score drift of each resolution mode over a local image set"""
+    images = _image_files(args.images)
+    if not images:
+        raise SystemExit(f"No images found in {args.images}")
+    # Optional {"file name": expected score} ground truth
+    labels = {}
+    if args.labels:
+        with open(args.labels) as handle:
+            labels = json.load(handle)
+
+    assessor.assess_damage(SAMPLE_HEADING, SAMPLE_DESCRIPTION, images[0])
+
+    scores_by_mode = {}
+    print(f"{'mode':>10} {'image tokens':>13} {'mean s':>8} {'img/s':>7} {'drift vs full':>14} {'label MAE':>10}")
+    for mode in args.modes:
+        tokens, latencies, scores = [], [], []
+        for image in images:
+            start = time.perf_counter()
+            result = assessor.assess_batch([(SAMPLE_HEADING, SAMPLE_DESCRIPTION, image)], resolution_mode=mode)[0]
+            latencies.append(time.perf_counter() - start)
+            tokens.append(result.get("image_tokens", 0))
+            scores.append(result.get("priority_score", 0))
+        scores_by_mode[mode] = scores
+
+        full_scores = scores_by_mode.get("full")
+        drift = statistics.mean(abs(a - b) for a, b in zip(scores, full_scores)) if full_scores else None
+        labelled = [(score, labels[os.path.basename(image)]) for score, image in zip(scores, images)
+                    if os.path.basename(image) in labels]
+        mae = statistics.mean(abs(score - label) for score, label in labelled) if labelled else None
+
+        mean_latency = statistics.mean(latencies)
+        print(f"{mode:>10} {statistics.mean(tokens):>13.0f} {mean_latency:>8.2f} {1 / mean_latency:>7.2f}"
+              f" {'-' if drift is None else f'{drift:.1f}':>14} {'-' if mae is None else f'{mae:.1f}':>10}")
+
+
+def bench_prefix(assessor, args):
+    """Time to first token with and without the cached shared prompt prefix"""
+    request = [(SAMPLE_HEADING, SAMPLE_DESCRIPTION, args.image)]
+    if assessor._prefix_cache is None:
+        assessor._build_prefix_cache()
+    if assessor._prefix_cache is None:
+        raise SystemExit("No shared prompt prefix to cache with this model's chat template")
+
+    print(f"{'prefix cache':>12} {'batch':>6} {'median TTFT s':>14} {'p90 TTFT s':>11}")
+    for batch_size in args.batch_sizes:
+        for use_prefix_cache in (False, True):
+            assessor.use_prefix_cache = use_prefix_cache
+            # One new token makes the generate call almost pure prefill
+            assessor.assess_batch(request * batch_size, max_new_tokens=1)
+            timings = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                assessor.assess_batch(request * batch_size, max_new_tokens=1)
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            print(f"{'on' if use_prefix_cache else 'off':>12} {batch_size:>6} {statistics.median(timings):>14.3f}"
+                  f" {timings[int(0.9 * (len(timings) - 1))]:>11.3f}")
+
+
+def bench_output(assessor, args):
+    """Latency and generated tokens per request for free-form versus JSON-constrained output"""
+    images = _image_files(args.images)
+    if not images:
+        raise SystemExit(f"No images found in {args.images}")
+
+    print(f"{'mode':>6} {'mean s':>8} {'p90 s':>7} {'tokens mean':>12} {'tokens max':>11} {'default 50s':>12}")
+    for output_mode in OUTPUT_MODES:
+        assessor.assess_batch([(SAMPLE_HEADING, SAMPLE_DESCRIPTION, images[0])], output_mode=output_mode)
+        latencies, tokens, fallbacks = [], [], 0
+        for image in images:
+            start = time.perf_counter()
+            result = assessor.assess_batch([(SAMPLE_HEADING, SAMPLE_DESCRIPTION, image)], output_mode=output_mode)[0]
+            latencies.append(time.perf_counter() - start)
+            tokens.append(result.get("generated_tokens", 0))
+            # A bare 50 is what the regex fallback returns when it finds nothing
+            fallbacks += result.get("priority_score") == 50
+        latencies.sort()
+        print(f"{output_mode:>6} {statistics.mean(latencies):>8.2f} {latencies[int(0.9 * (len(latencies) - 1))]:>7.2f}"
+              f" {statistics.mean(tokens):>12.1f} {max(tokens):>11} {fallbacks:>12}")
+
+
+def bench_decode(assessor, args):
+    """Decode speed, speculative acceptance and score agreement of the decode modes"""
+    corpus = _load_corpus(args)
+    modes = [mode for mode in args.modes if mode != "assisted" or assessor.draft_model is not None]
+    if len(modes) < len(args.modes):
+        print("Skipping assisted: no --draft-model-path")
+
+    rows = {}
+    for mode in modes:
+        assessor.decode_mode = mode
+        assessor.assess_batch([corpus[0]], max_new_tokens=args.max_new_tokens)
+        latencies, decode_seconds, tokens, drafted, accepted, scores = [], 0.0, 0, 0, 0, []
+        for item in corpus:
+            start = time.perf_counter()
+            result = assessor.assess_batch([item], max_new_tokens=args.max_new_tokens)[0]
+            latencies.append(time.perf_counter() - start)
+            timings = assessor.last_generation_timings
+            decode_seconds += timings["decode"] or 0
+            tokens += sum(timings["generated_tokens"])
+            drafted += timings.get("draft_tokens") or 0
+            accepted += timings.get("accepted_tokens") or 0
+            scores.append(result.get("priority_score"))
+        rows[mode] = {
+            "latency": statistics.mean(latencies),
+            "tokens_per_second": tokens / decode_seconds if decode_seconds else 0,
+            "acceptance": accepted / drafted if drafted else None,
+            "scores": scores,
+        }
+
+    # Speculative modes are checked against plain greedy, which they should reproduce exactly
+    reference = rows.get("greedy") or rows[modes[0]]
+    baseline_speed = rows[modes[0]]["tokens_per_second"]
+    print(f"{'mode':>14} {'mean s':>8} {'decode tok/s':>13} {'speed-up':>9} {'acceptance':>11} {'same scores':>12}")
+    for mode, row in rows.items():
+        same = sum(score == expected for score, expected in zip(row["scores"], reference["scores"]))
+        acceptance = f"{row['acceptance']:.0%}" if row["acceptance"] is not None else "-"
+        speedup = row["tokens_per_second"] / baseline_speed if baseline_speed else 0
+        print(f"{mode:>14} {row['latency']:>8.2f} {row['tokens_per_second']:>13.1f} {speedup:>8.2f}x"
+              f" {acceptance:>11} {same:>5}/{len(corpus):<6}")
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[int(fraction * (len(ordered) - 1))]
+
+
+def _summary(values):
+    return {
+        "count": len(values),
+        "mean": round(statistics.mean(values), 6),
+        "p50": round(_percentile(values, 0.5), 6),
+        "p90": round(_percentile(values, 0.9), 6),
+        "p99": round(_percentile(values, 0.99), 6),
+        "max": round(max(values), 6),
+    }
+
+
+def _rss_high_water_mb():
+    """Peak resident memory of this process so far, None where the OS does not report it"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / 2**20 if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def _phone_photos(count, megapixels, seed):
+    """Noisy JPEGs of phone-camera size, every other one stored sideways with an EXIF rotation"""
+    rng = random.Random(seed)
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    photos = []
+    for index in range(count):
+        # Noise upscaled a little keeps the JPEG realistically large without taking ages to generate
+        noise = Image.effect_noise((width // 8, height // 8), 64).convert("RGB").resize((width, height))
+        draw = ImageDraw.Draw(noise)
+        for _ in range(20):
+            x, y = rng.randrange(width), rng.randrange(height)
+            draw.rectangle((x, y, x + width // 6, y + height // 6), fill=tuple(rng.randrange(256) for _ in range(3)))
+        exif = Image.Exif()
+        if index % 2:
+            exif[0x0112] = 6
+        buffer = io.BytesIO()
+        noise.save(buffer, format="JPEG", quality=90, exif=exif)
+        photos.append(buffer.getvalue())
+    return photos
+
+
+def _measure_image_decode(job):
+    """Decode one image; runs in a fresh process so the peak RSS increase belongs to this decode alone"""
+    loader, source, pinpoints, max_side = job
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+    cpu_started, started = time.process_time(), time.perf_counter()
+    if loader == "current":
+        image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source).convert("RGB")
+    else:
+        image = decode_image(source, pinpoints, max_side)
+    cpu, wall = time.process_time() - cpu_started, time.perf_counter() - started
+    peak = None
+    if resource:
+        # Kilobytes on Linux, bytes on macOS
+        peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / (2**20 if sys.platform == "darwin" else 1024)
+    return cpu, wall, peak, image.size
+
+
+def bench_image_decode(assessor, args):
+    """CPU time and peak RSS per image: full decode + convert versus draft decode"""
+    if args.images:
+        sources = _image_files(args.images)
+        if not sources:
+            raise SystemExit(f"No images found in {args.images}")
+    else:
+        sources = _phone_photos(args.count, args.megapixels, args.seed)
+    mode = assessor.resolution_mode
+    max_side = {"max_side": assessor.max_image_side, "triage": assessor._tile_size()}.get(mode)
+    pinpoints = assessor._grid_pinpoints_for(mode)
+
+    # One process per decode, forked where possible so no model or torch import is repeated
+    context = multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn")
+    print(f"{len(sources)} images, resolution mode {mode}")
+    print(f"{'loader':>8} {'cpu ms':>8} {'wall ms p90':>12} {'peak RSS MB':>12} {'decoded MP':>11}")
+    for loader in ("current", "draft"):
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            rows = pool.map(_measure_image_decode, [(loader, source, pinpoints, max_side) for source in sources])
+        cpu = [row[0] for row in rows]
+        wall = sorted(row[1] for row in rows)
+        peaks = [row[2] for row in rows if row[2] is not None]
+        decoded = [row[3][0] * row[3][1] / 1e6 for row in rows]
+        peak = f"{statistics.mean(peaks):>12.1f}" if peaks else f"{'-':>12}"
+        print(f"{loader:>8} {statistics.mean(cpu) * 1000:>8.1f} {_percentile(wall, 0.9) * 1000:>12.1f} {peak}"
+              f" {statistics.mean(decoded):>11.2f}")
+
+
+class _StageRecorder:
+    """Wall time and memory high-water marks per pipeline stage"""
+
+    def __init__(self):
+        self.times = {}
+        self.rss_high_water = {}
+        self.rss_growth = {}
+        self.gpu_peak = {}
+
+    def run(self, stage, function, *args):
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        rss_before = _rss_high_water_mb()
+        start = time.perf_counter()
+        result = function(*args)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+            self.gpu_peak[stage] = max(self.gpu_peak.get(stage, 0), round(torch.cuda.max_memory_allocated() / 2**20, 1))
+        self.record(stage, time.perf_counter() - start)
+        rss_after = _rss_high_water_mb()
+        if rss_after is not None:
+            self.rss_high_water[stage] = max(self.rss_high_water.get(stage, 0), rss_after)
+            # How much this stage pushed the process high-water mark up
+            self.rss_growth[stage] = round(self.rss_growth.get(stage, 0) + rss_after - rss_before, 1)
+        return result
+
+    def record(self, stage, seconds):
+        self.times.setdefault(stage, []).append(seconds)
+
+    def report(self):
+        return {
+            stage: {
+                **_summary(times),
+                "rss_high_water_mb": self.rss_high_water.get(stage),
+                "rss_growth_mb": self.rss_growth.get(stage),
+                "gpu_peak_mb": self.gpu_peak.get(stage),
+            }
+            for stage, times in self.times.items()
+        }
+
+
+def _synthetic_corpus(count, seed):
+    """JPEG-encoded street-like scenes of varied size, so decode and anyres tiling vary too"""
+    rng = random.Random(seed)
+    sizes = [(640, 480), (1024, 768), (1280, 960), (720, 1280), (2048, 1536)]
+    corpus = []
+    for index in range(count):
+        width, height = sizes[index % len(sizes)]
+        image = Image.new("RGB", (width, height), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(40):
+            x, y = rng.randrange(width), rng.randrange(height)
+            draw.rectangle(
+                (x, y, x + rng.randrange(width // 4), y + rng.randrange(height // 4)),
+                fill=tuple(rng.randrange(256) for _ in range(3)),
+            )
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=85)
+        corpus.append((f"synthetic {index}", SAMPLE_DESCRIPTION, buffer.getvalue()))
+    return corpus
+
+
+def _load_corpus(args):
+    """(heading, description, image) triples from a folder, or synthetic ones"""
+    if not args.corpus:
+        return _synthetic_corpus(args.synthetic, args.seed)
+    images = _image_files(args.corpus)
+    if not images:
+        raise SystemExit(f"No images found in {args.corpus}")
+    # Optional {"file name": {"heading": ..., "description": ...}} next to the images
+    reports = {}
+    reports_path = os.path.join(args.corpus, "reports.json")
+    if os.path.exists(reports_path):
+        with open(reports_path) as handle:
+            reports = json.load(handle)
+    corpus = []
+    for image in images:
+        report = reports.get(os.path.basename(image), {})
+        corpus.append((report.get("heading", SAMPLE_HEADING), report.get("description", SAMPLE_DESCRIPTION), image))
+    return corpus
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(assessor, args):
+    """Per-stage latency percentiles, throughput and peak memory over a corpus, written as JSON"""
+    corpus = _load_corpus(args)
+    mode = assessor.resolution_mode
+    output_mode = assessor.output_mode
+    batches = [corpus[start:start + args.batch_size] for start in range(0, len(corpus), args.batch_size)]
+
+    # Warm-up, not recorded
+    assessor.assess_batch(batches[0], max_new_tokens=args.max_new_tokens)
+
+    recorder = _StageRecorder()
+    prompt_tokens, image_tokens, generated_tokens, decode_rates = [], [], [], []
+    for _ in range(args.runs):
+        for batch in batches:
+            start = time.perf_counter()
+            prepared = []
+            # Stages run one after another here so each one's cost is attributed to it alone
+            for heading, description, source in batch:
+                image = recorder.run("decode", assessor._load_image, source, mode)
+                image = recorder.run("resize", assessor._fit_image, image, mode)
+                prepared.append(recorder.run(
+                    "preprocess", assessor.prepare_inputs, heading, description, image, output_mode
+                ))
+            collated = recorder.run("collate", assessor.collate_inputs, prepared)
+            answers = recorder.run("generate", assessor._generate, collated, mode, args.max_new_tokens, output_mode)
+            recorder.record("batch", time.perf_counter() - start)
+
+            timings = assessor.last_generation_timings or {}
+            if timings.get("prefill") is not None:
+                recorder.record("prefill", timings["prefill"])
+                recorder.record("decode_tokens", timings["decode"])
+                if timings["decode"] > 0:
+                    decode_rates.append(sum(timings["generated_tokens"]) / timings["decode"])
+            prompt_tokens += timings.get("prompt_tokens", [])
+            generated_tokens += [count for _, count in answers]
+            image_tokens += [assessor.count_image_tokens(inputs) for inputs in prepared]
+
+    # End-to-end throughput through the production path, thread pool included
+    start = time.perf_counter()
+    for _ in range(args.runs):
+        for batch in batches:
+            assessor.assess_batch(batch, max_new_tokens=args.max_new_tokens)
+    elapsed = time.perf_counter() - start
+
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "model": "tiny" if args.tiny else assessor.model_id,
+            "device": str(assessor.model.device),
+            "backend": assessor.backend.name,
+            "decode_mode": assessor.decode_mode,
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "images": len(corpus),
+            "runs": args.runs,
+            "batch_size": args.batch_size,
+            "max_new_tokens": args.max_new_tokens,
+            "resolution_mode": mode,
+            "output_mode": output_mode,
+            "prefix_cache": assessor.use_prefix_cache,
+        },
+        "stages": recorder.report(),
+        "tokens": {
+            "prompt_mean": round(statistics.mean(prompt_tokens), 1) if prompt_tokens else None,
+            "image_mean": round(statistics.mean(image_tokens), 1),
+            "generated_mean": round(statistics.mean(generated_tokens), 1),
+            "decode_tokens_per_second_mean": round(statistics.mean(decode_rates), 2) if decode_rates else None,
+        },
+        "throughput": {
+            "images_per_second": round(len(corpus) * args.runs / elapsed, 3),
+            "seconds": round(elapsed, 3),
+        },
+        "peak_memory": {
+            "rss_mb": _rss_high_water_mb(),
+            "gpu_mb": round(torch.cuda.max_memory_allocated() / 2**20, 1) if torch.cuda.is_available() else None,
+        },
+    }
+
+    print(f"{'stage':>14} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'rss +MB':>8}")
+    for stage, summary in results["stages"].items():
+        print(f"{stage:>14} {summary['p50'] * 1000:>9.1f} {summary['p90'] * 1000:>9.1f} {summary['p99'] * 1000:>9.1f}"
+              f" {'-' if summary['rss_growth_mb'] is None else summary['rss_growth_mb']:>8}")
+    print(f"throughput: {results['throughput']['images_per_second']} images/s, "
+          f"peak RSS {results['peak_memory']['rss_mb']} MB")
+
+    # No result file for the comparisons of a broken run
+    _exit_on_failures(args.errors)
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+        print(f"Wrote {args.output}")
+
+
+def compare_results(args):
+    """Print stage-by-stage changes between two suite result files; exit 1 on a regression"""
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)
+    with open(args.candidate) as handle:
+        candidate = json.load(handle)
+
+    def change(before, after):
+        return (after - before) / before if before else 0.0
+
+    regressions = []
+    print(f"baseline {baseline['meta'].get('commit')} vs candidate {candidate['meta'].get('commit')}")
+    print(f"{'stage':>14} {'p50 before':>11} {'p50 after':>10} {'change':>8} {'p90 change':>11}")
+    for stage, before in baseline["stages"].items():
+        after = candidate["stages"].get(stage)
+        if after is None:
+            continue
+        p50_change = change(before["p50"], after["p50"])
+        p90_change = change(before["p90"], after["p90"])
+        flag = ""
+        if p50_change > args.threshold:
+            regressions.append(stage)
+            flag = "  REGRESSION"
+        print(f"{stage:>14} {before['p50'] * 1000:>9.1f}ms {after['p50'] * 1000:>8.1f}ms {p50_change:>+8.1%}"
+              f" {p90_change:>+11.1%}{flag}")
+
+    throughput_change = change(baseline["throughput"]["images_per_second"], candidate["throughput"]["images_per_second"])
+    print(f"throughput change: {throughput_change:+.1%}")
+    if -throughput_change > args.threshold:
+        regressions.append("throughput")
+    if regressions:
+        print(f"Regressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Damage assessment benchmarks")
+    parser.add_argument("--model-path", default=os.getenv("MODEL_PATH", r"C:\Users\samas\llava-v1.6-mistral-7b-hf"))
+    parser.add_argument("--tiny", action="store_true", help="Use a tiny random CPU model instead of the real one")
+    parser.add_argument("--resolution-mode", choices=RESOLUTION_MODES, default="full")
+    parser.add_argument("--output-mode", choices=OUTPUT_MODES, default="free")
+    parser.add_argument("--no-prefix-cache", action="store_true")
+    parser.add_argument("--decode-mode", choices=DECODE_MODES, default="sample")
+    parser.add_argument("--draft-model-path", help="Small causal LM for assisted decoding")
+    parser.add_argument("--backend", choices=BACKENDS, help="Inference backend, auto for the real model by default")
+    parser.add_argument("--cpu-threads", type=int, default=0, help="Threads of the CPU backends, 0 for one per core")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    batching = subparsers.add_parser("batching", help="Micro-batching throughput under a burst of reports")
+    batching.add_argument("--image", required=True, help="Local path of a sample damage photo")
+    batching.add_argument("--requests", type=int, default=16)
+    batching.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    batching.add_argument("--wait-ms", type=int, default=50)
+
+    resolution = subparsers.add_parser("resolution", help="Accuracy/latency trade-off of the resolution modes")
+    resolution.add_argument("--images", required=True, help="Folder of local damage photos")
+    resolution.add_argument("--labels", help="JSON file mapping image file names to expected scores")
+    resolution.add_argument("--modes", nargs="+", choices=RESOLUTION_MODES, default=list(RESOLUTION_MODES))
+
+    prefix = subparsers.add_parser("prefix", help="Time to first token with and without the prefix KV cache")
+    prefix.add_argument("--image", required=True, help="Local path of a sample damage photo")
+    prefix.add_argument("--runs", type=int, default=10)
+    prefix.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4])
+
+    output = subparsers.add_parser("output", help="Free-form versus JSON-constrained output cost")
+    output.add_argument("--images", required=True, help="Folder of local damage photos")
+
+    decode = subparsers.add_parser("decode", help="Sampling versus greedy and speculative decoding")
+    decode.add_argument("--corpus", help="Folder of images, optionally with reports.json; synthetic if omitted")
+    decode.add_argument("--synthetic", type=int, default=8, help="Number of synthetic images without --corpus")
+    decode.add_argument("--modes", nargs="+", choices=DECODE_MODES, default=list(DECODE_MODES))
+    decode.add_argument("--max-new-tokens", type=int, default=350)
+    decode.add_argument("--seed", type=int, default=0)
+
+    pipeline = subparsers.add_parser("pipeline", help="Throughput and utilisation with and without pipelining")
+    pipeline.add_argument("--corpus", help="Folder of images, optionally with reports.json; synthetic if omitted")
+    pipeline.add_argument("--synthetic", type=int, default=32, help="Number of synthetic images without --corpus")
+    pipeline.add_argument("--batch-size", type=int, default=4)
+    pipeline.add_argument("--wait-ms", type=int, default=50)
+    pipeline.add_argument("--prefetch-batches", type=int, default=2)
+    pipeline.add_argument("--queue-size", type=int, default=64)
+    pipeline.add_argument("--download-ms", type=int, default=0, help="Simulated download latency per image")
+    pipeline.add_argument("--connections", type=int, default=8, help="Concurrent simulated downloads")
+    pipeline.add_argument("--seed", type=int, default=0)
+
+    suite = subparsers.add_parser("suite", help="Per-stage latency, throughput and memory, saved as JSON")
+    suite.add_argument("--corpus", help="Folder of images, optionally with reports.json; synthetic if omitted")
+    suite.add_argument("--synthetic", type=int, default=16, help="Number of synthetic images without --corpus")
+    suite.add_argument("--batch-size", type=int, default=4)
+    suite.add_argument("--runs", type=int, default=3)
+    suite.add_argument("--max-new-tokens", type=int, default=64)
+    suite.add_argument("--seed", type=int, default=0)
+    suite.add_argument("--output", help="Write the results to this JSON file")
+
+    image_decode = subparsers.add_parser("image-decode", help="CPU time and peak RSS of image decoding, "
+                                                              "needs only the processor files")
+    image_decode.add_argument("--images", help="Folder of photos; synthetic phone photos if omitted")
+    image_decode.add_argument("--count", type=int, default=8)
+    image_decode.add_argument("--megapixels", type=float, default=12)
+    image_decode.add_argument("--seed", type=int, default=0)
+
+    compare = subparsers.add_parser("compare", help="Compare two suite result files")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    compare.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown counted as a regression")
+
+    args = parser.parse_args()
+    if args.benchmark == "compare":
+        compare_results(args)
+        return
+
+    options = dict(
+        resolution_mode=args.resolution_mode,
+        output_mode=args.output_mode,
+        use_prefix_cache=not args.no_prefix_cache,
+        cpu_threads=args.cpu_threads,
+        decode_mode=args.decode_mode,
+        draft_model_path=args.draft_model_path,
+    )
+    if args.backend:
+        options["backend"] = args.backend
+    if args.tiny:
+        from tiny_model import build_tiny_assessor
+        assessor = build_tiny_assessor(**options)
+    else:
+        options.setdefault("backend", "auto")
+        # Image decoding only needs the processor's grid list
+        assessor = InfrastructureDamageAssessor(args.model_path, load_model=args.benchmark != "image-decode", **options)
+    args.errors = _record_failures(assessor)
+
+    if args.benchmark == "batching":
+        bench_batching(assessor, args)
+    elif args.benchmark == "resolution":
+        bench_resolution(assessor, args)
+    elif args.benchmark == "prefix":
+        bench_prefix(assessor, args)
+    elif args.benchmark == "output":
+        bench_output(assessor, args)
+    elif args.benchmark == "decode":
+        bench_decode(assessor, args)
+    elif args.benchmark == "image-decode":
+        bench_image_decode(assessor, args)
+    elif args.benchmark == "pipeline":
+        bench_pipeline(assessor, args)
+    elif args.benchmark == "suite":
+        bench_suite(assessor, args)
+    _exit_on_failures(args.errors)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Backend settings, read from the environment (see backend/.env)"""
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+# PostgREST endpoint of the issues table; point it at a local PostgREST to test without Supabase
+SUPABASE_REST_URL = os.getenv("SUPABASE_REST_URL") or f"{(SUPABASE_URL or '').rstrip('/')}/rest/v1"
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "20"))
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "10"))
+# Above zero, final assessment writes arriving within this window go out as one bulk upsert
+DB_WRITE_COALESCE_MS = int(os.getenv("DB_WRITE_COALESCE_MS", "0"))
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "50"))
+# Local folder holding the llava-v1.6-mistral-7b-hf weights
+MODEL_PATH = os.getenv("MODEL_PATH", r"C:\Users\samas\llava-v1.6-mistral-7b-hf")
+# Run one short generate after loading so the first real request doesn't pay for kernel setup
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+# How the model runs: auto, cuda-bnb (4-bit on GPU), cpu-int8 (dynamic int8 on CPU) or onnx
+# (cpu-int8 with the vision tower on ONNX Runtime, exported once into INFERENCE_ONNX_DIR)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "auto")
+# CPU backends: torch/ONNX Runtime threads, 0 means one per physical core
+INFERENCE_CPU_THREADS = int(os.getenv("INFERENCE_CPU_THREADS", "0"))
+INFERENCE_ONNX_DIR = os.getenv("INFERENCE_ONNX_DIR", "onnx_cache")
+# Requests arriving within the wait window share one generate call
+ASSESS_BATCH_SIZE = int(os.getenv("ASSESS_BATCH_SIZE", "4"))
+ASSESS_BATCH_WAIT_MS = int(os.getenv("ASSESS_BATCH_WAIT_MS", "50"))
+# Preprocess the next batches while the current one generates, with up to ASSESS_PREFETCH_BATCHES
+# ready ahead; ASSESS_QUEUE_SIZE bounds the requests waiting for a batch (0 = unbounded)
+ASSESS_PIPELINE = os.getenv("ASSESS_PIPELINE", "true").lower() == "true"
+ASSESS_PREFETCH_BATCHES = int(os.getenv("ASSESS_PREFETCH_BATCHES", "2"))
+ASSESS_QUEUE_SIZE = int(os.getenv("ASSESS_QUEUE_SIZE", "64"))
+# Load-adaptive quality tiers (full, short, score_only): a tier is entered when the queued and running
+# jobs reach its depth or the p90 assessment latency reaches its seconds, and left once both are
+# below the recovery ratio of those and it has been held for the dwell time
+ASSESS_DEGRADE = os.getenv("ASSESS_DEGRADE", "false").lower() == "true"
+ASSESS_DEGRADE_QUEUE_DEPTHS = [int(value) for value in os.getenv("ASSESS_DEGRADE_QUEUE_DEPTHS", "20,60").split(",")]
+ASSESS_DEGRADE_LATENCY_SECONDS = [
+    float(value) for value in os.getenv("ASSESS_DEGRADE_LATENCY_SECONDS", "60,180").split(",")
+]
+ASSESS_DEGRADE_RECOVERY_RATIO = float(os.getenv("ASSESS_DEGRADE_RECOVERY_RATIO", "0.5"))
+ASSESS_DEGRADE_MIN_DWELL_SECONDS = float(os.getenv("ASSESS_DEGRADE_MIN_DWELL_SECONDS", "30"))
+# Image resolution budget before the processor: full, max_side, max_tiles or triage
+ASSESS_RESOLUTION_MODE = os.getenv("ASSESS_RESOLUTION_MODE", "full")
+ASSESS_MAX_IMAGE_SIDE = int(os.getenv("ASSESS_MAX_IMAGE_SIDE", "1008"))
+ASSESS_MAX_GRID_TILES = int(os.getenv("ASSESS_MAX_GRID_TILES", "4"))
+# Decode JPEGs straight at the resolution the processor needs; larger images than the pixel cap are refused
+ASSESS_DRAFT_DECODE = os.getenv("ASSESS_DRAFT_DECODE", "true").lower() == "true"
+ASSESS_MAX_IMAGE_PIXELS = int(os.getenv("ASSESS_MAX_IMAGE_PIXELS", "64000000"))
+# Freed image memory blocks kept for reuse by the next decode
+IMAGE_DECODE_BUFFER_BLOCKS = int(os.getenv("IMAGE_DECODE_BUFFER_BLOCKS", "8"))
+# Reuse the KV cache of the shared instruction prompt instead of prefilling it per request
+ASSESS_PREFIX_CACHE = os.getenv("ASSESS_PREFIX_CACHE", "true").lower() == "true"
+# Output format: free (regex-parsed text) or json (constrained decoding, stops at the closing brace)
+ASSESS_OUTPUT_MODE = os.getenv("ASSESS_OUTPUT_MODE", "free")
+ASSESS_JSON_REASONING_TOKENS = int(os.getenv("ASSESS_JSON_REASONING_TOKENS", "96"))
+# Token selection: sample, greedy, prompt_lookup or assisted (greedy with drafts from ASSESS_DRAFT_MODEL_PATH)
+ASSESS_DECODE_MODE = os.getenv("ASSESS_DECODE_MODE", "sample")
+ASSESS_DRAFT_MODEL_PATH = os.getenv("ASSESS_DRAFT_MODEL_PATH") or None
+ASSESS_PROMPT_LOOKUP_TOKENS = int(os.getenv("ASSESS_PROMPT_LOOKUP_TOKENS", "10"))
+# CLIP zero-shot triage before the full model, e.g. openai/clip-vit-base-patch32; empty turns it off.
+# Images at least TRIAGE_THRESHOLD likely to be unrelated or fake are scored 0 without the 7B model
+TRIAGE_MODEL_PATH = os.getenv("TRIAGE_MODEL_PATH", "")
+TRIAGE_THRESHOLD = float(os.getenv("TRIAGE_THRESHOLD", "0.85"))
+# Every image of an issue is scored (up to the cap) and combined with this rule: max, mean or weighted_mean
+MAX_IMAGES_PER_ISSUE = int(os.getenv("MAX_IMAGES_PER_ISSUE", "4"))
+MULTI_IMAGE_COMBINE = os.getenv("MULTI_IMAGE_COMBINE", "max")
+# Pooled image downloads from the storage host
+IMAGE_FETCH_MAX_CONNECTIONS = int(os.getenv("IMAGE_FETCH_MAX_CONNECTIONS", "32"))
+IMAGE_FETCH_MAX_PER_HOST = int(os.getenv("IMAGE_FETCH_MAX_PER_HOST", "8"))
+IMAGE_FETCH_MAX_BYTES = int(os.getenv("IMAGE_FETCH_MAX_BYTES", str(20 * 1024 * 1024)))
+IMAGE_FETCH_CONNECT_TIMEOUT = float(os.getenv("IMAGE_FETCH_CONNECT_TIMEOUT", "3"))
+IMAGE_FETCH_READ_TIMEOUT = float(os.getenv("IMAGE_FETCH_READ_TIMEOUT", "20"))
+# Results of identical image + text submissions are reused instead of regenerated
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "assessment_cache.sqlite3")
+RESULT_CACHE_MEMORY_ENTRIES = int(os.getenv("RESULT_CACHE_MEMORY_ENTRIES", "1024"))
+RESULT_CACHE_MAX_MB = int(os.getenv("RESULT_CACHE_MAX_MB", "256"))
+# Photos of an already assessed incident (within this many differing hash bits) reuse its score
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_INDEX_PATH = os.getenv("DEDUP_INDEX_PATH", "near_duplicates.bin")
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "6"))
+DEDUP_SAVE_EVERY = int(os.getenv("DEDUP_SAVE_EVERY", "100"))
+# Durable assessment queue; beyond JOB_QUEUE_MAX_PENDING new work is refused with 503 + Retry-After
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "assessment_jobs.sqlite3")
+JOB_QUEUE_CONCURRENCY = int(os.getenv("JOB_QUEUE_CONCURRENCY", "8"))
+JOB_QUEUE_MAX_PENDING = int(os.getenv("JOB_QUEUE_MAX_PENDING", "500"))
+JOB_QUEUE_MAX_ATTEMPTS = int(os.getenv("JOB_QUEUE_MAX_ATTEMPTS", "3"))
+JOB_QUEUE_RETRY_BASE_SECONDS = float(os.getenv("JOB_QUEUE_RETRY_BASE_SECONDS", "5"))
+# A running job whose process stops renewing its lease this long is re-queued by any process sharing the file
+JOB_QUEUE_LEASE_SECONDS = float(os.getenv("JOB_QUEUE_LEASE_SECONDS", "60"))
+# Jobs run earliest deadline first; deadline = enqueue time + seconds of the job's priority class
+JOB_QUEUE_DEADLINES = {
+    priority: float(seconds)
+    for priority, seconds in (
+        item.split(":") for item in os.getenv("JOB_QUEUE_DEADLINES", "critical:10,high:60,normal:600,low:3600").split(",")
+    )
+}
+# Urgency estimate at enqueue: this many reports within the radius during the window raise the class
+URGENCY_CLUSTER_RADIUS_M = float(os.getenv("URGENCY_CLUSTER_RADIUS_M", "250"))
+URGENCY_CLUSTER_SIZE = int(os.getenv("URGENCY_CLUSTER_SIZE", "3"))
+URGENCY_CLUSTER_WINDOW_SECONDS = float(os.getenv("URGENCY_CLUSTER_WINDOW_SECONDS", "86400"))
+# In-memory status of recently seen issues; older entries are re-read from the database
+STATUS_CACHE_TTL_SECONDS = float(os.getenv("STATUS_CACHE_TTL_SECONDS", "300"))
+# Queued/Processing may change in another process, so those entries are re-read much sooner
+STATUS_CACHE_PENDING_TTL_SECONDS = float(os.getenv("STATUS_CACHE_PENDING_TTL_SECONDS", "5"))
+STATUS_CACHE_MAX_ENTRIES = int(os.getenv("STATUS_CACHE_MAX_ENTRIES", "10000"))
+STATUS_EVENTS_KEEPALIVE_SECONDS = float(os.getenv("STATUS_EVENTS_KEEPALIVE_SECONDS", "15"))
+# Most issue ids accepted by one POST /assess-issues call
+MAX_BULK_ISSUES = int(os.getenv("MAX_BULK_ISSUES", "200"))
+# Out-of-process inference: comma separated host:port list of inference_server.py workers.
+# Empty keeps the model inside the API process.
+INFERENCE_WORKERS = [address.strip() for address in os.getenv("INFERENCE_WORKERS", "").split(",") if address.strip()]
+# Shared secret of the worker connections, which carry pickles; required with workers, no default
+INFERENCE_AUTHKEY = os.getenv("INFERENCE_AUTHKEY", "")
+INFERENCE_WORKER_COUNT = int(os.getenv("INFERENCE_WORKER_COUNT", "1"))
+INFERENCE_BASE_PORT = int(os.getenv("INFERENCE_BASE_PORT", "8601"))
+
+
+def require_inference_authkey():
+    """Refuse to use inference workers without a secret: whoever can connect to them can run code"""
+    if not INFERENCE_AUTHKEY:
+        raise RuntimeError("INFERENCE_AUTHKEY must be set to a long random secret to use inference workers")
+
+
+def assessor_options():
+    """Keyword arguments for InfrastructureDamageAssessor shared by the API and inference workers"""
+    return dict(
+        model_path=MODEL_PATH,
+        resolution_mode=ASSESS_RESOLUTION_MODE,
+        max_image_side=ASSESS_MAX_IMAGE_SIDE,
+        max_grid_tiles=ASSESS_MAX_GRID_TILES,
+        draft_decode=ASSESS_DRAFT_DECODE,
+        max_image_pixels=ASSESS_MAX_IMAGE_PIXELS,
+        decode_buffer_blocks=IMAGE_DECODE_BUFFER_BLOCKS,
+        use_prefix_cache=ASSESS_PREFIX_CACHE,
+        output_mode=ASSESS_OUTPUT_MODE,
+        json_reasoning_tokens=ASSESS_JSON_REASONING_TOKENS,
+        decode_mode=ASSESS_DECODE_MODE,
+        draft_model_path=ASSESS_DRAFT_MODEL_PATH,
+        prompt_lookup_tokens=ASSESS_PROMPT_LOOKUP_TOKENS,
+        backend=INFERENCE_BACKEND,
+        cpu_threads=INFERENCE_CPU_THREADS,
+        onnx_dir=INFERENCE_ONNX_DIR,
+    )
@@ -0,0 +1,195 @@
+import io
+import itertools
+import logging
+import os
+import struct
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+
+from PIL import Image
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+_FILE_MAGIC = b"NDX1"
+# 64-bit hash, priority score, issue UUID
+_RECORD = struct.Struct("<QB16s")
+
+
+def dhash(image, hash_size=8):
+    """Difference hash: one bit per horizontally adjacent pixel pair of a tiny grayscale thumbnail"""
+    thumbnail = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = list(thumbnail.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for column in range(hash_size):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return value
+
+
+def hash_image_bytes(image_bytes):
+    """Perceptual hash of an encoded image"""
+    image = Image.open(io.BytesIO(image_bytes))
+    # JPEG can decode at 1/8 scale directly, the hash only needs a 9x8 thumbnail
+    image.draft("L", (64, 64))
+    return dhash(image)
+
+
+class NearDuplicateIndex:
+    """Hamming-distance index over perceptual hashes of assessed images.
+
+    Uses multi-index hashing: the 64-bit hash is split into ``chunks`` substrings,
+    each with its own lookup table. Two hashes within ``max_distance`` bits must
+    agree on at least one substring to within ``max_distance // chunks`` bits, so
+    a lookup only probes a handful of buckets and checks a few candidates no
+    matter how many hashes are stored.
+
+    Several API processes may share the index file: each save first merges in
+    the hashes the others saved since, under an exclusive lock on
+    ``<path>.lock``, so no process overwrites another's work.
+    """
+
+    def __init__(self, path=None, max_distance=6, chunks=4):
+        self.path = path
+        self.max_distance = max_distance
+        self.chunks = chunks
+        self.unsaved_changes = 0
+        self._chunk_bits = HASH_BITS // chunks
+        self._chunk_mask = (1 << self._chunk_bits) - 1
+        self._probe_radius = max_distance // chunks
+        self._hashes = []
+        self._scores = []
+        self._issue_ids = []
+        self._tables = [{} for _ in range(chunks)]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def _split(self, value):
+        return [(value >> (index * self._chunk_bits)) & self._chunk_mask for index in range(self.chunks)]
+
+    def _probes(self, chunk):
+        """Every chunk value within the probe radius of chunk"""
+        yield chunk
+        for radius in range(1, self._probe_radius + 1):
+            for bits in itertools.combinations(range(self._chunk_bits), radius):
+                flipped = chunk
+                for bit in bits:
+                    flipped ^= 1 << bit
+                yield flipped
+
+    def _insert(self, value, priority_score, issue_id):
+        position = len(self._hashes)
+        self._hashes.append(value)
+        self._scores.append(priority_score)
+        self._issue_ids.append(issue_id)
+        for table, chunk in zip(self._tables, self._split(value)):
+            table.setdefault(chunk, []).append(position)
+
+    def add(self, value, priority_score, issue_id):
+        """Record the score an image hash was assessed with"""
+        with self._lock:
+            self._insert(value, priority_score, issue_id)
+            self.unsaved_changes += 1
+
+    def find(self, value, exclude_issue_id=None):
+        """Closest assessed hash within max_distance, or None"""
+        with self._lock:
+            best = None
+            seen = set()
+            for table, chunk in zip(self._tables, self._split(value)):
+                for probe in self._probes(chunk):
+                    for position in table.get(probe, ()):
+                        if position in seen:
+                            continue
+                        seen.add(position)
+                        if self._issue_ids[position] == exclude_issue_id:
+                            continue
+                        distance = (self._hashes[position] ^ value).bit_count()
+                        if distance <= self.max_distance and (best is None or distance < best[1]):
+                            best = (position, distance)
+
+            if best is None:
+                return None
+            position, distance = best
+            return {
+                "issue_id": self._issue_ids[position],
+                "priority_score": self._scores[position],
+                "distance": distance,
+            }
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock shared by every process saving to the same path"""
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", "a") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            yield
+
+    def _read(self):
+        """Records stored in the index file, None if there is no usable file"""
+        if not self.path or not os.path.exists(self.path):
+            return None
+        with open(self.path, "rb") as handle:
+            data = handle.read()
+        if data[:len(_FILE_MAGIC)] != _FILE_MAGIC:
+            logger.error(f"Ignoring {self.path}: not a near-duplicate index file")
+            return None
+        return [
+            (value, priority_score, str(uuid.UUID(bytes=issue_bytes)))
+            for value, priority_score, issue_bytes in _RECORD.iter_unpack(data[len(_FILE_MAGIC):])
+        ]
+
+    def save(self):
+        """Merge in hashes saved by other processes, then write the index atomically to its file"""
+        if not self.path:
+            return
+        with self._file_lock():
+            saved = self._read() or []
+            with self._lock:
+                known = set(zip(self._hashes, self._issue_ids))
+                merged = 0
+                for value, priority_score, issue_id in saved:
+                    if (value, issue_id) not in known:
+                        known.add((value, issue_id))
+                        self._insert(value, priority_score, issue_id)
+                        merged += 1
+                records = list(zip(self._hashes, self._scores, self._issue_ids))
+                self.unsaved_changes = 0
+
+            # A private temporary file, so concurrent saves never write into the same one
+            descriptor, temporary_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.path)), prefix=f"{os.path.basename(self.path)}.", suffix=".tmp"
+            )
+            try:
+                with os.fdopen(descriptor, "wb") as handle:
+                    handle.write(_FILE_MAGIC)
+                    for value, priority_score, issue_id in records:
+                        handle.write(_RECORD.pack(value, priority_score, uuid.UUID(issue_id).bytes))
+                os.replace(temporary_path, self.path)
+            except BaseException:
+                os.unlink(temporary_path)
+                raise
+        logger.info(f"Saved {len(records)} image hashes to {self.path} ({merged} merged from other processes)")
+
+    def load(self):
+        """Load a previously saved index, if the file exists"""
+        records = self._read()
+        if records is None:
+            return
+        with self._lock:
+            for value, priority_score, issue_id in records:
+                self._insert(value, priority_score, issue_id)
+        logger.info(f"Loaded {len(self)} image hashes from {self.path}")
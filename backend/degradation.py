@@ -0,0 +1,126 @@
+"""
+Quality tiers the assessor steps down to when it cannot keep up.
+
+During a surge every report gets the same expensive treatment (full anyres
+image, up to 350 generated tokens), so the queue grows without bound. The
+LoadController watches queue depth and recent assessment latency and moves
+batches to cheaper tiers while the pressure lasts, then back to full quality
+once it has passed. The tier used is recorded on every result.
+"""
+import time
+from collections import deque
+
+import metrics
+
+# From best to cheapest; None keeps the assessor's configured setting
+TIERS = {
+    "full": {"resolution_mode": None, "output_mode": None, "max_new_tokens": None},
+    # JSON output closes the reasoning within the token budget instead of cutting it off
+    "short": {"resolution_mode": None, "output_mode": "json", "max_new_tokens": 64},
+    # One low-resolution tile and no reasoning: JSON mode always leaves room for the
+    # score itself, so a budget of 1 leaves nothing for the reasoning
+    "score_only": {"resolution_mode": "triage", "output_mode": "json", "max_new_tokens": 1},
+}
+TIER_NAMES = tuple(TIERS)
+
+
+def lowest_tier(tiers):
+    """Cheapest of the given tier names (e.g. over the images of one issue), None if there are none"""
+    tiers = [tier for tier in tiers if tier in TIERS]
+    return max(tiers, key=TIER_NAMES.index) if tiers else None
+
+
+class LoadController:
+    """Picks the quality tier from queue depth and recent assessment latency.
+
+    Tier i is entered as soon as the depth reaches ``depth_thresholds[i - 1]``
+    or the p90 latency of the last ``window_seconds`` reaches
+    ``latency_thresholds[i - 1]``, skipping tiers if need be. Stepping back is
+    slower, one tier at a time: both signals have to fall below
+    ``recovery_ratio`` times the current tier's entry thresholds, and the tier
+    must have been held for ``min_dwell_seconds``. The gap between the two
+    keeps the tier from flapping around a threshold.
+    """
+
+    def __init__(self, depth, depth_thresholds=(20, 60), latency_thresholds=(60, 180), recovery_ratio=0.5,
+                 min_dwell_seconds=30, window_seconds=60, evaluate_interval=1.0):
+        if len(depth_thresholds) != len(TIERS) - 1 or len(latency_thresholds) != len(TIERS) - 1:
+            raise ValueError(f"Expected {len(TIERS) - 1} thresholds, one per tier below full")
+        # Callable returning the current number of waiting assessments
+        self._depth = depth
+        self.depth_thresholds = tuple(depth_thresholds)
+        self.latency_thresholds = tuple(latency_thresholds)
+        self.recovery_ratio = recovery_ratio
+        self.min_dwell_seconds = min_dwell_seconds
+        self.window_seconds = window_seconds
+        self.evaluate_interval = evaluate_interval
+        self.switches = 0
+        self._level = 0
+        self._since = time.monotonic()
+        self._evaluated = None
+        self._last_depth = 0
+        self._last_latency = 0.0
+        # (monotonic time, seconds) of recent assessments
+        self._latencies = deque(maxlen=1000)
+        self._seconds_per_tier = dict.fromkeys(TIERS, 0.0)
+        metrics.QUALITY_TIER.set(0)
+
+    def observe_latency(self, seconds):
+        """Feed the latency of one finished assessment"""
+        self._latencies.append((time.monotonic(), seconds))
+
+    def _latency_p90(self, now):
+        while self._latencies and now - self._latencies[0][0] > self.window_seconds:
+            self._latencies.popleft()
+        if not self._latencies:
+            return 0.0
+        latencies = sorted(seconds for _, seconds in self._latencies)
+        return latencies[int(0.9 * (len(latencies) - 1))]
+
+    def _switch(self, level, now):
+        self._seconds_per_tier[TIER_NAMES[self._level]] += now - self._since
+        self._level = level
+        self._since = now
+        self.switches += 1
+        metrics.QUALITY_TIER.set(level)
+        metrics.TIER_SWITCHES.inc(tier=TIER_NAMES[level])
+
+    def _evaluate(self, now):
+        depth, latency = self._depth(), self._latency_p90(now)
+        self._last_depth, self._last_latency = depth, latency
+
+        target = 0
+        for level, (depth_threshold, latency_threshold) in enumerate(
+                zip(self.depth_thresholds, self.latency_thresholds), start=1):
+            if depth >= depth_threshold or latency >= latency_threshold:
+                target = level
+        if target > self._level:
+            self._switch(target, now)
+        elif target < self._level and now - self._since >= self.min_dwell_seconds:
+            depth_threshold = self.depth_thresholds[self._level - 1] * self.recovery_ratio
+            latency_threshold = self.latency_thresholds[self._level - 1] * self.recovery_ratio
+            if depth < depth_threshold and latency < latency_threshold:
+                self._switch(self._level - 1, now)
+
+    def tier(self):
+        """Tier for the next batch, re-evaluated at most every evaluate_interval seconds"""
+        now = time.monotonic()
+        if self._evaluated is None or now - self._evaluated >= self.evaluate_interval:
+            self._evaluated = now
+            self._evaluate(now)
+        return TIER_NAMES[self._level]
+
+    def stats(self):
+        now = time.monotonic()
+        seconds_per_tier = dict(self._seconds_per_tier)
+        seconds_per_tier[TIER_NAMES[self._level]] += now - self._since
+        return {
+            "tier": TIER_NAMES[self._level],
+            "tier_seconds": round(now - self._since, 1),
+            "depth": self._last_depth,
+            "latency_p90_seconds": round(self._last_latency, 2),
+            "depth_thresholds": self.depth_thresholds,
+            "latency_thresholds": self.latency_thresholds,
+            "switches": self.switches,
+            "seconds_per_tier": {tier: round(seconds, 1) for tier, seconds in seconds_per_tier.items()},
+        }
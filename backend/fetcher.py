@@ -0,0 +1,117 @@
+import asyncio
+import logging
+from typing import List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+import metrics
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 needs the optional h2 package (pip install "httpx[http2]")
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class ImageTooLargeError(Exception):
+    """Raised when an image response exceeds the configured size cap"""
+
+
+class ImageFetcher:
+    """Async image downloader sharing one keep-alive connection pool.
+
+    Connections to the storage host are reused across assessments, so only the
+    first download pays for the TCP and TLS handshakes. Connect and read timeouts
+    are separate so an unreachable host fails fast while slow transfers still finish.
+    """
+
+    def __init__(
+        self,
+        max_connections=32,
+        max_connections_per_host=8,
+        max_bytes=20 * 1024 * 1024,
+        connect_timeout=3.0,
+        read_timeout=20.0,
+        keepalive_expiry=60.0,
+    ):
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.max_bytes = max_bytes
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive_expiry = keepalive_expiry
+        self._client = None
+        self._host_limits = {}
+        # Issues sharing an image URL download it once while it is in flight
+        self.flights = SingleFlight("download")
+
+    async def start(self):
+        """Open the shared connection pool"""
+        self._client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            follow_redirects=True,
+        )
+
+    async def close(self):
+        """Close all pooled connections"""
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.max_connections_per_host)
+        return self._host_limits[host]
+
+    async def fetch(self, url: str) -> bytes:
+        """Download one image, joining a download of the same URL already in flight"""
+        return await self.flights.do(url, self._fetch, url)
+
+    async def _fetch(self, url: str) -> bytes:
+        """Download one image, enforcing the per-host limit and the size cap"""
+        async with self._host_limit(url):
+            with metrics.STAGE_SECONDS.time(stage="download"):
+                async with self._client.stream("GET", url) as response:
+                    response.raise_for_status()
+
+                    try:
+                        declared_size = int(response.headers.get("content-length", ""))
+                    except ValueError:
+                        # Missing or malformed, the streamed byte count below still enforces the cap
+                        declared_size = None
+                    if declared_size is not None and declared_size > self.max_bytes:
+                        raise ImageTooLargeError(f"Image is {declared_size} bytes, limit is {self.max_bytes}")
+
+                    # Stream into one buffer so an oversized body is cut off early
+                    # even when the server does not declare its length
+                    buffer = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        buffer.extend(chunk)
+                        if len(buffer) > self.max_bytes:
+                            raise ImageTooLargeError(f"Image exceeds the {self.max_bytes} byte limit")
+                    return bytes(buffer)
+
+    async def fetch_many(self, urls: List[str]) -> List[Optional[bytes]]:
+        """Download several images at once; failed downloads come back as None"""
+        results = await asyncio.gather(*[self.fetch(url) for url in urls], return_exceptions=True)
+
+        images = []
+        for url, result in zip(urls, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error loading image from URL {url}: {str(result)}")
+                images.append(None)
+            else:
+                images.append(result)
+        return images
@@ -0,0 +1,93 @@
+"""
+Image decoding sized to what the processor will actually use.
+
+Phone photos are 12-50 MP, while LLaVA-Next never looks at more than its
+largest anyres grid (1008 px on the long side for llava-v1.6). For JPEGs,
+``draft`` makes libjpeg scale by 1/2, 1/4 or 1/8 inside the DCT, so those
+pixels are never decoded at all. This is the same budget the processor
+would shrink the image to, so the model sees the same picture for a fraction
+of the CPU time and memory.
+"""
+import io
+import math
+
+from PIL import Image
+
+# Images above this many pixels are refused before any pixel is decoded
+DEFAULT_MAX_PIXELS = 64_000_000
+
+_ORIENTATION_TAG = 0x0112
+# EXIF orientation -> transpose that makes the image upright
+_ORIENTATION_TRANSPOSES = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+# Orientations stored sideways, whose width and height swap once upright
+_SIDEWAYS_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def reuse_decode_buffers(blocks):
+    """Keep up to this many freed image memory blocks for the next decode instead of returning them to the OS.
+
+    Pillow allocates pixel storage in blocks; with a pool, back-to-back
+    decodes of similar photos reuse the same memory instead of paying for
+    fresh allocations and page faults every time. Process-wide.
+    """
+    Image.core.set_blocks_max(blocks)
+
+
+def required_size(size, pinpoints, max_side=None):
+    """
+    Smallest (width, height) that still covers every anyres grid the processor could choose
+
+    Args:
+        size: (width, height) of the upright image
+        pinpoints: anyres grid resolutions as [height, width] pairs
+        max_side: longest side the image will be shrunk to anyway, if any
+    """
+    width, height = size
+    scale = max(min(grid_width / width, grid_height / height) for grid_height, grid_width in pinpoints)
+    if max_side:
+        scale = min(scale, max_side / max(width, height))
+    scale = min(scale, 1.0)
+    return math.ceil(width * scale), math.ceil(height * scale)
+
+
+def decode_image(source, pinpoints=None, max_side=None, max_pixels=DEFAULT_MAX_PIXELS):
+    """
+    Decode an image upright and in RGB, JPEGs only as large as the processor needs
+
+    Args:
+        source: encoded bytes, a path or a file object
+        pinpoints: anyres grid resolutions of the current mode; None decodes at full size
+        max_side: longest side the image will be shrunk to anyway, if any
+        max_pixels: hard cap on width * height, checked before decoding
+
+    Raises:
+        Image.DecompressionBombError: the image is larger than max_pixels
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    image = Image.open(source)
+    width, height = image.size
+    if width * height > max_pixels:
+        raise Image.DecompressionBombError(f"Image is {width}x{height}, more than the {max_pixels} pixel limit")
+
+    # Reading the orientation only parses the header
+    orientation = image.getexif().get(_ORIENTATION_TAG, 1)
+    sideways = orientation in _SIDEWAYS_ORIENTATIONS
+    if pinpoints and image.format == "JPEG":
+        target = required_size((height, width) if sideways else (width, height), pinpoints, max_side)
+        # draft picks the largest DCT scaling that still yields at least this size
+        image.draft("RGB", (target[1], target[0]) if sideways else target)
+
+    image.load()
+    if orientation in _ORIENTATION_TRANSPOSES:
+        image = image.transpose(_ORIENTATION_TRANSPOSES[orientation])
+    # Already RGB (most JPEGs) is returned as is, convert would copy every pixel again
+    return image if image.mode == "RGB" else image.convert("RGB")
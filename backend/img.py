@@ -1,60 +1,267 @@
-from transformers import LlavaNextProcessor, LlavaNextForConditionalGeneration, BitsAndBytesConfig
+from transformers import AutoModelForCausalLM, AutoTokenizer, LlavaNextProcessor
 import torch
+import torch.nn.functional as F
 from PIL import Image
-import requests
 import json
 import os
 import re
+import threading
+import copy
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from structured_output import JSON_PREFILL, ScoreJsonLogitsProcessor, parse_score_json
+from transformers import LogitsProcessor, LogitsProcessorList
+import time
+import metrics
+from inference_backends import create_backend
+from image_decode import DEFAULT_MAX_PIXELS, decode_image, reuse_decode_buffers
 os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
 
+# Bump whenever the prompt or response parsing changes so cached results are not reused
+PROMPT_VERSION = "3"
+
+# Shared instructions come first in every prompt so their KV cache can be computed once
+# and reused; the image and the per-issue report follow them.
+ASSESSMENT_INSTRUCTIONS = """You are an expert infrastructure damage assessor. Analyze the image of city infrastructure damage below and provide a priority score.
+
+ASSESSMENT CRITERIA:
+- Public Safety Risk (40 points): Immediate threat to life, injury potential
+- Infrastructure Criticality (25 points): Essential services affected (power, water, transport, hospitals)  
+- Economic Impact (20 points): Business disruption, repair costs, affected population size
+- Urgency of Response (15 points): Risk of further deterioration, weather vulnerability
+
+SCORING SCALE:
+- 90-100: CRITICAL - Immediate emergency response required, life-threatening
+- 70-89: HIGH - Urgent attention needed within hours, major service disruption
+- 50-69: MEDIUM - Action required within days, moderate impact
+- 30-49: LOW - Can wait for scheduled maintenance, minor impact  
+- 1-29: MINIMAL - Cosmetic or very minor issues
+
+Analyze the image carefully and provide ONLY a priority score (1-100) based on the visible damage severity, type of infrastructure affected, and potential consequences. Be specific and justify your score with clear reasoning based on what you observe in the image.
+image can contain things which are false or ai generated or edited u need to give them a low priority 
+if not at all related rate them 0
+"""
+
+# How much of a photo the processor sees:
+#   full      - original image, every anyres grid the model supports
+#   max_side  - downscale so the longest side is at most max_image_side
+#   max_tiles - only anyres grids with at most max_grid_tiles crops
+#   triage    - a single low-res tile plus the base view, cheapest prefill
+RESOLUTION_MODES = ("full", "max_side", "max_tiles", "triage")
+
+# free - open-ended answer, score recovered by _extract_priority_score
+# json - decoding constrained to {"PriorityScore": int, "reasoning": str}, stops at the closing brace
+OUTPUT_MODES = ("free", "json")
+
+# How tokens are picked:
+#   sample        - temperature 0.3 / top-p 0.9 sampling (the original behaviour)
+#   greedy        - argmax, reproducible and therefore safe to cache
+#   prompt_lookup - greedy, with draft tokens copied from matching n-grams of the prompt
+#   assisted      - greedy, with draft tokens proposed by a small language model (draft_model_path)
+# The two speculative modes verify several drafted tokens per forward pass of the 7B model
+# and give exactly the greedy output, they only run one sequence at a time.
+DECODE_MODES = ("sample", "greedy", "prompt_lookup", "assisted")
+SPECULATIVE_DECODE_MODES = ("prompt_lookup", "assisted")
+
+
+class InferenceUnavailableError(RuntimeError):
+    """No model is reachable to run generation; the assessment should be retried later"""
+
+
+class _FirstTokenTimer(LogitsProcessor):
+    """Notes when the first logits arrive, which is where prefill ends and decoding starts.
+
+    It also counts the positions it sees: one per step normally, one per verified
+    draft token plus one per step with speculative decoding.
+    """
+
+    def __init__(self):
+        self.first_token_at = None
+        self.positions = 0
+
+    def __call__(self, input_ids, scores):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.positions += 1
+        return scores
+
+
+class _ForwardCounter:
+    """Forward hook counting the passes of the 7B model during generate"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, module, args, output):
+        self.count += 1
+
+
+class _ResolutionLock:
+    """Lets any number of threads work under one resolution mode at a time.
+
+    Preprocessing and generation both read the anyres grid list, so a batch in
+    another mode has to wait until nobody depends on the current one; batches in
+    the same mode (the common case) share it, which is what lets the next batch
+    preprocess while the current one generates.
+    """
+
+    def __init__(self, apply):
+        self._apply = apply
+        self._condition = threading.Condition()
+        self._mode = None
+        self._holders = 0
+
+    @contextmanager
+    def holding(self, mode):
+        with self._condition:
+            while self._holders and self._mode != mode:
+                self._condition.wait()
+            if not self._holders:
+                self._apply(mode)
+                self._mode = mode
+            self._holders += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._holders -= 1
+                if not self._holders:
+                    self._condition.notify_all()
+
+
 class InfrastructureDamageAssessor:
-    def __init__(self, model_path=r"C:\Users\samas\llava-v1.6-mistral-7b-hf"):
+    def __init__(self, model_path=r"C:\Users\samas\llava-v1.6-mistral-7b-hf", preprocess_workers=4,
+                 resolution_mode="full", max_image_side=1008, max_grid_tiles=4, use_prefix_cache=True,
+                 output_mode="free", json_reasoning_tokens=96, backend="cuda-bnb", cpu_threads=0,
+                 onnx_dir="onnx_cache", decode_mode="sample", draft_model_path=None, prompt_lookup_tokens=10,
+                 max_image_pixels=DEFAULT_MAX_PIXELS, draft_decode=True, decode_buffer_blocks=8,
+                 load_model=True, on_progress=None):
+        if resolution_mode not in RESOLUTION_MODES:
+            raise ValueError(f"Unknown resolution mode: {resolution_mode}")
+        if output_mode not in OUTPUT_MODES:
+            raise ValueError(f"Unknown output mode: {output_mode}")
+        if decode_mode not in DECODE_MODES:
+            raise ValueError(f"Unknown decode mode: {decode_mode}")
+        if decode_mode == "assisted" and not draft_model_path:
+            raise ValueError("Assisted decoding needs a draft_model_path")
         self.model_path = model_path
+        self.resolution_mode = resolution_mode
+        self.max_image_side = max_image_side
+        self.max_grid_tiles = max_grid_tiles
+        self.use_prefix_cache = use_prefix_cache
+        self.output_mode = output_mode
+        self.json_reasoning_tokens = json_reasoning_tokens
+        self.decode_mode = decode_mode
+        self.draft_model_path = draft_model_path
+        self.prompt_lookup_tokens = prompt_lookup_tokens
+        self.draft_model = None
+        self.draft_tokenizer = None
+        self.max_image_pixels = max_image_pixels
+        # Decode JPEGs at the resolution the processor needs (see image_decode)
+        self.draft_decode = draft_decode
+        reuse_decode_buffers(decode_buffer_blocks)
+        # Folder name of the weights, used to tell cached results of different models apart
+        self.model_id = re.split(r"[\\/]", model_path.rstrip("\\/"))[-1]
         self.processor = None
         self.model = None
-        self._load_model()
+        # How the weights are loaded and run (see inference_backends); preprocessing and
+        # score extraction below are the same for every backend
+        self.backend = create_backend(backend, cpu_threads=cpu_threads, onnx_dir=onnx_dir)
+        # Image download/decode and processor work run here so a batch's images are handled in parallel
+        self._preprocess_pool = ThreadPoolExecutor(max_workers=preprocess_workers, thread_name_prefix="preprocess")
+        # The anyres grid list is shared by the processor and the model config, so preprocessing
+        # and generation each hold this lock while they depend on it; the model itself runs
+        # one batch at a time
+        self._resolution_lock = _ResolutionLock(self._apply_grid_pinpoints)
+        self._generate_lock = threading.Lock()
+        self._full_grid_pinpoints = None
+        self._prefix_ids = None
+        self._prefix_cache = None
+        # CUDA stream the next batch's pixels are copied on while the current one generates
+        self._copy_stream = None
+        # Stage timings and token counts of the most recent generate call, see metrics.observe_generation
+        self.last_generation_timings = None
+        # Called with each loading phase name, so a server can report startup progress
+        self._on_progress = on_progress
+        if load_model:
+            self._load_model()
+        else:
+            # Generation happens elsewhere (see worker_pool.RemoteAssessor), only preprocessing runs here
+            self._load_processor()
         
     def _load_model(self):
         """Load the model and processor once during initialization"""
         print("Loading model and processor...")
         
-        self.processor = LlavaNextProcessor.from_pretrained(self.model_path)
+        self._report_progress("loading_processor")
+        self._load_processor()
         
-        bnb_config = BitsAndBytesConfig(
-            load_in_4bit=True,
-            bnb_4bit_compute_dtype=torch.float16, 
-            bnb_4bit_use_double_quant=True,
-            bnb_4bit_quant_type="nf4"
-        )
+        self._report_progress("loading_weights")
+        self.model = self.backend.load(self.model_path, self.model_id)
+        print(f"Inference backend: {self.backend.name}")
         
-        self.model = LlavaNextForConditionalGeneration.from_pretrained(
-            self.model_path,
-            torch_dtype=torch.float16,
-            device_map="auto",
-            quantization_config=bnb_config,
-            trust_remote_code=True
-        )
+        self._full_grid_pinpoints = [list(pinpoint) for pinpoint in self.model.config.image_grid_pinpoints]
+        if self.draft_model_path:
+            self._report_progress("loading_draft_model")
+            self._load_draft_model()
+        if self.use_prefix_cache:
+            self._report_progress("building_prefix_cache")
+            self._build_prefix_cache()
         
         print("Model loaded successfully!")
         print("Infrastructure Damage Assessment Tool Ready")
         print("=" * 60)
+
+    def _load_draft_model(self):
+        """Small causal LM proposing tokens for assisted decoding, on the 7B model's device"""
+        device = self.model.device
+        self.draft_tokenizer = AutoTokenizer.from_pretrained(self.draft_model_path)
+        self.draft_model = AutoModelForCausalLM.from_pretrained(
+            self.draft_model_path,
+            torch_dtype=torch.float16 if device.type == "cuda" else torch.float32,
+            low_cpu_mem_usage=True,
+        ).to(device).eval()
+
+    def _report_progress(self, phase):
+        if self._on_progress:
+            self._on_progress(phase)
+
+    def warm_up(self):
+        """Run one short generate so kernels are compiled and allocator pools filled before real traffic"""
+        self._report_progress("warming_up")
+        image = Image.new("RGB", (self._tile_size(), self._tile_size()), (128, 128, 128))
+        result = self.assess_batch([("Warm-up", "Warm-up request", image)], max_new_tokens=2)[0]
+        if "error" in result:
+            raise RuntimeError(result["error"])
+
+    def _load_processor(self):
+        self.processor = LlavaNextProcessor.from_pretrained(self.model_path)
+        self._full_grid_pinpoints = [list(pinpoint) for pinpoint in self.processor.image_processor.image_grid_pinpoints]
+        self.image_token_id = self.processor.tokenizer.convert_tokens_to_ids(getattr(self.processor, "image_token", "<image>"))
     
-    def _load_image_from_url(self, image_url):
-        """Load image from URL"""
+    def _decode(self, source, mode):
+        if not self.draft_decode or mode is None:
+            return decode_image(source, max_pixels=self.max_image_pixels)
+        if mode == "max_side":
+            max_side = self.max_image_side
+        elif mode == "triage":
+            max_side = self._tile_size()
+        else:
+            max_side = None
+        return decode_image(source, self._grid_pinpoints_for(mode), max_side, self.max_image_pixels)
+
+    def _load_image_from_bytes(self, image_bytes, mode=None):
+        """Load image from already downloaded bytes"""
         try:
-            response = requests.get(image_url, stream=True, timeout=30)
-            response.raise_for_status()
-            image = Image.open(response.raw)
-            return image.convert("RGB")
+            return self._decode(image_bytes, mode)
         except Exception as e:
-            print(f"Error loading image from URL: {e}")
+            print(f"Error loading image from bytes: {e}")
             return None
     
-    def _load_image_from_path(self, image_path):
+    def _load_image_from_path(self, image_path, mode=None):
         """Load image from local path"""
         try:
-            image = Image.open(image_path)
-            return image.convert("RGB")
+            return self._decode(image_path, mode)
         except Exception as e:
             print(f"Error loading image from path: {e}")
             return None
@@ -70,7 +277,7 @@ class InfrastructureDamageAssessor:
         # Remove repeated prompt content patterns
         patterns_to_remove = [
             r'You are an expert infrastructure damage assessor.*?json format as [\'"]PriorityScore[\'"] = \.',
-            r'SITUATION REPORT:.*?if not at all related rate them 0',
+            r'SITUATION REPORT:.*?json format as [\'"]PriorityScore[\'"] = \.',
             r'Analyze this image.*?priority score in json format',
             r'ASSESSMENT CRITERIA:.*?SCORING SCALE:.*?- 1-29: MINIMAL.*?cosmetic or very minor issues',
         ]
@@ -84,109 +291,501 @@ class InfrastructureDamageAssessor:
         
         return response
     
-    def assess_damage(self, heading, description, image_source):
+    def _load_image(self, image_source, mode=None):
+        """Load image from downloaded bytes, a PIL image or a local path, decoded for a resolution mode"""
+        # Downloading is the caller's job (see fetcher.ImageFetcher), so no worker
+        # thread is held open while waiting on the network
+        if isinstance(image_source, (bytes, bytearray, memoryview)):
+            return self._load_image_from_bytes(image_source, mode)
+        if isinstance(image_source, Image.Image):
+            return image_source.convert("RGB")
+        return self._load_image_from_path(image_source, mode)
+
+    def _tile_size(self):
+        crop_size = self.processor.image_processor.crop_size
+        return crop_size["height"] if isinstance(crop_size, dict) else crop_size
+
+    def _grid_pinpoints_for(self, mode):
+        """anyres grid resolutions allowed in a resolution mode"""
+        tile = self._tile_size()
+        if mode == "triage":
+            return [[tile, tile]]
+        if mode == "max_tiles":
+            allowed = [
+                pinpoint for pinpoint in self._full_grid_pinpoints
+                if (pinpoint[0] // tile) * (pinpoint[1] // tile) <= self.max_grid_tiles
+            ]
+            # Never leave the model without a grid, fall back to the smallest one
+            return allowed or [min(self._full_grid_pinpoints, key=lambda pinpoint: pinpoint[0] * pinpoint[1])]
+        return self._full_grid_pinpoints
+
+    def _apply_grid_pinpoints(self, mode):
+        # The processor counts image tokens from its grid list and the model unpads features
+        # from the config's, so both have to change together
+        pinpoints = self._grid_pinpoints_for(mode)
+        self.processor.image_processor.image_grid_pinpoints = pinpoints
+        if self.model is not None:
+            self.model.config.image_grid_pinpoints = pinpoints
+
+    def _fit_image(self, image, mode):
+        """Downscale an image to the resolution budget of a mode"""
+        if mode == "max_side":
+            limit = self.max_image_side
+        elif mode == "triage":
+            limit = self._tile_size()
+        else:
+            return image
+        if max(image.size) <= limit:
+            return image
+        image = image.copy()
+        image.thumbnail((limit, limit), Image.Resampling.BICUBIC)
+        return image
+
+    def count_image_tokens(self, inputs):
+        """Number of image tokens the processor expanded into a prepared prompt"""
+        return int((inputs["input_ids"] == self.image_token_id).sum())
+
+    def cache_identity(self):
+        """Everything besides the prompt that changes what a result looks like"""
+        identity = f"{self.model_id}:{self.resolution_mode}:{self.output_mode}"
+        # The speculative modes produce exactly the greedy output, so they share its entries
+        return identity if self.decode_mode == "sample" else f"{identity}:greedy"
+
+    def _build_report(self, heading, description, output_mode="free"):
+        """Per-issue part of the prompt, placed after the image"""
+        if output_mode == "json":
+            response_format = 'Respond only with JSON: {"PriorityScore": <0-100>, "reasoning": "<brief justification>"}.'
+        else:
+            response_format = "Respond with your assessment and priority score in json format as 'PriorityScore' = ."
+        return f"""SITUATION REPORT:
+Heading: {heading}
+Description: {description}
+
+{response_format}"""
+
+    def _build_conversation(self, heading, description, output_mode="free"):
+        # One text item with the image placeholder inline: chat templates like
+        # llava-v1.6-mistral's render image items before all text items, which would
+        # put the image ahead of the shared instructions and leave no prefix to cache
+        image_token = getattr(self.processor, "image_token", "<image>")
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": f"{ASSESSMENT_INSTRUCTIONS}\n{image_token}\n"
+                                f"{self._build_report(heading, description, output_mode)}",
+                    },
+                ],
+            },
+        ]
+
+    def prepare_inputs(self, heading, description, image, output_mode="free"):
+        """Run the processor for one report, returning CPU tensors"""
+        prompt = self.processor.apply_chat_template(
+            self._build_conversation(heading, description, output_mode), add_generation_prompt=True
+        )
+        if output_mode == "json":
+            # Start the answer for the model, its first token is then the score itself
+            prompt += JSON_PREFILL
+        return self.processor(
+            images=image,
+            text=prompt,
+            return_tensors="pt"
+        )
+
+    def collate_inputs(self, prepared):
+        """Left-pad prepared inputs into a single batch for one generate call"""
+        pad_token_id = self.processor.tokenizer.pad_token_id
+        if pad_token_id is None:
+            pad_token_id = self.processor.tokenizer.eos_token_id
+        
+        max_length = max(p["input_ids"].shape[1] for p in prepared)
+        max_patches = max(p["pixel_values"].shape[1] for p in prepared)
+        
+        input_ids, attention_mask, pixel_values = [], [], []
+        for p in prepared:
+            # Left padding keeps every row's last prompt token aligned for generation
+            padding = max_length - p["input_ids"].shape[1]
+            input_ids.append(F.pad(p["input_ids"], (padding, 0), value=pad_token_id))
+            attention_mask.append(F.pad(p["attention_mask"], (padding, 0), value=0))
+            # anyres produces a different number of crops per image; pad with empty crops,
+            # the model drops them again using image_sizes
+            extra_patches = max_patches - p["pixel_values"].shape[1]
+            pixel_values.append(F.pad(p["pixel_values"], (0, 0, 0, 0, 0, 0, 0, extra_patches)))
+        
+        return {
+            "input_ids": torch.cat(input_ids),
+            "attention_mask": torch.cat(attention_mask),
+            "pixel_values": torch.cat(pixel_values),
+            "image_sizes": torch.cat([p["image_sizes"] for p in prepared]),
+        }
+
+    def _build_prefix_cache(self):
+        """Prefill the shared instructions once and keep their KV cache"""
+        prompt = self.processor.apply_chat_template(self._build_conversation("", ""), add_generation_prompt=True)
+        prompt_ids = self.processor.tokenizer(prompt, return_tensors="pt").input_ids[0]
+        # Everything before the image placeholder is identical for every request; cut in
+        # token space so the prefix matches what the processor produces for a full prompt
+        image_positions = (prompt_ids == self.image_token_id).nonzero()
+        prefix_ids = prompt_ids[:int(image_positions[0])] if len(image_positions) else prompt_ids[:0]
+        
+        instruction_tokens = len(self.processor.tokenizer(ASSESSMENT_INSTRUCTIONS, add_special_tokens=False).input_ids)
+        if len(prefix_ids) < instruction_tokens:
+            # The chat template moved the image ahead of the instructions; a cache of a few
+            # template tokens saves nothing, so run without it rather than pretend
+            print(f"Warning: shared prompt prefix is only {len(prefix_ids)} tokens, fewer than the "
+                  f"{instruction_tokens} instruction tokens; prefix cache disabled")
+            self.use_prefix_cache = False
+            return
+        
+        with torch.no_grad():
+            outputs = self.model(input_ids=prefix_ids.unsqueeze(0).to(self.model.device), use_cache=True)
+        
+        self._prefix_ids = prefix_ids
+        self._prefix_cache = outputs.past_key_values
+        print(f"Cached KV for {len(self._prefix_ids)} shared prompt tokens "
+              f"({instruction_tokens} of them instructions)")
+
+    def _split_prefix(self, batch):
+        """Per-row prompt tokens after the shared prefix, None if any row does not start with it"""
+        if self._prefix_ids is None:
+            return None
+        prefix_length = len(self._prefix_ids)
+        suffixes = []
+        for input_ids, attention_mask in zip(batch["input_ids"], batch["attention_mask"]):
+            tokens = input_ids[attention_mask.bool()]
+            if len(tokens) <= prefix_length or not torch.equal(tokens[:prefix_length], self._prefix_ids):
+                return None
+            suffixes.append(tokens[prefix_length:])
+        return suffixes
+
+    def _generate_with_prefix_cache(self, batch, suffixes, generation_kwargs):
+        """Generate on top of a copy of the cached prefix, prefilling only the per-request tokens"""
+        device = self.model.device
+        batch_size = len(suffixes)
+        prefix_length = len(self._prefix_ids)
+        suffix_length = max(len(suffix) for suffix in suffixes)
+        total_length = prefix_length + suffix_length
+        
+        # Rows are padded between the prefix and their own tokens, so the cached prefix
+        # lines up for every row and all rows still end on the same position
+        input_ids = torch.full((batch_size, total_length), generation_kwargs["pad_token_id"], dtype=torch.long)
+        attention_mask = torch.zeros((batch_size, total_length), dtype=torch.long)
+        input_ids[:, :prefix_length] = self._prefix_ids
+        attention_mask[:, :prefix_length] = 1
+        for row, suffix in enumerate(suffixes):
+            input_ids[row, total_length - len(suffix):] = suffix
+            attention_mask[row, total_length - len(suffix):] = 1
+        input_ids = input_ids.to(device)
+        attention_mask = attention_mask.to(device)
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+        
+        cache = copy.deepcopy(self._prefix_cache)
+        if batch_size > 1:
+            cache.batch_repeat_interleave(batch_size)
+        
+        # Prefill the image and report tokens except the last one; generate() then
+        # continues from the cache and only feeds the final prompt token
+        self.model(
+            input_ids=input_ids[:, prefix_length:total_length - 1],
+            pixel_values=batch["pixel_values"].to(device),
+            image_sizes=batch["image_sizes"].to(device),
+            attention_mask=attention_mask[:, :total_length - 1],
+            position_ids=position_ids[:, prefix_length:total_length - 1],
+            past_key_values=cache,
+            cache_position=torch.arange(prefix_length, total_length - 1, device=device),
+            use_cache=True,
+        )
+        outputs = self.model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            past_key_values=cache,
+            **generation_kwargs
+        )
+        return outputs
+
+    def generate_answers(self, batch, max_new_tokens=None, output_mode="free"):
         """
-        Assess infrastructure damage and return priority score
+        Run one generate call over a collated batch and decode each row
         
-        Args:
-            heading (str): Brief title of the damage report
-            description (str): Detailed description of the situation
-            image_source (str): URL or local path to damage image
-            
         Returns:
-            dict: JSON response with priority_score (1-100) and reasoning
+            list: (answer text, generated token count) per row
         """
+        if self.decode_mode in SPECULATIVE_DECODE_MODES and len(batch["input_ids"]) > 1:
+            return self._generate_rows(batch, max_new_tokens, output_mode)
         
-        # Load image
-        if image_source.startswith(('http://', 'https://')):
-            image = self._load_image_from_url(image_source)
+        generation_kwargs = dict(
+            max_new_tokens=max_new_tokens or 350,  # Reduced from 300 to get cleaner responses
+            pad_token_id=self.processor.tokenizer.eos_token_id
+        )
+        if self.decode_mode == "sample":
+            generation_kwargs.update(do_sample=True, temperature=0.3, top_p=0.9, top_k=50)
         else:
-            image = self._load_image_from_path(image_source)
-            
-        if image is None:
-            return {
-                "priority_score": 0,
-                "error": "Failed to load image",
-                "reasoning": "Cannot assess damage without valid image"
-            }
+            generation_kwargs.update(do_sample=False)
+        if self.decode_mode == "prompt_lookup":
+            generation_kwargs["prompt_lookup_num_tokens"] = self.prompt_lookup_tokens
+        elif self.decode_mode == "assisted":
+            # The draft has its own vocabulary, so generate() converts through the text; the
+            # image placeholders are special tokens and are left out of the draft's prompt
+            generation_kwargs.update(
+                assistant_model=self.draft_model,
+                tokenizer=self.processor.tokenizer,
+                assistant_tokenizer=self.draft_tokenizer,
+            )
+        suffixes = self._split_prefix(batch) if self.use_prefix_cache else None
+        if suffixes is not None:
+            prompt_length = len(self._prefix_ids) + max(len(suffix) for suffix in suffixes)
+        else:
+            prompt_length = batch["input_ids"].shape[1]
+        
+        first_token_timer = _FirstTokenTimer()
+        logits_processors = LogitsProcessorList([first_token_timer])
+        if output_mode == "json":
+            constraint = ScoreJsonLogitsProcessor(
+                self.processor.tokenizer, prompt_length, max_reasoning_tokens=self.json_reasoning_tokens
+            )
+            logits_processors.append(constraint)
+            # A tighter token budget shortens the reasoning instead of cutting the JSON off
+            punctuation = constraint.max_new_tokens() - self.json_reasoning_tokens
+            constraint.max_reasoning_tokens = max(0, min(
+                self.json_reasoning_tokens, generation_kwargs["max_new_tokens"] - punctuation
+            ))
+            generation_kwargs["max_new_tokens"] = constraint.max_new_tokens()
+        generation_kwargs["logits_processor"] = logits_processors
+        prompt_tokens = batch["attention_mask"].sum(dim=1).tolist()
         
-        # Create shortened assessment prompt to reduce repetition
-        assessment_prompt = f"""You are an expert infrastructure damage assessor. Analyze this image of city infrastructure damage and provide a priority score.
+        forward_counter = _ForwardCounter()
+        hook = self.model.register_forward_hook(forward_counter)
+        started = time.perf_counter()
+        try:
+            with torch.no_grad():
+                if suffixes is not None:
+                    outputs = self._generate_with_prefix_cache(batch, suffixes, generation_kwargs)
+                else:
+                    batch = {key: value.to(self.model.device) for key, value in batch.items()}
+                    outputs = self.model.generate(**batch, **generation_kwargs)
+        finally:
+            hook.remove()
+        finished_at = time.perf_counter()
+        
+        # FIXED: Decode only the newly generated tokens, excluding the input prompt
+        eos_token_id = self.processor.tokenizer.eos_token_id
+        answers = []
+        for output in outputs:
+            generated = output[prompt_length:]
+            # Finished rows are padded with EOS until the whole batch is done
+            finished = (generated == eos_token_id).nonzero()
+            token_count = int(finished[0]) + 1 if len(finished) else len(generated)
+            answers.append((self.processor.decode(generated, skip_special_tokens=True).strip(), token_count))
+        
+        first_token_at = first_token_timer.first_token_at
+        self.last_generation_timings = {
+            "generate": finished_at - started,
+            "prefill": first_token_at - started if first_token_at else None,
+            "decode": finished_at - first_token_at if first_token_at else None,
+            "prompt_tokens": prompt_tokens,
+            "generated_tokens": [token_count for _, token_count in answers],
+        }
+        if self.decode_mode in SPECULATIVE_DECODE_MODES:
+            # Each pass of the 7B model verifies the drafted tokens it was handed and adds one of
+            # its own, so drafted = positions checked - passes, accepted = tokens - passes
+            passes = forward_counter.count - (1 if suffixes is not None else 0)
+            self.last_generation_timings["draft_tokens"] = max(0, first_token_timer.positions - passes)
+            self.last_generation_timings["accepted_tokens"] = max(0, sum(self.last_generation_timings["generated_tokens"]) - passes)
+        return answers
 
-SITUATION REPORT:
-Heading: {heading}
-Description: {description}
+    def _generate_rows(self, batch, max_new_tokens, output_mode):
+        """Speculative decoding verifies one sequence at a time, so a batch runs row by row"""
+        answers = []
+        timings = None
+        for row in range(len(batch["input_ids"])):
+            answers += self.generate_answers(
+                {key: value[row:row + 1] for key, value in batch.items()}, max_new_tokens, output_mode
+            )
+            row_timings = self.last_generation_timings
+            if timings is None:
+                timings = dict(row_timings)
+                continue
+            for key in ("generate", "prefill", "decode", "draft_tokens", "accepted_tokens"):
+                if timings.get(key) is not None and row_timings.get(key) is not None:
+                    timings[key] += row_timings[key]
+            timings["prompt_tokens"] = timings["prompt_tokens"] + row_timings["prompt_tokens"]
+            timings["generated_tokens"] = timings["generated_tokens"] + row_timings["generated_tokens"]
+        self.last_generation_timings = timings
+        return answers
 
-ASSESSMENT CRITERIA:
-- Public Safety Risk (40 points): Immediate threat to life, injury potential
-- Infrastructure Criticality (25 points): Essential services affected (power, water, transport, hospitals)  
-- Economic Impact (20 points): Business disruption, repair costs, affected population size
-- Urgency of Response (15 points): Risk of further deterioration, weather vulnerability
+    def _generate(self, batch, mode, max_new_tokens, output_mode):
+        """Generation step of a batch; RemoteAssessor overrides this to run it in a worker process"""
+        # The anyres grid list is shared by the processor and the model config, so the mode
+        # is held again in case a batch in another mode ran since preprocessing
+        with self._resolution_lock.holding(mode), self._generate_lock:
+            answers = self.generate_answers(batch, max_new_tokens, output_mode)
+            metrics.observe_generation(self.last_generation_timings)
+            return answers
 
-SCORING SCALE:
-- 90-100: CRITICAL - Immediate emergency response required, life-threatening
-- 70-89: HIGH - Urgent attention needed within hours, major service disruption
-- 50-69: MEDIUM - Action required within days, moderate impact
-- 30-49: LOW - Can wait for scheduled maintenance, minor impact  
-- 1-29: MINIMAL - Cosmetic or very minor issues
+    def _load_and_prepare(self, heading, description, image_source, mode, output_mode):
+        """Load one image and run the processor on it, None if the image is unusable"""
+        with metrics.STAGE_SECONDS.time(stage="decode"):
+            image = self._load_image(image_source, mode)
+        if image is None:
+            return None
+        with metrics.STAGE_SECONDS.time(stage="preprocess"):
+            return self.prepare_inputs(heading, description, self._fit_image(image, mode), output_mode)
 
-Analyze the image carefully and provide ONLY a priority score (1-100) based on the visible damage severity, type of infrastructure affected, and potential consequences. Be specific and justify your score with clear reasoning based on what you observe in the image.
-image can contain things which are false or ai generated or edited u need to give them a low priority 
-if not at all related rate them 0
-Respond with your assessment and priority score in json format as 'PriorityScore' = ."""
+    def _failure_result(self, error):
+        return {
+            "priority_score": 0,
+            "error": f"Assessment failed: {str(error)}",
+            "reasoning": "Technical error during damage assessment"
+        }
 
-        try:
-            conversation = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "image"},
-                        {"type": "text", "text": assessment_prompt}
-                    ],
-                },
-            ]
-            
-            prompt = self.processor.apply_chat_template(conversation, add_generation_prompt=True)
-            inputs = self.processor(
-                images=image,
-                text=prompt,
-                return_tensors="pt"
-            ).to(self.model.device)
-            
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=350,  # Reduced from 300 to get cleaner responses
-                    do_sample=True,
-                    temperature=0.3,
-                    top_p=0.9,
-                    top_k=50,
-                    pad_token_id=self.processor.tokenizer.eos_token_id
-                )
-            
-            # FIXED: Decode only the newly generated tokens, excluding the input prompt
-            input_length = inputs['input_ids'].shape[1]
-            answer = self.processor.decode(outputs[0][input_length:], skip_special_tokens=True).strip()
-            
-            # Additional cleaning
-            answer = self._clean_response(answer)
+    def assess_batch(self, requests, resolution_mode=None, max_new_tokens=None, output_mode=None):
+        """
+        Assess several reports with a single batched generate call
+        
+        Args:
+            requests (list): (heading, description, image_source) tuples, where
+                image_source is downloaded image bytes or a local path
+            resolution_mode (str): One of RESOLUTION_MODES, defaults to the assessor's mode
+            max_new_tokens (int): Generation length limit, defaults to 350
+            output_mode (str): One of OUTPUT_MODES, defaults to the assessor's mode
             
-            # Extract priority score from response
-            priority_score = self._extract_priority_score(answer)
+        Returns:
+            list: One result dict per request, in the same order
+        """
+        return self.finish_batch(self.prepare_batch(requests, resolution_mode, output_mode), max_new_tokens)
+
+    def prepare_batch(self, requests, resolution_mode=None, output_mode=None):
+        """
+        CPU half of assess_batch: decode, preprocess and collate a batch, and start
+        copying its pixels to the GPU. A pipeline runs this for the next batch while
+        finish_batch generates the current one (see batching.BatchScheduler).
+        
+        Returns:
+            dict: Prepared batch to hand to finish_batch
+        """
+        mode = resolution_mode or self.resolution_mode
+        output_mode = output_mode or self.output_mode
+        prepared = {"mode": mode, "output_mode": output_mode, "results": [None] * len(requests),
+                    "pending": [], "batch": None, "ready": None}
+        
+        try:
+            with self._resolution_lock.holding(mode):
+                # Decode and preprocess every image of the batch concurrently
+                inputs_list = list(self._preprocess_pool.map(
+                    lambda request: self._load_and_prepare(*request, mode, output_mode), requests
+                ))
+        except Exception as e:
+            prepared["results"] = [self._failure_result(e) for _ in requests]
+            return prepared
+        
+        for index, ((heading, description, _), inputs) in enumerate(zip(requests, inputs_list)):
+            if inputs is None:
+                prepared["results"][index] = {
+                    "priority_score": 0,
+                    "error": "Failed to load image",
+                    "reasoning": "Cannot assess damage without valid image"
+                }
+                continue
+            prepared["pending"].append((index, heading, description, inputs))
+        
+        if prepared["pending"]:
+            try:
+                batch = self.collate_inputs([inputs for *_, inputs in prepared["pending"]])
+                prepared["batch"], prepared["ready"] = self._prefetch_to_device(batch)
+            except Exception as e:
+                for index, *_ in prepared["pending"]:
+                    prepared["results"][index] = self._failure_result(e)
+                prepared["pending"] = []
+        return prepared
+
+    def _prefetch_to_device(self, batch):
+        """Copy the pixel tensor to the GPU from pinned memory on a side stream.
+
+        The copy overlaps whatever the GPU is doing; the returned event marks when
+        it is done. Token ids stay on the CPU, the prefix cache compares them there.
+        """
+        if self.model is None or self.model.device.type != "cuda":
+            return batch, None
+        device = self.model.device
+        if self._copy_stream is None:
+            self._copy_stream = torch.cuda.Stream(device)
+        pixel_values = batch["pixel_values"].pin_memory()
+        with torch.cuda.stream(self._copy_stream):
+            batch["pixel_values"] = pixel_values.to(device, non_blocking=True)
+            ready = torch.cuda.Event()
+            ready.record(self._copy_stream)
+        return batch, ready
+
+    def finish_batch(self, prepared, max_new_tokens=None):
+        """
+        Generation half of assess_batch: generate for a prepared batch and parse the answers
+        
+        Returns:
+            list: One result dict per request, in the same order
+        """
+        mode, output_mode = prepared["mode"], prepared["output_mode"]
+        results = prepared["results"]
+        pending = prepared["pending"]
+        
+        if pending:
+            batch = prepared["batch"]
+            if prepared["ready"] is not None:
+                # Kernels of this thread's stream wait for the prefetch, and the pixel
+                # memory is not reused before they are done with it
+                stream = torch.cuda.current_stream(self.model.device)
+                stream.wait_event(prepared["ready"])
+                batch["pixel_values"].record_stream(stream)
+            try:
+                answers = self._generate(batch, mode, max_new_tokens, output_mode)
+            except InferenceUnavailableError:
+                raise
+            except Exception as e:
+                answers = None
+                for index, *_ in pending:
+                    results[index] = self._failure_result(e)
             
-            return {
-                "priority_score": priority_score,
-                "reasoning": answer,
-                "heading": heading,
-                "description": description
-            }
+            for (index, heading, description, inputs), (answer, generated_tokens) in zip(pending, answers or []):
+                parsed = parse_score_json(answer) if output_mode == "json" else None
+                if parsed is not None:
+                    priority_score, answer = parsed
+                else:
+                    # Additional cleaning
+                    answer = self._clean_response(answer)
+                    priority_score = self._extract_priority_score(answer)
+                
+                image_tokens = self.count_image_tokens(inputs)
+                metrics.IMAGE_TOKENS.observe(image_tokens)
+                results[index] = {
+                    "priority_score": priority_score,
+                    "reasoning": answer,
+                    "heading": heading,
+                    "description": description,
+                    "image_tokens": image_tokens,
+                    "generated_tokens": generated_tokens
+                }
+        
+        for result in results:
+            if "error" not in result:
+                result["resolution_mode"] = mode
+                result["output_mode"] = output_mode
+        return results
+
+    def assess_damage(self, heading, description, image_source):
+        """
+        Assess infrastructure damage and return priority score
+        
+        Args:
+            heading (str): Brief title of the damage report
+            description (str): Detailed description of the situation
+            image_source (bytes | str): Downloaded image bytes or local path to damage image
             
-        except Exception as e:
-            return {
-                "priority_score": 0,
-                "error": f"Assessment failed: {str(e)}",
-                "reasoning": "Technical error during damage assessment"
-            }
+        Returns:
+            dict: JSON response with priority_score (1-100) and reasoning
+        """
+        return self.assess_batch([(heading, description, image_source)])[0]
     
     def _extract_priority_score(self, response_text):
         """Extract numerical priority score from model response"""
@@ -269,6 +868,50 @@ Respond with your assessment and priority score in json format as 'PriorityScore
         # Default fallback
         return 50
 
+def combine_priority_scores(scores, rule="max"):
+    """
+    Combine per-image priority scores of one issue into a single score
+    
+    Args:
+        scores (list): Priority scores (0-100), one per image
+        rule (str): 'max' takes the most severe view, 'mean' averages all views,
+            'weighted_mean' weights each view by its own score so severe views
+            dominate without a single outlier deciding alone
+            
+    Returns:
+        int: Combined priority score
+    """
+    if not scores:
+        raise ValueError("No scores to combine")
+    if rule == "max":
+        return max(scores)
+    if rule == "mean":
+        return round(sum(scores) / len(scores))
+    if rule == "weighted_mean":
+        total = sum(scores)
+        if total == 0:
+            return 0
+        return round(sum(score * score for score in scores) / total)
+    raise ValueError(f"Unknown score combination rule: {rule}")
+
+
+def combine_image_results(results, rule="max"):
+    """Merge per-image assessments of one issue into a single result"""
+    if len(results) == 1 or all("error" in result for result in results):
+        return results[0]
+    
+    image_scores = [None if "error" in result else result.get("priority_score", 0) for result in results]
+    reasoning = "\n".join(
+        f"Image {index + 1} ({'not assessed' if score is None else f'score {score}'}): {result.get('reasoning', '')}"
+        for index, (score, result) in enumerate(zip(image_scores, results))
+    )
+    return {
+        "priority_score": combine_priority_scores([score for score in image_scores if score is not None], rule),
+        "reasoning": reasoning,
+        "image_scores": image_scores
+    }
+
+
 # Initialize the assessor
 # assessor = InfrastructureDamageAssessor()
 
@@ -0,0 +1,228 @@
+"""
+Interchangeable ways of loading and running the LLaVA-Next model.
+
+Every backend returns a model with the LlavaNextForConditionalGeneration
+interface, so InfrastructureDamageAssessor keeps one preprocessing, batching,
+prefix-cache and score-extraction path whichever backend is selected:
+
+    cuda-bnb  - 4-bit bitsandbytes on CUDA (the original path)
+    cpu-int8  - float32 weights with every language-model Linear dynamically
+                quantised to int8, on a tuned number of CPU threads
+    onnx      - cpu-int8 with the vision tower exported to ONNX and run by
+                ONNX Runtime
+    auto      - cuda-bnb when a GPU is visible, cpu-int8 otherwise
+"""
+import logging
+import os
+import types
+
+import torch
+from transformers import BitsAndBytesConfig, LlavaNextForConditionalGeneration
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("auto", "cuda-bnb", "cpu-int8", "onnx")
+
+
+def _module_name(model, suffix):
+    """Full name of the first submodule whose name ends with suffix; the nesting differs between transformers versions"""
+    for name, _ in model.named_modules():
+        if name == suffix or name.endswith("." + suffix):
+            return name
+    raise ValueError(f"Model has no {suffix} module")
+
+
+def _find_module(model, suffix):
+    """(parent module, attribute name, module) of the submodule named like suffix"""
+    name = _module_name(model, suffix)
+    parent_name, _, attribute = name.rpartition(".")
+    return model.get_submodule(parent_name) if parent_name else model, attribute, model.get_submodule(name)
+
+
+class CudaBnbBackend:
+    """4-bit NF4 weights with fp16 compute, spread over the visible GPUs"""
+
+    name = "cuda-bnb"
+
+    def load(self, model_path, model_id):
+        bnb_config = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_compute_dtype=torch.float16,
+            bnb_4bit_use_double_quant=True,
+            bnb_4bit_quant_type="nf4"
+        )
+        return LlavaNextForConditionalGeneration.from_pretrained(
+            model_path,
+            torch_dtype=torch.float16,
+            device_map="auto",
+            quantization_config=bnb_config,
+            # safetensors shards are memory-mapped and streamed to the device one
+            # tensor at a time instead of being read into RAM first
+            use_safetensors=True,
+            low_cpu_mem_usage=True,
+            trust_remote_code=True
+        )
+
+    def optimize(self, model, model_id):
+        """Backend-specific changes to an already built model (used by tiny_model)"""
+        return model
+
+    def describe(self):
+        return {"backend": self.name, "devices": torch.cuda.device_count()}
+
+
+class CpuInt8Backend:
+    """Dynamic int8 quantisation of the language model for CPU hosts.
+
+    Weights load as float32 (about 30 GB for the 7B model while loading), then
+    each Linear layer of the language model is replaced by an int8 one that
+    quantises activations on the fly, roughly a quarter of the memory and
+    two to three times faster matmuls. The vision tower and projector are small
+    and more sensitive to rounding, so they stay float32.
+    """
+
+    name = "cpu-int8"
+
+    def __init__(self, threads=0):
+        self.threads = threads or max(1, (os.cpu_count() or 2) // 2)
+
+    def _configure_threads(self):
+        # One intra-op pool sized to the physical cores; hyper-threads and
+        # inter-op parallelism only add contention for batch-sized matmuls
+        torch.set_num_threads(self.threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Can only be set before the first parallel op, keep whatever is in place
+            pass
+
+    def load(self, model_path, model_id):
+        self._configure_threads()
+        model = LlavaNextForConditionalGeneration.from_pretrained(
+            model_path,
+            torch_dtype=torch.float32,
+            use_safetensors=True,
+            low_cpu_mem_usage=True,
+            trust_remote_code=True
+        )
+        return self.optimize(model, model_id)
+
+    def optimize(self, model, model_id):
+        self._configure_threads()
+        model = model.float().eval()
+        # None switches quantisation off for a subtree
+        qconfig_spec = {torch.nn.Linear: torch.ao.quantization.default_dynamic_qconfig}
+        for suffix in ("vision_tower", "multi_modal_projector"):
+            qconfig_spec[_module_name(model, suffix)] = None
+        return torch.ao.quantization.quantize_dynamic(model, qconfig_spec, dtype=torch.qint8)
+
+    def describe(self):
+        return {"backend": self.name, "threads": self.threads}
+
+
+class _HiddenStates:
+    """Stands in for the hidden_states tuple, holding only the layers the model reads"""
+
+    def __init__(self, layers):
+        self._layers = layers
+
+    def __getitem__(self, index):
+        return self._layers[index]
+
+
+class OnnxVisionTower(torch.nn.Module):
+    """Drop-in for the CLIP vision tower that runs an exported ONNX graph"""
+
+    def __init__(self, session, feature_layers):
+        super().__init__()
+        self.session = session
+        self.feature_layers = feature_layers
+
+    @property
+    def dtype(self):
+        return torch.float32
+
+    @property
+    def device(self):
+        return torch.device("cpu")
+
+    def forward(self, pixel_values, output_hidden_states=True, **kwargs):
+        outputs = self.session.run(None, {"pixel_values": pixel_values.float().cpu().numpy()})
+        layers = {layer: torch.from_numpy(output) for layer, output in zip(self.feature_layers, outputs)}
+        return types.SimpleNamespace(hidden_states=_HiddenStates(layers))
+
+
+class _VisionFeatures(torch.nn.Module):
+    """Export wrapper returning just the hidden layers LLaVA-Next takes image features from"""
+
+    def __init__(self, vision_tower, feature_layers):
+        super().__init__()
+        self.vision_tower = vision_tower
+        self.feature_layers = feature_layers
+
+    def forward(self, pixel_values):
+        hidden_states = self.vision_tower(pixel_values, output_hidden_states=True).hidden_states
+        return tuple(hidden_states[layer] for layer in self.feature_layers)
+
+
+class OnnxBackend(CpuInt8Backend):
+    """cpu-int8 language model with the vision tower on ONNX Runtime.
+
+    Only the vision tower is exported: it is a fixed-shape encoder that ONNX
+    Runtime fuses well, while the autoregressive language model needs the
+    KV-cache handling generate() and the prefix cache rely on. The export is
+    cached in ``onnx_dir`` per model and reused on the next start.
+    """
+
+    name = "onnx"
+
+    def __init__(self, threads=0, onnx_dir="onnx_cache"):
+        super().__init__(threads)
+        self.onnx_dir = onnx_dir
+
+    def optimize(self, model, model_id):
+        # Optional dependency: pip install onnxruntime onnx
+        import onnxruntime
+
+        parent, attribute, vision_tower = _find_module(model, "vision_tower")
+        feature_layer = model.config.vision_feature_layer
+        feature_layers = list(feature_layer) if isinstance(feature_layer, (list, tuple)) else [feature_layer]
+
+        path = os.path.join(self.onnx_dir, model_id, "vision_tower.onnx")
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            image_size = model.config.vision_config.image_size
+            logger.info(f"Exporting the vision tower to {path}")
+            torch.onnx.export(
+                _VisionFeatures(vision_tower.float().eval(), feature_layers),
+                (torch.zeros(1, 3, image_size, image_size),),
+                path,
+                input_names=["pixel_values"],
+                output_names=[f"hidden_state_{index}" for index in range(len(feature_layers))],
+                dynamic_axes={"pixel_values": {0: "crops"}},
+                opset_version=17,
+            )
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        setattr(parent, attribute, OnnxVisionTower(session, feature_layers))
+        return super().optimize(model, model_id)
+
+    def describe(self):
+        return {"backend": self.name, "threads": self.threads, "onnx_dir": self.onnx_dir}
+
+
+def create_backend(name="auto", cpu_threads=0, onnx_dir="onnx_cache"):
+    """Backend instance for a BACKENDS name"""
+    if name == "auto":
+        name = "cuda-bnb" if torch.cuda.is_available() else "cpu-int8"
+    if name == "cuda-bnb":
+        return CudaBnbBackend()
+    if name == "cpu-int8":
+        return CpuInt8Backend(cpu_threads)
+    if name == "onnx":
+        return OnnxBackend(cpu_threads, onnx_dir)
+    raise ValueError(f"Unknown inference backend: {name}")
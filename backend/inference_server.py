@@ -0,0 +1,210 @@
+"""
+Inference worker processes for the damage assessment API.
+
+Each worker loads the model once and serves generate requests from any number of
+API processes (set INFERENCE_WORKERS=host:port,... in the API's .env). The
+supervisor restarts workers that crash.
+
+Usage:
+    python inference_server.py --workers 2 --base-port 8601 --devices 0 1
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import torch
+
+from img import InfrastructureDamageAssessor
+from worker_pool import tensor_from_shared_memory
+from config import (
+    INFERENCE_AUTHKEY,
+    INFERENCE_BASE_PORT,
+    INFERENCE_WORKER_COUNT,
+    MODEL_WARMUP,
+    assessor_options,
+    require_inference_authkey,
+)
+
+logger = logging.getLogger("inference_server")
+
+# A worker that dies sooner than this after starting is restarted with an increasing delay
+CRASH_LOOP_SECONDS = 60
+MAX_RESTART_DELAY = 60
+
+
+def _attach_shared_memory(name):
+    """Open a block created by the API process without taking ownership of it"""
+    block = SharedMemory(name=name)
+    # Attaching also registers the block, and the tracker would unlink it when this
+    # worker exits even though the API process owns it
+    resource_tracker.unregister(block._name, "shared_memory")
+    return block
+
+
+class InferenceWorker:
+    """One model copy answering generate requests on a TCP port"""
+
+    def __init__(self, host, port, authkey):
+        self.host = host
+        self.port = port
+        self.authkey = authkey
+        self.assessor = None
+        self.started_at = time.time()
+        self.requests = 0
+        self.failures = 0
+        self.last_error = None
+        self.busy = False
+
+    def stats(self):
+        stats = {
+            "pid": os.getpid(),
+            "port": self.port,
+            "uptime_seconds": round(time.time() - self.started_at),
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "busy": self.busy,
+        }
+        if torch.cuda.is_available():
+            stats["gpu_memory_allocated_mb"] = round(torch.cuda.memory_allocated() / 2**20)
+            stats["gpu_memory_reserved_mb"] = round(torch.cuda.memory_reserved() / 2**20)
+            stats["gpu_memory_peak_mb"] = round(torch.cuda.max_memory_allocated() / 2**20)
+        return stats
+
+    def serve(self):
+        self.assessor = InfrastructureDamageAssessor(**assessor_options())
+        if MODEL_WARMUP:
+            self.assessor.warm_up()
+        # Only listen once the model is ready, until then clients fail over to other workers
+        with Listener((self.host, self.port), authkey=self.authkey) as listener:
+            logger.info(f"Inference worker {os.getpid()} listening on {self.host}:{self.port}")
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception as e:
+                    logger.warning(f"Rejected connection: {str(e)}")
+                    continue
+                threading.Thread(target=self._handle_connection, args=(connection,), daemon=True).start()
+
+    def _handle_connection(self, connection):
+        """Serve one API process; generation itself is serialised by the assessor's lock"""
+        with connection:
+            while True:
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    return
+                if message.get("op") == "ping":
+                    connection.send({"stats": self.stats()})
+                    continue
+
+                reply, fatal = self._generate(message)
+                reply["stats"] = self.stats()
+                connection.send(reply)
+                if fatal:
+                    # The CUDA context is unusable after a device-side error, let the supervisor restart us
+                    logger.error("Unrecoverable CUDA error, exiting for restart")
+                    os._exit(1)
+
+    def _generate(self, message):
+        self.busy = True
+        try:
+            name, shape, dtype = message["pixel_values"]
+            block = _attach_shared_memory(name)
+            try:
+                batch = dict(message["tensors"])
+                batch["pixel_values"] = tensor_from_shared_memory(block, shape, dtype)
+            finally:
+                block.close()
+
+            # Same as assessor._generate, but the timings are read before another connection's batch runs
+            mode = message["resolution_mode"]
+            with self.assessor._resolution_lock.holding(mode), self.assessor._generate_lock:
+                answers = self.assessor.generate_answers(batch, message["max_new_tokens"], message["output_mode"])
+                timings = self.assessor.last_generation_timings
+            self.requests += 1
+            return {"answers": answers, "timings": timings}, False
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            logger.error(f"Generation failed: {str(e)}")
+            if isinstance(e, torch.cuda.OutOfMemoryError):
+                torch.cuda.empty_cache()
+                return {"error": str(e)}, False
+            return {"error": str(e)}, "CUDA error" in str(e)
+        finally:
+            self.busy = False
+
+
+def _run_worker(host, port, authkey, device):
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s worker:{port} %(levelname)s %(message)s")
+    if device is not None:
+        os.environ["CUDA_VISIBLE_DEVICES"] = device
+    InferenceWorker(host, port, authkey).serve()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Damage assessment inference workers")
+    parser.add_argument("--workers", type=int, default=INFERENCE_WORKER_COUNT)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--base-port", type=int, default=INFERENCE_BASE_PORT,
+                        help="Worker i listens on base-port + i")
+    parser.add_argument("--devices", nargs="+", help="CUDA device per worker, assigned round-robin")
+    args = parser.parse_args()
+    try:
+        require_inference_authkey()
+    except RuntimeError as e:
+        raise SystemExit(str(e))
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s supervisor %(levelname)s %(message)s")
+    # Fresh interpreters, forking a process that might touch CUDA is unsafe
+    context = multiprocessing.get_context("spawn")
+    authkey = INFERENCE_AUTHKEY.encode("utf-8")
+
+    def launch(index):
+        device = args.devices[index % len(args.devices)] if args.devices else None
+        process = context.Process(
+            target=_run_worker, args=(args.host, args.base_port + index, authkey, device),
+            name=f"inference-worker-{index}",
+        )
+        process.start()
+        logger.info(f"Started worker {index} (pid {process.pid}) on port {args.base_port + index}")
+        return {"process": process, "started_at": time.time(), "restarts": 0, "restart_at": None}
+
+    workers = [launch(index) for index in range(args.workers)]
+    try:
+        while True:
+            time.sleep(2)
+            for index, worker in enumerate(workers):
+                process = worker["process"]
+                if process.is_alive():
+                    continue
+                now = time.time()
+                if worker["restart_at"] is None:
+                    crashed_early = now - worker["started_at"] < CRASH_LOOP_SECONDS
+                    delay = min(MAX_RESTART_DELAY, 2 ** worker["restarts"]) if crashed_early else 0
+                    worker["restart_at"] = now + delay
+                    logger.error(f"Worker {index} (pid {process.pid}) exited with code {process.exitcode}, "
+                                 f"restarting in {delay}s")
+                    worker["restarts"] = worker["restarts"] + 1 if crashed_early else 0
+                if now >= worker["restart_at"]:
+                    restarts = worker["restarts"]
+                    workers[index] = launch(index)
+                    workers[index]["restarts"] = restarts
+    except KeyboardInterrupt:
+        logger.info("Stopping inference workers")
+    finally:
+        for worker in workers:
+            worker["process"].terminate()
+        for worker in workers:
+            worker["process"].join(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
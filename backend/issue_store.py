@@ -0,0 +1,278 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+
+import metrics
+from fetcher import HTTP2_AVAILABLE
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Only what an assessment reads, never select('*')
+ISSUE_COLUMNS = "id,title,description,image_urls,status"
+STATUS_COLUMNS = "id,status,priority_score,assessment_reasoning,assessed_at"
+# Newer column, only read and written with track_tier
+TIER_COLUMN = "assessment_tier"
+# What the urgency estimate looks at when a job is queued
+URGENCY_COLUMNS = "id,title,description,user_id,latitude,longitude"
+
+
+class IssueStore:
+    """Async access to the issues table through PostgREST over one pooled client.
+
+    Claiming an issue for assessment and reading it is a single PATCH that
+    returns the updated row, and the final write is one more request, so a job
+    costs two round trips. With ``coalesce_ms`` above zero the final writes of
+    concurrent jobs are gathered for that long (or until ``write_batch_size``)
+    and sent as one bulk upsert; that is off by default because an upsert would
+    re-create an issue deleted while it was being assessed. Works against
+    Supabase (``<project>/rest/v1``) or any plain PostgREST server with the
+    same table.
+
+    With ``track_tier`` the quality tier of each assessment is stored in the
+    ``assessment_tier`` column, which start() checks for; without it the column
+    is never named, so tables created before it keep working.
+    """
+
+    def __init__(self, rest_url, service_key, max_connections=20, timeout=10.0,
+                 coalesce_ms=0, write_batch_size=50, track_tier=False):
+        self.rest_url = rest_url.rstrip("/")
+        self.service_key = service_key
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.coalesce = max(0, coalesce_ms) / 1000
+        self.write_batch_size = max(1, write_batch_size)
+        self.track_tier = track_tier
+        self.status_columns = f"{STATUS_COLUMNS},{TIER_COLUMN}" if track_tier else STATUS_COLUMNS
+        self.requests = 0
+        self.bulk_writes = 0
+        self.rows_written = 0
+        self._client = None
+        self._writes = None
+        self._writer = None
+        # Concurrent status polls of one issue share a single read
+        self.status_flights = SingleFlight("db_status")
+
+    async def start(self):
+        """Open the connection pool and, when coalescing, the bulk writer"""
+        headers = {"Accept": "application/json"}
+        if self.service_key:
+            headers["apikey"] = self.service_key
+            headers["Authorization"] = f"Bearer {self.service_key}"
+        self._client = httpx.AsyncClient(
+            base_url=self.rest_url,
+            headers=headers,
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+            timeout=self.timeout,
+        )
+        if self.track_tier:
+            await self._check_tier_column()
+        if self.coalesce:
+            self._writes = asyncio.Queue()
+            self._writer = asyncio.create_task(self._run_writer())
+
+    async def close(self):
+        """Flush pending writes and close the pool"""
+        if self._writer:
+            while not self._writes.empty():
+                await self._flush(self._drain())
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    async def _check_tier_column(self):
+        """Fail at startup rather than on every write if the table predates assessment_tier"""
+        try:
+            await self._request("db_read", "GET", "/issues", params={"select": f"id,{TIER_COLUMN}", "limit": 0})
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 400:
+                raise
+            await self._client.aclose()
+            self._client = None
+            raise RuntimeError(
+                f"issues.{TIER_COLUMN} is missing: run ALTER TABLE issues ADD COLUMN {TIER_COLUMN} TEXT; "
+                f"or turn ASSESS_DEGRADE off"
+            ) from e
+
+    async def _request(self, stage, method, path, **kwargs):
+        self.requests += 1
+        with metrics.STAGE_SECONDS.time(stage=stage):
+            response = await self._client.request(method, path, **kwargs)
+        response.raise_for_status()
+        return response.json() if response.content else None
+
+    async def claim_issue(self, issue_id: str) -> Optional[dict]:
+        """Mark an issue Processing and return its assessment columns, None if it does not exist"""
+        rows = await self._request(
+            "db_claim", "PATCH", "/issues",
+            params={"id": f"eq.{issue_id}", "select": ISSUE_COLUMNS},
+            json={"status": "Processing"},
+            headers={"Prefer": "return=representation"},
+        )
+        return rows[0] if rows else None
+
+    async def fetch_status(self, issue_id: str) -> Optional[dict]:
+        return await self.status_flights.do(issue_id, self._fetch_status, issue_id)
+
+    async def _fetch_status(self, issue_id: str) -> Optional[dict]:
+        rows = await self._request("db_read", "GET", "/issues", params={"id": f"eq.{issue_id}", "select": self.status_columns})
+        return rows[0] if rows else None
+
+    async def fetch_issues(self, issue_ids: List[str], columns: str = URGENCY_COLUMNS) -> Dict[str, dict]:
+        """Rows of the given issues by id, in one in.() query; missing issues are left out"""
+        if not issue_ids:
+            return {}
+        rows = await self._request("db_read", "GET", "/issues", params={"id": f"in.({','.join(issue_ids)})", "select": columns})
+        return {row["id"]: row for row in rows or []}
+
+    async def fetch_reporter_scores(self, user_ids: List[str], per_user: int = 20) -> Dict[str, List[int]]:
+        """Most recent assessed priority scores of each reporter, in one query"""
+        if not user_ids:
+            return {}
+        rows = await self._request("db_read", "GET", "/issues", params={
+            "user_id": f"in.({','.join(user_ids)})",
+            "priority_score": "not.is.null",
+            "select": "user_id,priority_score",
+            "order": "created_at.desc",
+            "limit": str(per_user * len(user_ids)),
+        })
+        scores = {user_id: [] for user_id in user_ids}
+        for row in rows or []:
+            if len(scores[row["user_id"]]) < per_user:
+                scores[row["user_id"]].append(row["priority_score"])
+        return scores
+
+    @staticmethod
+    def _filter_params(statuses: Optional[Sequence[str]], created_after: Optional[str],
+                       created_before: Optional[str]) -> list:
+        params = []
+        if statuses:
+            # Quoted, statuses may contain spaces or commas
+            params.append(("status", "in.(" + ",".join(f'"{status}"' for status in statuses) + ")"))
+        if created_after:
+            params.append(("created_at", f"gte.{created_after}"))
+        if created_before:
+            params.append(("created_at", f"lt.{created_before}"))
+        return params
+
+    async def page_issues(self, after_id: Optional[str] = None, limit: int = 100,
+                          statuses: Optional[Sequence[str]] = None, created_after: Optional[str] = None,
+                          created_before: Optional[str] = None, columns: str = ISSUE_COLUMNS) -> List[dict]:
+        """
+        One page of issues in id order, starting after after_id
+
+        Keyset pagination: each page is an index range scan on the primary key that
+        costs the same however deep into the table it is, where OFFSET would read and
+        throw away every row before it. Rows inserted behind the cursor are not seen.
+        """
+        params = [("select", columns), ("order", "id.asc"), ("limit", str(limit))]
+        params += self._filter_params(statuses, created_after, created_before)
+        if after_id:
+            params.append(("id", f"gt.{after_id}"))
+        return await self._request("db_read", "GET", "/issues", params=params) or []
+
+    async def count_issues(self, after_id: Optional[str] = None, statuses: Optional[Sequence[str]] = None,
+                           created_after: Optional[str] = None, created_before: Optional[str] = None) -> Optional[int]:
+        """Number of issues page_issues would still return, None if the server does not say"""
+        params = [("select", "id")] + self._filter_params(statuses, created_after, created_before)
+        if after_id:
+            params.append(("id", f"gt.{after_id}"))
+        self.requests += 1
+        with metrics.STAGE_SECONDS.time(stage="db_read"):
+            response = await self._client.head("/issues", params=params, headers={"Prefer": "count=exact"})
+        response.raise_for_status()
+        # Content-Range: 0-99/1234, or */0 when nothing matches
+        total = response.headers.get("content-range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+
+    async def update_issue(self, issue_id: str, fields: dict) -> bool:
+        """Update one issue, False if it no longer exists"""
+        rows = await self._request(
+            "db_write", "PATCH", "/issues",
+            params={"id": f"eq.{issue_id}", "select": "id"},
+            json=fields,
+            headers={"Prefer": "return=representation"},
+        )
+        return bool(rows)
+
+    async def save_assessment(self, issue_id: str, title: str, fields: dict) -> bool:
+        """Write an assessment result, through the bulk writer when coalescing"""
+        if not self.track_tier:
+            fields = {key: value for key, value in fields.items() if key != TIER_COLUMN}
+        if not self._writer:
+            return await self.update_issue(issue_id, fields)
+        future = asyncio.get_running_loop().create_future()
+        # title is NOT NULL, an upsert row has to carry it even though it never changes
+        await self._writes.put(({"id": issue_id, "title": title, **fields}, future))
+        return await future
+
+    def _drain(self):
+        batch = []
+        while len(batch) < self.write_batch_size and not self._writes.empty():
+            batch.append(self._writes.get_nowait())
+        return batch
+
+    async def _collect(self):
+        """Wait for one write, then keep gathering until the batch is full or the window closes"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._writes.get()]
+        deadline = loop.time() + self.coalesce
+
+        while len(batch) < self.write_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._writes.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run_writer(self):
+        while True:
+            await self._flush(await self._collect())
+
+    async def _flush(self, batch):
+        if not batch:
+            return
+        # PostgREST needs the same keys in every row of a bulk insert
+        columns = sorted({key for row, _ in batch for key in row})
+        rows = [{column: row.get(column) for column in columns} for row, _ in batch]
+        try:
+            written = await self._request(
+                "db_write", "POST", "/issues",
+                params={"on_conflict": "id", "columns": ",".join(columns), "select": "id"},
+                json=rows,
+                headers={"Prefer": "resolution=merge-duplicates,return=representation"},
+            )
+        except Exception as e:
+            logger.error(f"Bulk write of {len(batch)} assessments failed: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.bulk_writes += 1
+        self.rows_written += len(batch)
+        written_ids = {row["id"] for row in written or []}
+        for row, future in batch:
+            if not future.done():
+                future.set_result(row["id"] in written_ids)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "bulk_writes": self.bulk_writes,
+            "rows_written": self.rows_written,
+            "pending_writes": self._writes.qsize() if self._writes else 0,
+            "status_reads": self.status_flights.stats(),
+        }
@@ -0,0 +1,428 @@
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from collections import deque
+
+import metrics
+from urgency import PRIORITY_CLASSES
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised by enqueue when the queue is at capacity"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Assessment queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class PermanentJobError(Exception):
+    """Raised by a job handler for failures that retrying cannot fix"""
+
+
+class JobQueue:
+    """Durable, bounded assessment queue stored in a local SQLite (WAL) file.
+
+    Jobs survive restarts. A running job is leased to the queue that claimed it
+    for ``lease_seconds`` and the lease is renewed while the job runs, so
+    several API processes can share the file: a job whose lease ran out (its
+    process crashed or hung) goes back in the queue, a job another live process
+    is running is left alone. At most ``concurrency`` jobs run at once, enqueue refuses
+    work beyond ``max_pending`` so callers can apply backpressure, and failed jobs
+    are retried with exponential backoff until ``max_attempts`` is reached, after
+    which ``on_failure`` is called.
+
+    Jobs are served earliest deadline first. A job's deadline is its enqueue
+    time plus the budget of its priority class (``deadlines``), so a critical
+    report overtakes the backlog, while a low priority job that has waited long
+    enough has an earlier deadline than anything queued after it and cannot
+    starve.
+
+    An issue has at most one active job: enqueueing an issue that is already
+    queued or running attaches to that job (moving its deadline up if the new
+    request is more urgent) instead of assessing it twice.
+    """
+
+    def __init__(self, path="assessment_jobs.sqlite3", handler=None, on_failure=None, concurrency=2,
+                 max_pending=500, max_attempts=3, retry_base_seconds=5, poll_interval=1.0, deadlines=None,
+                 lease_seconds=60):
+        self.path = path
+        self.handler = handler
+        self.on_failure = on_failure
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        # Identifies this queue's leases among the processes sharing the file
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # Seconds from enqueue to deadline per priority class
+        self.deadlines = deadlines or {"critical": 10, "high": 60, "normal": 600, "low": 3600}
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.attached = 0
+        self._wait_times = {priority: deque(maxlen=1000) for priority in PRIORITY_CLASSES}
+        self._missed_deadlines = dict.fromkeys(PRIORITY_CLASSES, 0)
+        self._service_times = deque(maxlen=100)
+        self._wakeup = None
+        self._workers = []
+        self._heartbeat = None
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " issue_id TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " enqueued_at REAL NOT NULL,"
+            " next_run_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " last_error TEXT,"
+            " batch_id TEXT,"
+            " priority TEXT NOT NULL DEFAULT 'normal',"
+            " deadline REAL,"
+            " owner TEXT,"
+            " lease_expires_at REAL)"
+        )
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "batch_id" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN batch_id TEXT")
+        if "priority" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN priority TEXT NOT NULL DEFAULT 'normal'")
+            self._db.execute("ALTER TABLE jobs ADD COLUMN deadline REAL")
+            self._db.execute("UPDATE jobs SET deadline = enqueued_at + ?", (self.deadlines["normal"],))
+        if "owner" not in columns:
+            # Running jobs from before leases have none and count as expired
+            self._db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            self._db.execute("ALTER TABLE jobs ADD COLUMN lease_expires_at REAL")
+        self._db.execute("DROP INDEX IF EXISTS jobs_ready")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_deadline ON jobs (status, deadline)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_issue ON jobs (issue_id, status)")
+        self._db.commit()
+
+    async def start(self):
+        """Recover jobs with an expired lease and start the workers"""
+        self.prune()
+        self.recover_expired()
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        self._heartbeat = asyncio.create_task(self._renew_leases())
+
+    async def stop(self):
+        """Stop the workers and hand their interrupted jobs back to the queue"""
+        tasks = self._workers + ([self._heartbeat] if self._heartbeat else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._heartbeat = None
+        released = self._db.execute(
+            "UPDATE jobs SET status = 'queued', next_run_at = ?, owner = NULL, lease_expires_at = NULL"
+            " WHERE status = 'running' AND owner = ?",
+            (time.time(), self.owner),
+        ).rowcount
+        self._db.commit()
+        if released:
+            logger.info(f"Re-queued {released} assessment jobs interrupted by shutdown")
+        self._db.close()
+
+    def recover_expired(self):
+        """Put running jobs whose lease ran out back in the queue; returns how many"""
+        now = time.time()
+        recovered = self._db.execute(
+            "UPDATE jobs SET status = 'queued', next_run_at = ?, owner = NULL, lease_expires_at = NULL"
+            " WHERE status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?)",
+            (now, now),
+        ).rowcount
+        self._db.commit()
+        if recovered:
+            logger.warning(f"Re-queued {recovered} assessment jobs whose lease expired")
+            if self._wakeup:
+                self._wakeup.set()
+        return recovered
+
+    async def _renew_leases(self):
+        """Keep this queue's leases alive and pick up the jobs of queues that died"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                self._db.execute(
+                    "UPDATE jobs SET lease_expires_at = ? WHERE status = 'running' AND owner = ?",
+                    (time.time() + self.lease_seconds, self.owner),
+                )
+                self._db.commit()
+                self.recover_expired()
+            except Exception as e:
+                # An open transaction would make the next BEGIN IMMEDIATE on this connection fail
+                self._db.rollback()
+                logger.error(f"Renewing assessment job leases failed: {str(e)}")
+
+    def pending_count(self):
+        return self._db.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+
+    def active_status(self, issue_id):
+        """'queued' or 'running' while the issue has an active job, None otherwise"""
+        row = self._db.execute(
+            "SELECT status FROM jobs WHERE issue_id = ? AND status IN ('queued', 'running')", (issue_id,)
+        ).fetchone()
+        return row["status"] if row else None
+
+    def retry_after(self):
+        """Seconds until a slot is likely to free up, for the Retry-After header"""
+        service_time = sum(self._service_times) / len(self._service_times) if self._service_times else 30
+        # A full queue accepts work again as soon as any running job finishes
+        return max(1, round(service_time / self.concurrency))
+
+    def _attach(self, issue_id, priority, now):
+        """Id of the issue's queued or running job, None if there is none; must run inside a transaction"""
+        job = self._db.execute(
+            "SELECT id, status, deadline FROM jobs WHERE issue_id = ? AND status IN ('queued', 'running')", (issue_id,)
+        ).fetchone()
+        if job is None:
+            return None
+        deadline = now + self.deadlines[priority]
+        if job["status"] == "queued" and deadline < job["deadline"]:
+            self._db.execute("UPDATE jobs SET priority = ?, deadline = ? WHERE id = ?", (priority, deadline, job["id"]))
+        self.attached += 1
+        metrics.JOBS.inc(outcome="attached")
+        return job["id"]
+
+    def enqueue(self, issue_id, priority="normal"):
+        """Persist a job and wake a worker; raises QueueFullError at capacity.
+
+        Returns the job id and whether it is an already active job of the issue.
+        """
+        now = time.time()
+        # Check and insert under the write lock, other API processes may share the file
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            job_id = self._attach(issue_id, priority, now)
+            if job_id:
+                self._db.commit()
+                return job_id, True
+            if self.pending_count() >= self.max_pending:
+                raise QueueFullError(self.retry_after())
+            job_id = str(uuid.uuid4())
+            self._db.execute(
+                "INSERT INTO jobs (id, issue_id, status, enqueued_at, next_run_at, priority, deadline)"
+                " VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, issue_id, now, now, priority, now + self.deadlines[priority]),
+            )
+            self._db.commit()
+        except BaseException:
+            self._db.rollback()
+            raise
+        # Before start() the job just waits in the file
+        if self._wakeup:
+            self._wakeup.set()
+        return job_id, False
+
+    def enqueue_many(self, issue_ids, batch_id, priorities=None):
+        """Persist jobs for as many issues as there is room for, in one transaction.
+
+        ``priorities`` maps issue ids to their class, others are normal. Issues
+        with an active job attach to it and are not part of the batch. Returns
+        the newly queued and the attached issue ids; raises QueueFullError if
+        nothing could be accepted.
+        """
+        priorities = priorities or {}
+        now = time.time()
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            attached = [issue_id for issue_id in issue_ids if self._attach(issue_id, priorities.get(issue_id, "normal"), now)]
+            room = self.max_pending - self.pending_count()
+            if room <= 0 and not attached:
+                raise QueueFullError(self.retry_after())
+
+            # With too little room, the most urgent issues get the places
+            ranked = sorted(
+                (issue_id for issue_id in issue_ids if issue_id not in attached),
+                key=lambda issue_id: PRIORITY_CLASSES.index(priorities.get(issue_id, "normal")),
+            )
+            accepted = ranked[:max(room, 0)]
+            rows = []
+            for issue_id in accepted:
+                priority = priorities.get(issue_id, "normal")
+                rows.append((str(uuid.uuid4()), issue_id, now, now, batch_id, priority, now + self.deadlines[priority]))
+            self._db.executemany(
+                "INSERT INTO jobs (id, issue_id, status, enqueued_at, next_run_at, batch_id, priority, deadline)"
+                " VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._db.commit()
+        except BaseException:
+            self._db.rollback()
+            raise
+        if self._wakeup:
+            self._wakeup.set()
+        return accepted, attached
+
+    def batch_status(self, batch_id):
+        """Progress of a bulk submission, None if the batch is unknown or already pruned"""
+        rows = self._db.execute(
+            "SELECT issue_id, status, priority, attempts, last_error FROM jobs WHERE batch_id = ? ORDER BY rowid",
+            (batch_id,)
+        ).fetchall()
+        if not rows:
+            return None
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        for row in rows:
+            counts[row["status"]] += 1
+        return {
+            "batch_id": batch_id,
+            "total": len(rows),
+            **counts,
+            "finished": counts["done"] + counts["failed"] == len(rows),
+            "jobs": [dict(row) for row in rows],
+        }
+
+    def _claim(self):
+        """Mark the runnable job with the earliest deadline as running and return it"""
+        now = time.time()
+        row = self._db.execute(
+            "SELECT * FROM jobs WHERE status = 'queued' AND next_run_at <= ? ORDER BY deadline, enqueued_at LIMIT 1",
+            (now,),
+        ).fetchone()
+        if row is None:
+            return None
+        # Several API processes may share the file, only one of them wins the job
+        claimed = self._db.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, owner = ?, lease_expires_at = ?"
+            " WHERE id = ? AND status = 'queued'",
+            (now, self.owner, now + self.lease_seconds, row["id"]),
+        ).rowcount
+        self._db.commit()
+        if not claimed:
+            return None
+        if row["attempts"] == 0:
+            priority = row["priority"]
+            self._wait_times[priority].append(now - row["enqueued_at"])
+            metrics.STAGE_SECONDS.observe(now - row["enqueued_at"], stage="queue_wait")
+            metrics.QUEUE_WAIT_SECONDS.observe(now - row["enqueued_at"], priority=priority)
+            if now > row["deadline"]:
+                self._missed_deadlines[priority] += 1
+                metrics.MISSED_DEADLINES.inc(priority=priority)
+        return row
+
+    def _finish(self, job_id, status, error=None):
+        # A job whose lease lapsed may already be running elsewhere, leave it to that run
+        updated = self._db.execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, last_error = ?, owner = NULL, lease_expires_at = NULL"
+            " WHERE id = ? AND owner = ?",
+            (status, time.time(), error, job_id, self.owner),
+        ).rowcount
+        self._db.commit()
+        if not updated:
+            logger.warning(f"Assessment job {job_id} lost its lease before it finished")
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            job = self._claim()
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job):
+        issue_id = job["issue_id"]
+        attempt = job["attempts"] + 1
+        started = time.perf_counter()
+        try:
+            await self.handler(issue_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if isinstance(e, PermanentJobError) or attempt >= self.max_attempts:
+                logger.error(f"Assessment job for issue {issue_id} failed after {attempt} attempts: {str(e)}")
+                self._finish(job["id"], "failed", str(e))
+                self.failed += 1
+                metrics.JOBS.inc(outcome="failed")
+                if self.on_failure:
+                    try:
+                        await self.on_failure(issue_id, e)
+                    except Exception as failure_error:
+                        logger.error(f"Failure handler for issue {issue_id} raised: {str(failure_error)}")
+            else:
+                delay = self.retry_base_seconds * 2 ** (attempt - 1)
+                logger.warning(f"Assessment job for issue {issue_id} failed (attempt {attempt}), retrying in {delay}s: {str(e)}")
+                self._db.execute(
+                    "UPDATE jobs SET status = 'queued', next_run_at = ?, last_error = ?, owner = NULL,"
+                    " lease_expires_at = NULL WHERE id = ? AND owner = ?",
+                    (time.time() + delay, str(e), job["id"], self.owner),
+                )
+                self._db.commit()
+                self.retried += 1
+                metrics.JOBS.inc(outcome="retried")
+            return
+
+        self._service_times.append(time.perf_counter() - started)
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage="job")
+        self._finish(job["id"], "done")
+        self.completed += 1
+        metrics.JOBS.inc(outcome="done")
+
+    def stats(self):
+        """Queue depth and wait times for capacity planning"""
+        counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        oldest = self._db.execute("SELECT MIN(enqueued_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        queued_by_priority = dict(self._db.execute(
+            "SELECT priority, COUNT(*) FROM jobs WHERE status = 'queued' GROUP BY priority"
+        ).fetchall())
+
+        def percentile(waits, fraction):
+            return round(waits[int(fraction * (len(waits) - 1))], 3) if waits else None
+
+        by_priority = {}
+        for priority, class_waits in self._wait_times.items():
+            class_waits = sorted(class_waits)
+            by_priority[priority] = {
+                "queued": queued_by_priority.get(priority, 0),
+                "deadline_seconds": self.deadlines[priority],
+                "wait_seconds_p50": percentile(class_waits, 0.5),
+                "wait_seconds_p95": percentile(class_waits, 0.95),
+                "wait_seconds_p99": percentile(class_waits, 0.99),
+                "wait_seconds_max": round(class_waits[-1], 3) if class_waits else None,
+                "missed_deadlines": self._missed_deadlines[priority],
+            }
+        waits = sorted(wait for class_waits in self._wait_times.values() for wait in class_waits)
+
+        return {
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "capacity": self.max_pending,
+            "concurrency": self.concurrency,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "attached": self.attached,
+            "oldest_queued_seconds": round(time.time() - oldest, 1) if oldest else 0,
+            "wait_seconds_p50": percentile(waits, 0.5),
+            "wait_seconds_p95": percentile(waits, 0.95),
+            "wait_seconds_max": waits[-1] if waits else None,
+            "by_priority": by_priority,
+        }
+
+    def prune(self, older_than_seconds=86400):
+        """Delete finished jobs older than the cutoff"""
+        self._db.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+            (time.time() - older_than_seconds,),
+        )
+        self._db.commit()
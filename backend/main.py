@@ -1,9 +1,9 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic import BaseModel
 from typing import Optional, List
 import asyncio
 import httpx
-from supabase import create_client, Client
 import os
 from datetime import datetime
 import logging
@@ -11,9 +11,78 @@ from dotenv import load_dotenv
 from contextlib import asynccontextmanager
 load_dotenv()
 import uuid
+import json
+import time
 
 # Import your existing damage assessor
-from img import InfrastructureDamageAssessor
+from img import InfrastructureDamageAssessor, InferenceUnavailableError, combine_image_results, PROMPT_VERSION
+from batching import BatchScheduler
+from fetcher import ImageFetcher
+from result_cache import AssessmentCache
+from dedup import NearDuplicateIndex, hash_image_bytes
+from job_queue import JobQueue, QueueFullError, PermanentJobError
+from worker_pool import RemoteAssessor
+from issue_store import IssueStore
+from status_cache import StatusCache, TERMINAL_STATUSES
+from triage import ImageTriage
+from urgency import UrgencyEstimator
+from singleflight import SingleFlight
+from degradation import LoadController, lowest_tier
+import metrics
+from config import (
+    ASSESS_BATCH_SIZE,
+    ASSESS_BATCH_WAIT_MS,
+    ASSESS_PIPELINE,
+    ASSESS_PREFETCH_BATCHES,
+    ASSESS_QUEUE_SIZE,
+    ASSESS_DEGRADE,
+    ASSESS_DEGRADE_QUEUE_DEPTHS,
+    ASSESS_DEGRADE_LATENCY_SECONDS,
+    ASSESS_DEGRADE_RECOVERY_RATIO,
+    ASSESS_DEGRADE_MIN_DWELL_SECONDS,
+    MAX_IMAGES_PER_ISSUE,
+    MULTI_IMAGE_COMBINE,
+    IMAGE_FETCH_MAX_CONNECTIONS,
+    IMAGE_FETCH_MAX_PER_HOST,
+    IMAGE_FETCH_MAX_BYTES,
+    IMAGE_FETCH_CONNECT_TIMEOUT,
+    IMAGE_FETCH_READ_TIMEOUT,
+    RESULT_CACHE_PATH,
+    RESULT_CACHE_MEMORY_ENTRIES,
+    RESULT_CACHE_MAX_MB,
+    DEDUP_ENABLED,
+    DEDUP_INDEX_PATH,
+    DEDUP_MAX_DISTANCE,
+    DEDUP_SAVE_EVERY,
+    JOB_QUEUE_PATH,
+    JOB_QUEUE_CONCURRENCY,
+    JOB_QUEUE_MAX_PENDING,
+    JOB_QUEUE_MAX_ATTEMPTS,
+    JOB_QUEUE_RETRY_BASE_SECONDS,
+    JOB_QUEUE_LEASE_SECONDS,
+    JOB_QUEUE_DEADLINES,
+    URGENCY_CLUSTER_RADIUS_M,
+    URGENCY_CLUSTER_SIZE,
+    URGENCY_CLUSTER_WINDOW_SECONDS,
+    MAX_BULK_ISSUES,
+    STATUS_CACHE_TTL_SECONDS,
+    STATUS_CACHE_PENDING_TTL_SECONDS,
+    STATUS_CACHE_MAX_ENTRIES,
+    STATUS_EVENTS_KEEPALIVE_SECONDS,
+    INFERENCE_WORKERS,
+    INFERENCE_AUTHKEY,
+    require_inference_authkey,
+    SUPABASE_REST_URL,
+    SUPABASE_SERVICE_KEY,
+    DB_MAX_CONNECTIONS,
+    DB_TIMEOUT,
+    DB_WRITE_COALESCE_MS,
+    DB_WRITE_BATCH_SIZE,
+    MODEL_WARMUP,
+    TRIAGE_MODEL_PATH,
+    TRIAGE_THRESHOLD,
+    assessor_options,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -21,25 +90,165 @@ logger = logging.getLogger(__name__)
 
 # Initialize the damage assessor globally
 assessor = None
+batcher = None
+fetcher = None
+result_cache = None
+dedup_index = None
+job_queue = None
+issue_store = None
+triage = None
+urgency = None
+load_controller = None
+# One in-flight assessment per identical image + report across issues; issues themselves
+# are deduplicated by the job queue, which attaches a repeat request to the active job
+image_flights = SingleFlight("image")
+# Answers status polls and feeds the event stream, updated at every job transition
+status_cache = StatusCache(STATUS_CACHE_TTL_SECONDS, STATUS_CACHE_MAX_ENTRIES,
+                           pending_ttl_seconds=STATUS_CACHE_PENDING_TTL_SECONDS)
+# Startup progress reported by /readyz; the model loads in the background
+model_state = {"phase": "starting", "error": None, "phase_seconds": {}, "cold_start_seconds": None}
+_phase_started = time.perf_counter()
+_model_loader = None
+
+def set_model_phase(phase: str):
+    """Move startup to its next phase, recording how long the previous one took"""
+    global _phase_started
+    now = time.perf_counter()
+    previous = model_state["phase"]
+    model_state["phase_seconds"][previous] = round(now - _phase_started, 2)
+    metrics.STARTUP_SECONDS.set(now - _phase_started, phase=previous)
+    model_state["phase"] = phase
+    _phase_started = now
+    logger.info(f"Startup phase: {phase} ({previous} took {model_state['phase_seconds'][previous]}s)")
+
+def build_assessor():
+    """Load the model (or only the processor for remote inference) and warm it up; runs in a thread"""
+    if INFERENCE_WORKERS:
+        # The model lives in inference_server.py processes, which warm themselves up
+        return RemoteAssessor(INFERENCE_WORKERS, INFERENCE_AUTHKEY, on_progress=set_model_phase, **assessor_options())
+    loaded = InfrastructureDamageAssessor(on_progress=set_model_phase, **assessor_options())
+    if MODEL_WARMUP:
+        loaded.warm_up()
+    return loaded
+
+async def load_model_in_background(started: float):
+    """Second startup phase: the API already answers while this runs"""
+    global assessor, batcher, triage, load_controller
+    try:
+        loaded = await asyncio.to_thread(build_assessor)
+    except Exception as e:
+        model_state["error"] = str(e)
+        set_model_phase("failed")
+        logger.error(f"Model failed to load: {str(e)}")
+        return
+    
+    if TRIAGE_MODEL_PATH:
+        set_model_phase("loading_triage")
+        try:
+            triage = await asyncio.to_thread(ImageTriage, TRIAGE_MODEL_PATH, TRIAGE_THRESHOLD)
+        except Exception as e:
+            # Triage only saves time, assessments still work without it
+            logger.error(f"Triage model failed to load, assessing every image with the full model: {str(e)}")
+
+    assessor = loaded
+    if ASSESS_DEGRADE:
+        # Queued and running jobs are the backlog the tiers have to keep in check
+        load_controller = LoadController(
+            job_queue.pending_count,
+            depth_thresholds=ASSESS_DEGRADE_QUEUE_DEPTHS,
+            latency_thresholds=ASSESS_DEGRADE_LATENCY_SECONDS,
+            recovery_ratio=ASSESS_DEGRADE_RECOVERY_RATIO,
+            min_dwell_seconds=ASSESS_DEGRADE_MIN_DWELL_SECONDS,
+        )
+    # With remote inference every worker can run a batch at the same time
+    batcher = BatchScheduler(
+        assessor,
+        ASSESS_BATCH_SIZE,
+        ASSESS_BATCH_WAIT_MS,
+        concurrency=len(INFERENCE_WORKERS) or 1,
+        pipelined=ASSESS_PIPELINE,
+        prefetch_batches=ASSESS_PREFETCH_BATCHES,
+        queue_size=ASSESS_QUEUE_SIZE,
+        controller=load_controller,
+    )
+    batcher.start()
+    # Jobs accepted while loading have been waiting in the queue, start working them off
+    await job_queue.start()
+    set_model_phase("ready")
+    model_state["cold_start_seconds"] = round(time.perf_counter() - started, 2)
+    metrics.STARTUP_SECONDS.set(model_state["cold_start_seconds"], phase="total")
+    logger.info(f"Model initialized successfully! Cold start took {model_state['cold_start_seconds']}s")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifecycle events for FastAPI"""
-    global assessor
-    logger.info("Initializing damage assessment model...")
-    assessor = InfrastructureDamageAssessor()
-    logger.info("Model initialized successfully!")
+    global fetcher, result_cache, dedup_index, job_queue, issue_store, urgency, _model_loader
+    started = time.perf_counter()
+    if INFERENCE_WORKERS:
+        require_inference_authkey()
+    issue_store = IssueStore(
+        SUPABASE_REST_URL,
+        SUPABASE_SERVICE_KEY,
+        max_connections=DB_MAX_CONNECTIONS,
+        timeout=DB_TIMEOUT,
+        coalesce_ms=DB_WRITE_COALESCE_MS,
+        write_batch_size=DB_WRITE_BATCH_SIZE,
+        track_tier=ASSESS_DEGRADE,
+    )
+    await issue_store.start()
+    result_cache = AssessmentCache(
+        RESULT_CACHE_PATH,
+        memory_entries=RESULT_CACHE_MEMORY_ENTRIES,
+        max_disk_bytes=RESULT_CACHE_MAX_MB * 1024 * 1024,
+    )
+    fetcher = ImageFetcher(
+        max_connections=IMAGE_FETCH_MAX_CONNECTIONS,
+        max_connections_per_host=IMAGE_FETCH_MAX_PER_HOST,
+        max_bytes=IMAGE_FETCH_MAX_BYTES,
+        connect_timeout=IMAGE_FETCH_CONNECT_TIMEOUT,
+        read_timeout=IMAGE_FETCH_READ_TIMEOUT,
+    )
+    await fetcher.start()
+    if DEDUP_ENABLED:
+        dedup_index = NearDuplicateIndex(DEDUP_INDEX_PATH, max_distance=DEDUP_MAX_DISTANCE)
+        await asyncio.to_thread(dedup_index.load)
+    job_queue = JobQueue(
+        JOB_QUEUE_PATH,
+        handler=process_issue_assessment,
+        on_failure=mark_issue_error,
+        concurrency=JOB_QUEUE_CONCURRENCY,
+        max_pending=JOB_QUEUE_MAX_PENDING,
+        max_attempts=JOB_QUEUE_MAX_ATTEMPTS,
+        retry_base_seconds=JOB_QUEUE_RETRY_BASE_SECONDS,
+        deadlines=JOB_QUEUE_DEADLINES,
+        lease_seconds=JOB_QUEUE_LEASE_SECONDS,
+    )
+    urgency = UrgencyEstimator(
+        issue_store,
+        cluster_radius_m=URGENCY_CLUSTER_RADIUS_M,
+        cluster_window_seconds=URGENCY_CLUSTER_WINDOW_SECONDS,
+        cluster_size=URGENCY_CLUSTER_SIZE,
+    )
+    # The API serves requests from here on; new jobs wait in the queue until the model is ready
+    logger.info("Initializing damage assessment model in the background...")
+    set_model_phase("loading")
+    _model_loader = asyncio.create_task(load_model_in_background(started))
     yield
     # Any cleanup code can go here
     logger.info("Shutting down model...")
+    _model_loader.cancel()
+    await job_queue.stop()
+    if batcher:
+        await batcher.stop()
+    await fetcher.close()
+    result_cache.close()
+    await issue_store.close()
+    if dedup_index:
+        await asyncio.to_thread(dedup_index.save)
 
 # Initialize FastAPI app
 app = FastAPI(title="Infrastructure Damage Assessment API", version="1.0.0", lifespan=lifespan)
 
-SUPABASE_URL = os.getenv("SUPABASE_URL",)
-SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY", )
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-
 # Pydantic models
 class IssueRequest(BaseModel):
     issue_id: str
@@ -47,15 +256,45 @@ class IssueRequest(BaseModel):
 class AssessmentResponse(BaseModel):
     success: bool
     message: str
+    priority: Optional[str] = None
     priority_score: Optional[int] = None
     error: Optional[str] = None
 
+class BulkIssueRequest(BaseModel):
+    issue_ids: List[str]
+
+class BulkIssueResult(BaseModel):
+    issue_id: str
+    accepted: bool
+    priority: Optional[str] = None
+    attached: bool = False
+    error: Optional[str] = None
+
+class BulkAssessmentResponse(BaseModel):
+    batch_id: Optional[str] = None
+    accepted: int
+    rejected: int
+    results: List[BulkIssueResult]
+
 class IssueData(BaseModel):
     id: str
     title: str
     description: str
     image_urls: List[str]
     status: str
+def record_status(issue_id: str, status: str, priority_score: Optional[int] = None,
+                  reasoning: Optional[str] = None, assessed_at: Optional[str] = None,
+                  assessment_tier: Optional[str] = None, publish: bool = True):
+    """Cache an issue's status; pipeline transitions are also pushed to event subscribers"""
+    status_cache.set(issue_id, {
+        "issue_id": issue_id,
+        "status": status,
+        "priority_score": priority_score,
+        "reasoning": reasoning,
+        "assessed_at": assessed_at,
+        "assessment_tier": assessment_tier
+    }, publish=publish)
+
 def validate_uuid(issue_id: str) -> Optional[str]:
     try:
         issue_uuid = str(uuid.UUID(issue_id))
@@ -65,44 +304,43 @@ def validate_uuid(issue_id: str) -> Optional[str]:
         logger.error(f"❌ Invalid UUID format: {e}")
         return None
 
-async def fetch_issue_from_supabase(issue_id: str) -> Optional[IssueData]:
-    """Fetch issue data from Supabase"""
+async def claim_issue(issue_id: str) -> Optional[IssueData]:
+    """Mark an issue Processing and fetch it in the same request, None if it does not exist"""
     try:
-        # Supabase Python client is synchronous, so we offload it to a thread
-        response = await asyncio.to_thread(
-            lambda: supabase.table('issues').select('*').eq('id', issue_id).execute()
-        )
-        
-        if not response.data:
-            logger.error(f"No issue found with ID: {issue_id}")
-            return None
-            
-        issue = response.data[0]
-        return IssueData(
-            id=issue['id'],
-            title=issue['title'],
-            description=issue['description'],
-            image_urls=issue.get('image_urls', []),
-            status=issue['status']
-        )
-        
+        issue = await issue_store.claim_issue(issue_id)
     except Exception as e:
+        # Connection problems are worth a retry, let the job queue see them
         logger.error(f"Error fetching issue {issue_id}: {str(e)}")
+        raise
+    
+    if not issue:
+        logger.error(f"No issue found with ID: {issue_id}")
         return None
+        
+    return IssueData(
+        id=issue['id'],
+        title=issue['title'],
+        description=issue.get('description') or '',
+        image_urls=issue.get('image_urls') or [],
+        status=issue['status']
+    )
 
-async def update_issue_priority(issue_id: str, priority_score: int, reasoning: str) -> bool:
+async def update_issue_priority(issue: IssueData, priority_score: int, reasoning: str,
+                                assessment_tier: Optional[str] = None) -> bool:
     """Update issue priority score in Supabase"""
+    issue_id = issue.id
+    assessed_at = datetime.utcnow().isoformat()
     try:
-        response = await asyncio.to_thread(
-            lambda: supabase.table('issues').update({
-                'priority_score': priority_score,
-                'assessment_reasoning': reasoning,
-                'status': 'Assessed',
-                'assessed_at': datetime.utcnow().isoformat()
-            }).eq('id', issue_id).execute()
-        )
+        saved = await issue_store.save_assessment(issue_id, issue.title, {
+            'priority_score': priority_score,
+            'assessment_reasoning': reasoning,
+            'status': 'Assessed',
+            'assessed_at': assessed_at,
+            'assessment_tier': assessment_tier
+        })
         
-        if response.data:
+        if saved:
+            record_status(issue_id, 'Assessed', priority_score, reasoning, assessed_at, assessment_tier)
             logger.info(f"Successfully updated priority score for issue {issue_id}: {priority_score}")
             return True
         else:
@@ -113,6 +351,70 @@ async def update_issue_priority(issue_id: str, priority_score: int, reasoning: s
         logger.error(f"Error updating issue {issue_id}: {str(e)}")
         return False
 
+async def assess_image(issue: IssueData, image: bytes) -> dict:
+    """Assess one image of an issue, answering from the result cache when possible"""
+    cache_key = AssessmentCache.make_key(image, issue.title, issue.description, PROMPT_VERSION, assessor.cache_identity())
+    # SQLite lookups stay off the event loop
+    cached = await asyncio.to_thread(result_cache.get, cache_key)
+    metrics.CACHE_LOOKUPS.inc(cache="result", result="miss" if cached is None else "hit")
+    if cached is not None:
+        logger.info(f"Result cache hit for issue {issue.id}")
+        return cached
+    # The same image and report already being assessed (another issue, a re-upload) is awaited, not redone
+    return await image_flights.do(cache_key, assess_uncached_image, issue, image, cache_key)
+
+async def assess_uncached_image(issue: IssueData, image: bytes, cache_key: str) -> dict:
+    """Near-duplicate lookup, triage and the full assessment of an image the result cache does not know"""
+    image_hash = None
+    if dedup_index:
+        image_hash = await asyncio.to_thread(hash_image_bytes, image)
+        duplicate = dedup_index.find(image_hash, exclude_issue_id=issue.id)
+        metrics.CACHE_LOOKUPS.inc(cache="near_duplicate", result="hit" if duplicate else "miss")
+        if duplicate:
+            logger.info(f"Issue {issue.id} is a near-duplicate of issue {duplicate['issue_id']} (distance {duplicate['distance']})")
+            return {
+                "priority_score": duplicate["priority_score"],
+                "reasoning": f"Near-duplicate of already assessed issue {duplicate['issue_id']} "
+                             f"(image hash distance {duplicate['distance']}); reusing its priority score.",
+                "duplicate_of": duplicate["issue_id"]
+            }
+    
+    if triage:
+        try:
+            decision = await asyncio.to_thread(triage.classify, image)
+        except Exception as e:
+            # Undecodable images are reported by the full assessment
+            logger.warning(f"Triage failed for issue {issue.id}: {str(e)}")
+            decision = None
+        if decision and decision["gated"]:
+            logger.info(f"Triage scored an image of issue {issue.id} as {decision['group']} ({decision['confidence']})")
+            return triage.gated_result(decision)
+    
+    started = time.perf_counter()
+    result = await batcher.submit(issue.title, issue.description, image)
+    if triage:
+        triage.record_full_assessment(time.perf_counter() - started)
+    # Failures and results of a degraded tier are not cached, so a retry or a later
+    # assessment of the same image gets a fresh, full-quality attempt
+    if "error" not in result and result.get("assessment_tier", "full") == "full":
+        await asyncio.to_thread(result_cache.put, cache_key, result)
+        if image_hash is not None:
+            record_image_hash(image_hash, result.get("priority_score", 0), issue.id)
+    return result
+
+def record_image_hash(image_hash: int, priority_score: int, issue_id: str):
+    """Add an assessed image to the near-duplicate index, saving it every so often"""
+    dedup_index.add(image_hash, priority_score, issue_id)
+    if dedup_index.unsaved_changes >= DEDUP_SAVE_EVERY:
+        asyncio.create_task(asyncio.to_thread(dedup_index.save))
+
+async def image_load_failure() -> dict:
+    return {
+        "priority_score": 0,
+        "error": "Failed to load image",
+        "reasoning": "Cannot assess damage without valid image"
+    }
+
 async def assess_issue_damage(issue: IssueData) -> Optional[dict]:
     """Assess damage for an issue using the AI model"""
     try:
@@ -122,18 +424,28 @@ async def assess_issue_damage(issue: IssueData) -> Optional[dict]:
                 "priority_score": 10,  # Default score
                 "reasoning": "No images provided for assessment. Using default priority score."
             }
-        image_url = issue.image_urls[0]
-        # Run the CPU/GPU heavy synchronous task in a separate thread so we don't block the async event loop
-        result = await asyncio.to_thread(
-            assessor.assess_damage,
-            issue.title,
-            issue.description,
-            image_url
-        )
+        image_urls = issue.image_urls[:MAX_IMAGES_PER_ISSUE]
+        # Download every image at once over the pooled connections
+        images = await fetcher.fetch_many(image_urls)
+        # Submitted together, the images land in the same batch and are decoded and
+        # preprocessed in parallel; the batcher keeps generation off the event loop
+        results = await asyncio.gather(*[
+            assess_image(issue, image)
+            if image is not None else image_load_failure()
+            for image in images
+        ])
+        result = combine_image_results(results, MULTI_IMAGE_COMBINE)
+        # An issue is only as good as its most degraded image
+        tier = lowest_tier(image_result.get("assessment_tier") for image_result in results)
+        if tier:
+            result = {**result, "assessment_tier": tier}
         
         logger.info(f"Assessment completed for issue {issue.id}: Score {result.get('priority_score', 0)}")
         return result
         
+    except InferenceUnavailableError:
+        # Not the issue's fault, let the job queue retry once a worker is back
+        raise
     except Exception as e:
         logger.error(f"Error assessing damage for issue {issue.id}: {str(e)}")
         return {
@@ -142,58 +454,61 @@ async def assess_issue_damage(issue: IssueData) -> Optional[dict]:
         }
 
 async def process_issue_assessment(issue_id: str):
-    """Background task to process issue assessment"""
+    """Queue job handler: assess one issue; raising makes the queue retry it"""
+    logger.info(f"Starting assessment for issue: {issue_id}")
+    
+    # Set status to 'Processing' and fetch the issue in one round trip
+    issue = await claim_issue(issue_id)
+    if not issue:
+        raise PermanentJobError("Issue not found")
+    record_status(issue_id, 'Processing')
+    
+    # Assess the damage
+    assessment_result = await assess_issue_damage(issue)
+    
+    # Update the issue with priority score
+    success = await update_issue_priority(
+        issue=issue,
+        priority_score=assessment_result.get('priority_score', 50),
+        reasoning=assessment_result.get('reasoning', 'Assessment completed'),
+        assessment_tier=assessment_result.get('assessment_tier')
+    )
+    if not success:
+        raise RuntimeError(f"Failed to update database for issue {issue_id}")
+    
+    logger.info(f"Successfully processed assessment for issue {issue_id}")
+
+async def mark_issue_error(issue_id: str, error: Exception):
+    """Record a job that ran out of retries as failed on the issue"""
+    reasoning = f"Assessment failed: {str(error)}"
+    record_status(issue_id, 'Error', reasoning=reasoning)
     try:
-        logger.info(f"Starting assessment for issue: {issue_id}")
-        
-        # Update status to 'Processing'
-        await asyncio.to_thread(
-            lambda: supabase.table('issues').update({
-                'status': 'Processing'
-            }).eq('id', issue_id).execute()
-        )
-        
-        # Fetch issue data
-        issue = await fetch_issue_from_supabase(issue_id)
-        if not issue:
-            raise HTTPException(status_code=404, detail="Issue not found")
-        
-        # Assess the damage
-        assessment_result = await assess_issue_damage(issue)
-        
-        if assessment_result:
-            # Update the issue with priority score
-            success = await update_issue_priority(
-                issue_id=issue_id,
-                priority_score=assessment_result.get('priority_score', 50),
-                reasoning=assessment_result.get('reasoning', 'Assessment completed')
-            )
-            
-            if success:
-                logger.info(f"Successfully processed assessment for issue {issue_id}")
-            else:
-                logger.error(f"Failed to update database for issue {issue_id}")
-        else:
-            logger.error(f"Assessment failed for issue {issue_id}")
-            
+        await issue_store.update_issue(issue_id, {
+            'status': 'Error',
+            'assessment_reasoning': reasoning
+        })
+    except Exception as db_error:
+        logger.error(f"Failed to update error status: {str(db_error)}")
+
+def reject_if_model_failed():
+    """While loading, work is queued; once loading has failed it is refused instead"""
+    if model_state["phase"] == "failed":
+        raise HTTPException(status_code=503, detail=f"Assessment model failed to load: {model_state['error']}")
+
+async def estimate_priorities(issues: List[dict]) -> dict:
+    """Priority class per issue id; falls back to normal so queueing never fails on the estimate"""
+    try:
+        estimates = await urgency.estimate_many(issues)
     except Exception as e:
-        logger.error(f"Error in background assessment for issue {issue_id}: {str(e)}")
-        # Update status to 'Error'
-        try:
-            await asyncio.to_thread(
-                lambda: supabase.table('issues').update({
-                    'status': 'Error',
-                    'assessment_reasoning': f"Assessment failed: {str(e)}"
-                }).eq('id', issue_id).execute()
-            )
-        except Exception as db_error:
-            logger.error(f"Failed to update error status: {str(db_error)}")
+        logger.warning(f"Urgency estimate failed, queueing as normal: {str(e)}")
+        return {issue["id"]: "normal" for issue in issues}
+    for issue_id, (priority, reasons) in estimates.items():
+        if reasons:
+            logger.info(f"Issue {issue_id} queued as {priority}: {', '.join(reasons)}")
+    return {issue_id: priority for issue_id, (priority, _) in estimates.items()}
 
 @app.post("/assess-issue", response_model=AssessmentResponse)
-async def assess_issue_endpoint(
-    request: IssueRequest, 
-    background_tasks: BackgroundTasks
-):
+async def assess_issue_endpoint(request: IssueRequest):
     """Endpoint to queue an issue for assessment"""
     try:
         # Validate UUID format
@@ -201,16 +516,44 @@ async def assess_issue_endpoint(
         if not validated_id:
             raise HTTPException(status_code=400, detail="Invalid UUID format")
 
-        # Add the assessment task to background tasks
-        background_tasks.add_task(process_issue_assessment, validated_id)
+        reject_if_model_failed()
+
+        # Urgent-looking reports get an earlier deadline and overtake the backlog
+        try:
+            issues = await issue_store.fetch_issues([validated_id])
+        except Exception as e:
+            logger.warning(f"Could not read issue {validated_id} for its urgency estimate: {str(e)}")
+            issues = {}
+        priority = (await estimate_priorities(list(issues.values()))).get(validated_id, "normal")
         
-        logger.info(f"Queued assessment for issue: {validated_id}")
+        # Persist the job; workers pick it up as capacity allows. A repeated request
+        # (double tap, admin retry) joins the issue's active job instead of adding one
+        _, attached = job_queue.enqueue(validated_id, priority)
+        
+        if attached:
+            logger.info(f"Issue {validated_id} already has an active assessment, attached to it")
+            message = f"Issue {validated_id} is already queued or being assessed"
+        else:
+            # An issue assessed before is no longer finished; its event streams stay open
+            record_status(validated_id, 'Queued')
+            logger.info(f"Queued assessment for issue: {validated_id} ({priority})")
+            message = f"Issue {validated_id} queued for assessment with {priority} priority"
         
         return AssessmentResponse(
             success=True,
-            message=f"Issue {validated_id} queued for assessment"
+            message=message + ("" if model_state["phase"] == "ready" else " (model is still loading)"),
+            priority=priority
         )
         
+    except QueueFullError as e:
+        logger.warning(f"Rejected assessment for issue {request.issue_id}: {str(e)}")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error queuing assessment: {str(e)}")
         raise HTTPException(
@@ -219,6 +562,68 @@ async def assess_issue_endpoint(
         )
 
 
+@app.post("/assess-issues", response_model=BulkAssessmentResponse)
+async def assess_issues_endpoint(request: BulkIssueRequest):
+    """Queue many issues at once; poll GET /assess-issues/{batch_id} for progress"""
+    reject_if_model_failed()
+    if len(request.issue_ids) > MAX_BULK_ISSUES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ISSUES} issue ids per request")
+
+    results = {}
+    candidates = []
+    for issue_id in request.issue_ids:
+        try:
+            validated_id = str(uuid.UUID(issue_id))
+        except ValueError:
+            results[issue_id] = BulkIssueResult(issue_id=issue_id, accepted=False, error="Invalid UUID format")
+            continue
+        # Repeated ids are assessed once
+        if validated_id not in results:
+            results[validated_id] = None
+            candidates.append(validated_id)
+
+    try:
+        existing = await issue_store.fetch_issues(candidates)
+        queueable = [issue_id for issue_id in candidates if issue_id in existing]
+        priorities = await estimate_priorities([existing[issue_id] for issue_id in queueable])
+        batch_id = str(uuid.uuid4())
+        accepted, attached = job_queue.enqueue_many(queueable, batch_id, priorities) if queueable else ([], [])
+        accepted, attached = set(accepted), set(attached)
+    except QueueFullError as e:
+        logger.warning(f"Rejected bulk assessment of {len(candidates)} issues: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        logger.error(f"Error queuing bulk assessment: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to queue assessments: {str(e)}")
+
+    for issue_id in candidates:
+        if issue_id in accepted:
+            record_status(issue_id, 'Queued')
+            results[issue_id] = BulkIssueResult(issue_id=issue_id, accepted=True, priority=priorities[issue_id])
+        elif issue_id in attached:
+            # Already queued or running on its own, so it is not tracked under this batch
+            results[issue_id] = BulkIssueResult(issue_id=issue_id, accepted=True, attached=True,
+                                                priority=priorities[issue_id])
+        else:
+            error = "Issue not found" if issue_id not in existing else "Assessment queue is full"
+            results[issue_id] = BulkIssueResult(issue_id=issue_id, accepted=False, error=error)
+
+    logger.info(f"Queued {len(accepted)} of {len(request.issue_ids)} issues as batch {batch_id}")
+    return BulkAssessmentResponse(
+        batch_id=batch_id if accepted else None,
+        accepted=len(accepted) + len(attached),
+        rejected=len(results) - len(accepted) - len(attached),
+        results=list(results.values())
+    )
+
+@app.get("/assess-issues/{batch_id}")
+async def get_batch_status(batch_id: str):
+    """Progress of a bulk assessment request"""
+    status = job_queue.batch_status(batch_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return status
+
 @app.get("/assessment-status/{issue_id}")
 async def get_assessment_status(issue_id: str):
     """Get the current assessment status of an issue"""
@@ -227,23 +632,29 @@ async def get_assessment_status(issue_id: str):
         if not validated_id:
             raise HTTPException(status_code=400, detail="Invalid UUID format")
 
-        response = await asyncio.to_thread(
-            lambda: supabase.table('issues').select(
-                'id, status, priority_score, assessment_reasoning, assessed_at'
-            ).eq('id', validated_id).execute()
-        )
+        cached = status_cache.get(validated_id)
+        if cached is not None:
+            return cached
+
+        issue = await issue_store.fetch_status(validated_id)
         
-        if not response.data:
+        if not issue:
             raise HTTPException(status_code=404, detail="Issue not found")
-            
-        issue = response.data[0]
-        return {
-            "issue_id": issue['id'],
-            "status": issue['status'],
-            "priority_score": issue.get('priority_score'),
-            "reasoning": issue.get('assessment_reasoning'),
-            "assessed_at": issue.get('assessed_at')
-        }
+
+        status = issue['status']
+        # The row keeps the previous outcome until a re-queued job starts
+        if status in TERMINAL_STATUSES and job_queue and job_queue.active_status(issue['id']) == 'queued':
+            status = 'Queued'
+        record_status(
+            issue['id'],
+            status,
+            issue.get('priority_score'),
+            issue.get('assessment_reasoning'),
+            issue.get('assessed_at'),
+            issue.get('assessment_tier'),
+            publish=False
+        )
+        return status_cache.get(issue['id'])
     except HTTPException:
         raise
     except Exception as e:
@@ -253,12 +664,111 @@ async def get_assessment_status(issue_id: str):
             detail=f"Failed to fetch assessment status: {str(e)}"
         )
 
+@app.get("/assessment-events")
+async def assessment_events(request: Request, issue_id: Optional[str] = None):
+    """Server-Sent Events stream of Queued/Processing/Assessed/Error transitions.
+
+    With issue_id the stream starts with the issue's current status and ends after
+    its assessment finishes; without it, transitions of every issue are streamed.
+    """
+    if issue_id is not None:
+        issue_id = validate_uuid(issue_id)
+        if not issue_id:
+            raise HTTPException(status_code=400, detail="Invalid UUID format")
+    # Subscribe before reading the current status so no transition falls in between
+    queue = status_cache.subscribe(issue_id)
+    current = None
+    if issue_id is not None:
+        try:
+            current = await get_assessment_status(issue_id)
+        except HTTPException:
+            status_cache.unsubscribe(queue, issue_id)
+            raise
+
+    def finished(status):
+        # A finished issue that was queued again is followed until the new job ends; a running
+        # job is the one that just reported this outcome
+        return status['status'] in TERMINAL_STATUSES and not (job_queue and job_queue.active_status(issue_id) == 'queued')
+
+    async def stream():
+        last = current
+        try:
+            if current is not None:
+                yield f"event: {current['status']}\ndata: {json.dumps(current)}\n\n"
+                if finished(current):
+                    return
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), STATUS_EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if issue_id is not None:
+                        # Jobs run by other processes sharing the queue are not pushed here,
+                        # so pick up their transitions from the database
+                        try:
+                            event = await get_assessment_status(issue_id)
+                        except HTTPException:
+                            event = last
+                    if issue_id is None or event['status'] == last['status']:
+                        # Comment lines keep proxies from closing an idle stream
+                        yield ": keepalive\n\n"
+                        continue
+                last = event
+                yield f"event: {event['status']}\ndata: {json.dumps(event)}\n\n"
+                if issue_id is not None and finished(event):
+                    return
+        finally:
+            status_cache.unsubscribe(queue, issue_id)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    if job_queue:
+        queue_stats = job_queue.stats()
+        metrics.QUEUE_DEPTH.set(queue_stats["queued"], status="queued")
+        metrics.QUEUE_DEPTH.set(queue_stats["running"], status="running")
+    if isinstance(assessor, RemoteAssessor):
+        for worker in assessor.worker_health():
+            peak = (worker["worker"] or {}).get("gpu_memory_peak_mb")
+            if peak is not None:
+                metrics.MEMORY_PEAK_BYTES.set(peak * 2**20, kind=f"gpu_allocated_worker_{worker['address']}")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/livez")
+async def liveness():
+    """Liveness probe: the process is up and serving, whatever the model is doing"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness probe: 200 once the model is loaded and warmed up, 503 with progress until then"""
+    body = {"ready": model_state["phase"] == "ready", **model_state}
+    if model_state["phase"] not in ("ready", "failed"):
+        body["phase_elapsed_seconds"] = round(time.perf_counter() - _phase_started, 2)
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
-        "model_loaded": assessor is not None,
+        "model_loaded": model_state["phase"] == "ready",
+        "model": model_state,
+        "batching": batcher.stats() if batcher else None,
+        "result_cache": result_cache.stats() if result_cache else None,
+        "near_duplicate_hashes": len(dedup_index) if dedup_index else None,
+        "queue": job_queue.stats() if job_queue else None,
+        "database": issue_store.stats() if issue_store else None,
+        "status_cache": status_cache.stats(),
+        "triage": triage.stats() if triage else None,
+        "quality_tier": load_controller.stats() if load_controller else None,
+        "single_flight": {
+            flights.name: flights.stats()
+            for flights in (image_flights, fetcher.flights if fetcher else None) if flights
+        },
+        "inference_workers": assessor.worker_health() if isinstance(assessor, RemoteAssessor) else None,
+        "inference_backend": assessor.backend.describe() if assessor and not isinstance(assessor, RemoteAssessor) else None,
         "timestamp": datetime.utcnow().isoformat()
     }
 
@@ -270,8 +780,14 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "assess_issue": "POST /assess-issue",
+            "assess_issues": "POST /assess-issues",
+            "batch_status": "GET /assess-issues/{batch_id}",
             "assessment_status": "GET /assessment-status/{issue_id}",
-            "health": "GET /health"
+            "assessment_events": "GET /assessment-events?issue_id={issue_id}",
+            "metrics": "GET /metrics",
+            "health": "GET /health",
+            "liveness": "GET /livez",
+            "readiness": "GET /readyz"
         }
     }
 
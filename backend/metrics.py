@@ -0,0 +1,204 @@
+"""Minimal Prometheus metrics for the assessment pipeline.
+
+Recording is a dict lookup and a few additions under a lock, cheap enough for
+every request. GET /metrics renders the registry in the Prometheus text format.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 40, 80, 160, 320)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if value not in (float("inf"), float("-inf")) else ("+Inf" if value > 0 else "-Inf")
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines += self._render_items(items)
+        return lines
+
+    def _render_items(self, items):
+        return [f"{self.name}{_label_text(self.labels, key)} {_number(value)}" for key, value in items]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_items(self, items):
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "assessment_stage_seconds",
+    "Time spent per pipeline stage: download, decode, preprocess, prefill, decode_tokens, generate, "
+    "queue_wait, job, db_claim, db_write, db_read, triage",
+    ["stage"],
+)
+PROMPT_TOKENS = Histogram("assessment_prompt_tokens", "Prompt tokens per assessed image, image tokens included",
+                          buckets=TOKEN_BUCKETS)
+IMAGE_TOKENS = Histogram("assessment_image_tokens", "Image tokens per assessed image", buckets=TOKEN_BUCKETS)
+GENERATED_TOKENS = Histogram("assessment_generated_tokens", "Generated tokens per assessed image",
+                             buckets=TOKEN_BUCKETS)
+DECODE_TOKENS_PER_SECOND = Histogram("assessment_decode_tokens_per_second",
+                                     "Generated tokens per second of decoding, summed over the batch",
+                                     buckets=RATE_BUCKETS)
+BATCH_SIZE = Histogram("assessment_batch_size", "Images per generate call", buckets=SIZE_BUCKETS)
+JOBS = Counter("assessment_jobs_total", "Finished assessment jobs by outcome", ["outcome"])
+CACHE_LOOKUPS = Counter("assessment_cache_lookups_total", "Result cache and near-duplicate lookups",
+                        ["cache", "result"])
+QUEUE_WAIT_SECONDS = Histogram("assessment_queue_wait_seconds", "Time from enqueue to first start per priority class",
+                               ["priority"])
+MISSED_DEADLINES = Counter("assessment_missed_deadlines_total", "Jobs started after their priority class deadline",
+                           ["priority"])
+QUEUE_DEPTH = Gauge("assessment_queue_jobs", "Jobs in the durable queue by status", ["status"])
+STARTUP_SECONDS = Gauge("assessment_startup_seconds", "Duration of each startup phase and of the whole cold start",
+                        ["phase"])
+SPECULATIVE_TOKENS = Counter("assessment_speculative_tokens_total",
+                             "Draft tokens proposed and accepted by speculative decoding; accepted / drafted "
+                             "is the acceptance rate", ["kind"])
+SINGLE_FLIGHT_CALLS = Counter("assessment_single_flight_calls_total",
+                              "Calls that ran the work (leader) or joined an identical call in flight (shared)",
+                              ["group", "role"])
+TRIAGE_DECISIONS = Counter("assessment_triage_decisions_total",
+                           "Triage outcomes: assess (sent to the full model), unrelated or fake (scored by triage)",
+                           ["decision"])
+TRIAGE_SAVED_SECONDS = Counter("assessment_triage_saved_seconds_total",
+                               "Estimated full-assessment time skipped by triage")
+PIPELINE_BUSY_SECONDS = Counter("assessment_pipeline_busy_seconds_total",
+                                "Time the batch scheduler's prepare and generate stages spent working; the "
+                                "generate rate is the fraction of time the model is busy", ["stage"])
+QUALITY_TIER = Gauge("assessment_quality_tier", "Current load-adaptive quality tier: 0 full, 1 short, 2 score_only")
+TIER_SWITCHES = Counter("assessment_quality_tier_switches_total", "Switches into each quality tier", ["tier"])
+TIER_ASSESSMENTS = Counter("assessment_quality_tier_assessments_total", "Images assessed per quality tier",
+                           ["tier"])
+MEMORY_PEAK_BYTES = Gauge("assessment_memory_peak_bytes", "High-water mark of process memory", ["kind"])
+
+
+def observe_generation(timings):
+    """Record the timings generate_answers reports for one batch"""
+    if not timings:
+        return
+    STAGE_SECONDS.observe(timings["generate"], stage="generate")
+    if timings.get("prefill") is not None:
+        STAGE_SECONDS.observe(timings["prefill"], stage="prefill")
+        STAGE_SECONDS.observe(timings["decode"], stage="decode_tokens")
+        if timings["decode"] > 0 and sum(timings["generated_tokens"]):
+            DECODE_TOKENS_PER_SECOND.observe(sum(timings["generated_tokens"]) / timings["decode"])
+    BATCH_SIZE.observe(len(timings["generated_tokens"]))
+    if timings.get("draft_tokens") is not None:
+        SPECULATIVE_TOKENS.inc(timings["draft_tokens"], kind="drafted")
+        SPECULATIVE_TOKENS.inc(timings["accepted_tokens"], kind="accepted")
+    for prompt_tokens, generated_tokens in zip(timings["prompt_tokens"], timings["generated_tokens"]):
+        PROMPT_TOKENS.observe(prompt_tokens)
+        GENERATED_TOKENS.observe(generated_tokens)
+
+
+def update_memory_peaks():
+    """Refresh the memory high-water marks of this process"""
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux
+        MEMORY_PEAK_BYTES.set(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, kind="cpu_rss")
+    try:
+        import torch
+    except ImportError:
+        return
+    if torch.cuda.is_available():
+        MEMORY_PEAK_BYTES.set(torch.cuda.max_memory_allocated(), kind="gpu_allocated")
+        MEMORY_PEAK_BYTES.set(torch.cuda.max_memory_reserved(), kind="gpu_reserved")
+
+
+def render():
+    """The whole registry in the Prometheus text exposition format"""
+    update_memory_peaks()
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
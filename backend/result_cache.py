@@ -0,0 +1,128 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class AssessmentCache:
+    """Two-tier cache of assessment results keyed by image content.
+
+    A small in-memory LRU answers repeat submissions instantly, and a SQLite file
+    keeps results across restarts. The disk tier is trimmed by least recent use
+    once the stored results exceed ``max_disk_bytes``.
+    """
+
+    def __init__(self, path="assessment_cache.sqlite3", memory_entries=1024, max_disk_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+        self._db.commit()
+        self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    @staticmethod
+    def make_key(image_bytes, heading, description, prompt_version, model_id):
+        """Content hash of everything that influences an assessment"""
+        digest = hashlib.sha256()
+        digest.update(hashlib.sha256(image_bytes).digest())
+        for field in (heading, description, prompt_version, model_id):
+            encoded = str(field or "").encode("utf-8")
+            # Length prefixes keep ("ab", "c") and ("a", "bc") from colliding
+            digest.update(len(encoded).to_bytes(8, "big"))
+            digest.update(encoded)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached result for key, or None"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return dict(self._memory[key])
+
+            row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._db.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            result = json.loads(row[0])
+            self._remember(key, result)
+            self.disk_hits += 1
+            return dict(result)
+
+    def put(self, key, result):
+        """Store a result in both tiers"""
+        value = json.dumps(result)
+        with self._lock:
+            self._remember(key, result)
+
+            previous = self._db.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()),
+            )
+            self._disk_bytes += len(value) - (previous[0] if previous else 0)
+            self._evict()
+            self._db.commit()
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        """Drop least recently used disk entries until under the size budget"""
+        while self._disk_bytes > self.max_disk_bytes:
+            rows = self._db.execute(
+                "SELECT key, size FROM results ORDER BY last_access LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                break
+            for key, size in rows:
+                self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._memory.pop(key, None)
+                self._disk_bytes -= size
+                if self._disk_bytes <= self.max_disk_bytes:
+                    break
+
+    def stats(self):
+        """Hit/miss counters for health reporting"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,52 @@
+import asyncio
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one execution.
+
+    The first caller for a key runs the coroutine; callers arriving while it is
+    in flight wait for the same result (or exception) instead of repeating the
+    work. Nothing is remembered once the call finishes, so this only removes
+    duplicate concurrent work, caching stays the job of the caches. The shared
+    call runs as its own task: a waiter that is cancelled does not cancel it for
+    the others.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.leaders = 0
+        self.shared = 0
+        self._calls = {}
+
+    async def do(self, key, function, *args, **kwargs):
+        """Await function(*args, **kwargs), or the identical call already running under key"""
+        call = self._calls.get(key)
+        if call is None:
+            self.leaders += 1
+            metrics.SINGLE_FLIGHT_CALLS.inc(group=self.name, role="leader")
+            call = asyncio.ensure_future(function(*args, **kwargs))
+            self._calls[key] = call
+            call.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.shared += 1
+            metrics.SINGLE_FLIGHT_CALLS.inc(group=self.name, role="shared")
+            logger.debug(f"{self.name}: joined the call in flight for {key}")
+        return await asyncio.shield(call)
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Mark the exception as retrieved even if every waiter was cancelled
+        if not call.cancelled():
+            call.exception()
+
+    def in_flight(self, key):
+        return key in self._calls
+
+    def stats(self):
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "shared": self.shared}
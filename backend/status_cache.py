@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Statuses after which an issue's event stream ends
+TERMINAL_STATUSES = ("Assessed", "Error")
+
+
+class StatusCache:
+    """Latest assessment status per issue, kept current by the pipeline itself.
+
+    Every state transition of a job is written here as well as to the database,
+    so status reads are answered from memory. Finished statuses expire after
+    ``ttl_seconds`` so edits made outside this service are picked up from the
+    database eventually; Queued and Processing entries only live for
+    ``pending_ttl_seconds``, since another process sharing the job queue may
+    move the issue on without this cache hearing of it. Transitions are also pushed to subscribers (the SSE
+    endpoint); a subscriber that stops reading loses events instead of holding
+    up the pipeline.
+    """
+
+    def __init__(self, ttl_seconds=300, max_entries=10000, subscriber_buffer=100, pending_ttl_seconds=5):
+        self.ttl_seconds = ttl_seconds
+        self.pending_ttl_seconds = pending_ttl_seconds
+        self.max_entries = max_entries
+        self.subscriber_buffer = subscriber_buffer
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # issue id -> queues, None -> queues following every issue
+        self._subscribers = {}
+
+    def get(self, issue_id):
+        """Cached status of an issue, None if unknown or expired"""
+        entry = self._entries.get(issue_id)
+        if entry is None or time.monotonic() > entry[0]:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(entry[1])
+
+    def set(self, issue_id, status, publish=True):
+        """Store an issue's status and, for pipeline transitions, notify subscribers"""
+        ttl = self.ttl_seconds if status["status"] in TERMINAL_STATUSES else self.pending_ttl_seconds
+        self._entries[issue_id] = (time.monotonic() + ttl, status)
+        self._entries.move_to_end(issue_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        if publish:
+            for queue in self._subscribers.get(issue_id, ()) + self._subscribers.get(None, ()):
+                try:
+                    queue.put_nowait(dict(status))
+                except asyncio.QueueFull:
+                    logger.warning(f"Dropped {status['status']} event of issue {issue_id} for a slow subscriber")
+
+    def subscribe(self, issue_id=None):
+        """Queue receiving status events of one issue, or of every issue when issue_id is None"""
+        queue = asyncio.Queue(self.subscriber_buffer)
+        self._subscribers[issue_id] = self._subscribers.get(issue_id, ()) + (queue,)
+        return queue
+
+    def unsubscribe(self, queue, issue_id=None):
+        remaining = tuple(subscriber for subscriber in self._subscribers.get(issue_id, ()) if subscriber is not queue)
+        if remaining:
+            self._subscribers[issue_id] = remaining
+        else:
+            self._subscribers.pop(issue_id, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0,
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+        }
@@ -0,0 +1,146 @@
+import json
+import re
+import weakref
+
+import torch
+from transformers import LogitsProcessor
+
+# The assistant turn is started with this text, so the model's first token is already the score
+JSON_PREFILL = '{"PriorityScore": '
+_REASONING_OPEN = ', "reasoning": "'
+_REASONING_CLOSE = '"}'
+
+_SCORE, _OPEN, _REASONING, _CLOSE, _DONE = range(5)
+
+# Vocabulary scans are slow, so they are done once per tokenizer; weak keys so a
+# tokenizer that is freed takes its tables along instead of leaving them to a reused id()
+_vocabulary_cache = weakref.WeakKeyDictionary()
+
+
+class ScoreJsonLogitsProcessor(LogitsProcessor):
+    """Constrains decoding to {"PriorityScore": <0-100>, "reasoning": "<text>"}.
+
+    The score is limited to digit tokens that keep it within 0-100, the literal
+    JSON punctuation is forced, the reasoning may only use tokens that cannot
+    break out of the string, and once the object is closed only EOS is allowed,
+    so generation stops there. The processor is stateless: every call replays the
+    tokens generated after ``prompt_length``, which keeps it correct when
+    generate() evaluates several candidate positions at once.
+    """
+
+    def __init__(self, tokenizer, prompt_length, max_reasoning_tokens=96):
+        self.prompt_length = prompt_length
+        self.max_reasoning_tokens = max_reasoning_tokens
+        self.eos_token_id = tokenizer.eos_token_id
+        self.open_ids = tokenizer.encode(_REASONING_OPEN, add_special_tokens=False)
+        self.close_ids = tokenizer.encode(_REASONING_CLOSE, add_special_tokens=False)
+        self._digits, self._string_safe = _vocabulary_tables(tokenizer)
+        self._reasoning_mask = None
+
+    def max_new_tokens(self):
+        """Upper bound on generated tokens, score digits included"""
+        return 3 + len(self.open_ids) + self.max_reasoning_tokens + len(self.close_ids) + 1
+
+    def _replay(self, generated):
+        """Walk the generated tokens through the grammar and return where it stands"""
+        state, digits, position, reasoning_tokens = _SCORE, "", 0, 0
+        for token in generated:
+            if state == _SCORE:
+                if token in self._digits:
+                    digits += self._digits[token]
+                    continue
+                state, position = _OPEN, 1
+            elif state == _OPEN:
+                position += 1
+            elif state == _REASONING:
+                if token == self.close_ids[0]:
+                    state, position = _CLOSE, 1
+                else:
+                    reasoning_tokens += 1
+                    continue
+            elif state == _CLOSE:
+                position += 1
+            else:
+                continue
+
+            if state == _OPEN and position == len(self.open_ids):
+                state = _REASONING
+            elif state == _CLOSE and position == len(self.close_ids):
+                state = _DONE
+        return state, digits, position, reasoning_tokens
+
+    def _allowed_digits(self, digits):
+        if digits == "0" or len(digits) >= 3:
+            return []
+        allowed = []
+        for token, text in self._digits.items():
+            number = digits + text
+            # No leading zeros, JSON would reject them
+            if len(number) <= 3 and int(number) <= 100 and (number == "0" or not number.startswith("0")):
+                allowed.append(token)
+        return allowed
+
+    def __call__(self, input_ids, scores):
+        if self._reasoning_mask is None or self._reasoning_mask.device != scores.device:
+            self._reasoning_mask = torch.full((scores.shape[-1],), float("-inf"), device=scores.device)
+            self._reasoning_mask[[token for token in self._string_safe if token < scores.shape[-1]]] = 0
+            self._reasoning_mask[self.close_ids[0]] = 0
+
+        constrained = torch.full_like(scores, float("-inf"))
+        for row, sequence in enumerate(input_ids):
+            state, digits, position, reasoning_tokens = self._replay(sequence[self.prompt_length:].tolist())
+
+            if state == _SCORE:
+                allowed = self._allowed_digits(digits)
+                if digits:
+                    allowed.append(self.open_ids[0])
+            elif state == _OPEN:
+                allowed = [self.open_ids[position]]
+            elif state == _REASONING and reasoning_tokens < self.max_reasoning_tokens:
+                constrained[row] = scores[row] + self._reasoning_mask
+                continue
+            elif state == _REASONING:
+                allowed = [self.close_ids[0]]
+            elif state == _CLOSE:
+                allowed = [self.close_ids[position]]
+            else:
+                allowed = [self.eos_token_id]
+
+            constrained[row, allowed] = scores[row, allowed]
+        return constrained
+
+
+def _vocabulary_tables(tokenizer):
+    """Digit tokens and tokens that are safe inside a JSON string, computed once per tokenizer"""
+    if tokenizer in _vocabulary_cache:
+        return _vocabulary_cache[tokenizer]
+
+    # Added tokens such as <image> must never appear inside the reasoning either
+    special = set(tokenizer.all_special_ids) | set(getattr(tokenizer, "added_tokens_decoder", {}))
+    digits, string_safe = {}, []
+    for token, piece in enumerate(tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))):
+        if token in special or piece is None:
+            continue
+        # Byte-fallback pieces like <0x0A> can be control characters or half a UTF-8 sequence
+        if re.fullmatch(r"<0x[0-9A-Fa-f]{2}>", piece):
+            continue
+        if piece.isdigit() and piece.isascii():
+            digits[token] = piece
+        text = piece.replace("▁", " ")
+        if text and '"' not in text and "\\" not in text and all(ord(char) >= 32 for char in text):
+            string_safe.append(token)
+
+    _vocabulary_cache[tokenizer] = (digits, string_safe)
+    return digits, string_safe
+
+
+def parse_score_json(generated_text):
+    """Parse constrained output back into (score, reasoning); None if it did not close"""
+    try:
+        parsed = json.loads(JSON_PREFILL + generated_text.strip())
+    except json.JSONDecodeError:
+        return None
+    score = parsed.get("PriorityScore")
+    if not isinstance(score, int) or not 0 <= score <= 100:
+        return None
+    return score, str(parsed.get("reasoning", "")).strip()
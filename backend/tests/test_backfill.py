@@ -0,0 +1,107 @@
+import argparse
+import asyncio
+import json
+
+import pytest
+
+for module in ("dotenv", "httpx", "PIL", "torch", "transformers"):
+    pytest.importorskip(module)
+
+from backfill import Backfill, Checkpoint, _load_state
+from img import PROMPT_VERSION
+
+IDS = [f"issue-{index}" for index in range(7)]
+
+
+class FakeStore:
+    def __init__(self, slow_id=None):
+        self.slow_id = slow_id
+        self.saved = []
+
+    async def count_issues(self, after_id=None, **filters):
+        return len([issue_id for issue_id in IDS if after_id is None or issue_id > after_id])
+
+    async def page_issues(self, after_id=None, limit=100, **filters):
+        rows = [issue_id for issue_id in IDS if after_id is None or issue_id > after_id][:limit]
+        return [{"id": issue_id, "title": "Pothole", "image_urls": ["https://storage.test/a.jpg"]} for issue_id in rows]
+
+    async def save_assessment(self, issue_id, title, fields):
+        if issue_id == self.slow_id:
+            await asyncio.sleep(0.05)
+        self.saved.append(issue_id)
+        return True
+
+
+class FakeFetcher:
+    async def fetch_many(self, urls):
+        return [b"jpeg" for _ in urls]
+
+
+class FakeBatcher:
+    async def submit(self, title, description, image):
+        return {"priority_score": 40, "reasoning": "ok"}
+
+    def stats(self):
+        return {"utilisation": {"generate": 0}, "average_batch_size": 1}
+
+
+def _state(after_id=None):
+    return {"filters": {"statuses": None, "created_after": None, "created_before": None}, "after_id": after_id,
+            "assessed": 0, "failed": 0, "skipped": 0, "finished": False, "prompt_version": PROMPT_VERSION,
+            "assessor": None}
+
+
+def _args(**overrides):
+    return argparse.Namespace(**{"status": None, "since": None, "until": None, "restart": False, **overrides})
+
+
+def test_checkpoint_saves_atomically_and_records_failures(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "run.json"))
+    assert checkpoint.load() is None
+    checkpoint.save({"after_id": "issue-3"})
+    checkpoint.record_failure("issue-4", "timeout")
+
+    assert checkpoint.load()["after_id"] == "issue-3"
+    assert (tmp_path / "run.json.failed").read_text() == "issue-4\ttimeout\n"
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["run.json", "run.json.failed"]
+
+
+def test_checkpoint_waits_for_every_issue_of_earlier_pages(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "run.json"))
+    backfill = Backfill(FakeStore(), FakeFetcher(), FakeBatcher(), checkpoint, _state())
+    backfill._pages = {0: {"last_id": "issue-1", "pending": 0},
+                       1: {"last_id": "issue-3", "pending": 1},
+                       2: {"last_id": "issue-5", "pending": 0}}
+    backfill._advance()
+    assert json.loads((tmp_path / "run.json").read_text())["after_id"] == "issue-1"
+
+    backfill._pages[1]["pending"] = 0
+    backfill._advance()
+    assert backfill.state["after_id"] == "issue-5"
+
+
+def test_run_finishes_and_resumes_after_the_checkpoint(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "run.json"))
+    store = FakeStore(slow_id="issue-0")
+    first = Backfill(store, FakeFetcher(), FakeBatcher(), checkpoint, _state(), page_size=2, concurrency=3,
+                     limit=4)
+    asyncio.run(first.run())
+    state = checkpoint.load()
+    assert (state["after_id"], state["assessed"], state["finished"]) == ("issue-3", 4, False)
+
+    resumed = Backfill(store, FakeFetcher(), FakeBatcher(), checkpoint, _load_state(_args(), checkpoint, None),
+                       page_size=2, concurrency=3)
+    asyncio.run(resumed.run())
+    state = checkpoint.load()
+    assert sorted(store.saved) == IDS
+    assert (state["after_id"], state["assessed"], state["finished"]) == ("issue-6", 7, True)
+
+
+def test_load_state_refuses_finished_runs_and_other_filters(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "run.json"))
+    checkpoint.save({**_state("issue-6"), "finished": True})
+    with pytest.raises(SystemExit):
+        _load_state(_args(), checkpoint, None)
+    with pytest.raises(SystemExit):
+        _load_state(_args(status=["Assessed"]), checkpoint, None)
+    assert _load_state(_args(restart=True), checkpoint, None)["after_id"] is None
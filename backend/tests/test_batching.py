@@ -0,0 +1,66 @@
+import asyncio
+
+from batching import BatchScheduler
+
+
+class FakeAssessor:
+    """Assesses in one step or two; a description of "broken" gets an error result"""
+
+    def __init__(self):
+        self.batches = []
+
+    def assess_batch(self, requests, resolution_mode=None, max_new_tokens=None, output_mode=None):
+        self.batches.append(len(requests))
+        return [self._result(description) for _, description, _ in requests]
+
+    def prepare_batch(self, requests, resolution_mode=None, output_mode=None):
+        return requests
+
+    def finish_batch(self, prepared, max_new_tokens=None):
+        return self.assess_batch(prepared)
+
+    @staticmethod
+    def _result(description):
+        if description == "broken":
+            return {"error": "Failed to load image"}
+        return {"priority_score": 60, "reasoning": description}
+
+
+class FixedTier:
+    def __init__(self, tier):
+        self._tier = tier
+        self.latencies = []
+
+    def tier(self):
+        return self._tier
+
+    def observe_latency(self, seconds):
+        self.latencies.append(seconds)
+
+
+def _submit_all(batcher, descriptions):
+    async def run():
+        batcher.start()
+        try:
+            return await asyncio.gather(*[batcher.submit("title", description, b"") for description in descriptions])
+        finally:
+            await batcher.stop()
+
+    return asyncio.run(run())
+
+
+def test_concurrent_requests_share_a_batch():
+    assessor = FakeAssessor()
+    results = _submit_all(BatchScheduler(assessor, max_batch_size=4, max_wait_ms=50, pipelined=False), "abcd")
+    assert assessor.batches == [4]
+    assert [result["reasoning"] for result in results] == list("abcd")
+
+
+def test_only_successful_results_carry_the_tier():
+    for pipelined in (False, True):
+        controller = FixedTier("short")
+        batcher = BatchScheduler(FakeAssessor(), pipelined=pipelined, controller=controller)
+        ok, broken = _submit_all(batcher, ["ok", "broken"])
+        assert ok["assessment_tier"] == "short"
+        assert "assessment_tier" not in broken
+        assert len(controller.latencies) == 2
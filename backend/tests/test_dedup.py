@@ -0,0 +1,61 @@
+import random
+import uuid
+
+import pytest
+
+pytest.importorskip("PIL")
+
+from dedup import HASH_BITS, NearDuplicateIndex
+
+
+def _flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def _issue():
+    return str(uuid.uuid4())
+
+
+def test_finds_hashes_within_max_distance_only():
+    rng = random.Random(7)
+    index = NearDuplicateIndex(max_distance=6)
+    for _ in range(2000):
+        index.add(rng.getrandbits(HASH_BITS), 10, _issue())
+    target, issue_id = rng.getrandbits(HASH_BITS), _issue()
+    index.add(target, 80, issue_id)
+
+    # Six flipped bits spread over every chunk still share a chunk within the probe radius
+    match = index.find(_flip(target, [0, 17, 33, 40, 50, 63]))
+    assert match == {"issue_id": issue_id, "priority_score": 80, "distance": 6}
+    assert index.find(_flip(target, range(0, 64, 9))) is None
+
+
+def test_prefers_the_closest_match_and_skips_the_issue_itself():
+    index = NearDuplicateIndex(max_distance=6)
+    own, near, far = _issue(), _issue(), _issue()
+    index.add(0, 90, own)
+    index.add(_flip(0, [1]), 50, near)
+    index.add(_flip(0, [1, 2, 3]), 20, far)
+
+    assert index.find(0)["issue_id"] == own
+    assert index.find(0, exclude_issue_id=own)["issue_id"] == near
+
+
+def test_save_merges_hashes_saved_by_another_process(tmp_path):
+    path = str(tmp_path / "index.bin")
+    first, second = NearDuplicateIndex(path), NearDuplicateIndex(path)
+    first_issue, second_issue = _issue(), _issue()
+    first.add(1, 30, first_issue)
+    second.add(1 << 40, 70, second_issue)
+
+    first.save()
+    second.save()
+
+    reloaded = NearDuplicateIndex(path)
+    reloaded.load()
+    assert len(reloaded) == 2
+    assert reloaded.find(1)["issue_id"] == first_issue
+    assert reloaded.find(1 << 40)["priority_score"] == 70
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["index.bin", "index.bin.lock"]
@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+from degradation import LoadController, lowest_tier
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    return clock
+
+
+def _controller(depth, **kwargs):
+    return LoadController(lambda: depth[0], depth_thresholds=(20, 60), latency_thresholds=(60, 180),
+                          recovery_ratio=0.5, min_dwell_seconds=30, evaluate_interval=0, **kwargs)
+
+
+def test_steps_down_at_once_and_skips_tiers(clock):
+    depth = [0]
+    controller = _controller(depth)
+    assert controller.tier() == "full"
+    depth[0] = 60
+    assert controller.tier() == "score_only"
+
+
+def test_latency_alone_triggers_degradation(clock):
+    controller = _controller([0])
+    for seconds in (70, 75, 80):
+        controller.observe_latency(seconds)
+    assert controller.tier() == "short"
+    # Latencies older than the window no longer count
+    clock.now += 61 + 30
+    assert controller.tier() == "full"
+
+
+def test_recovers_one_tier_at_a_time_after_dwell_and_below_recovery_ratio(clock):
+    depth = [60]
+    controller = _controller(depth)
+    assert controller.tier() == "score_only"
+
+    # Below the entry threshold but above half of it: hysteresis holds the tier
+    depth[0] = 40
+    clock.now += 60
+    assert controller.tier() == "score_only"
+
+    # Low enough, but recovery waits for the dwell time after every switch
+    depth[0] = 0
+    assert controller.tier() == "short"
+    clock.now += 10
+    assert controller.tier() == "short"
+    clock.now += 30
+    assert controller.tier() == "full"
+    assert controller.switches == 3
+
+
+def test_evaluates_at_most_every_interval(clock):
+    depth = [0]
+    controller = LoadController(lambda: depth[0], evaluate_interval=1.0)
+    assert controller.tier() == "full"
+    depth[0] = 100
+    assert controller.tier() == "full"
+    clock.now += 1
+    assert controller.tier() == "score_only"
+
+
+def test_lowest_tier_picks_the_cheapest_known_tier():
+    assert lowest_tier(["full", "score_only", "short"]) == "score_only"
+    assert lowest_tier([None, "full"]) == "full"
+    assert lowest_tier([None]) is None
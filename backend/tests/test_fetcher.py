@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+import metrics
+from fetcher import ImageFetcher, ImageTooLargeError
+
+
+def _fetcher(handler, max_bytes=1024):
+    fetcher = ImageFetcher(max_bytes=max_bytes)
+    fetcher._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return fetcher
+
+
+def test_fetch_returns_body_and_times_download():
+    fetcher = _fetcher(lambda request: httpx.Response(200, content=b"jpeg bytes"))
+    before = sum(metrics.STAGE_SECONDS._values.get(("download",), [[0], 0.0])[0])
+
+    assert asyncio.run(fetcher._fetch("https://storage.example/a.jpg")) == b"jpeg bytes"
+    assert sum(metrics.STAGE_SECONDS._values[("download",)][0]) == before + 1
+
+
+def test_fetch_rejects_declared_oversized_body():
+    fetcher = _fetcher(lambda request: httpx.Response(200, content=b"x" * 2048), max_bytes=1024)
+    with pytest.raises(ImageTooLargeError):
+        asyncio.run(fetcher._fetch("https://storage.example/big.jpg"))
+
+
+def test_fetch_many_returns_none_for_failed_downloads():
+    def handler(request):
+        if request.url.path == "/missing.jpg":
+            return httpx.Response(404)
+        return httpx.Response(200, content=b"ok")
+
+    fetcher = _fetcher(handler)
+    images = asyncio.run(fetcher.fetch_many(["https://storage.example/a.jpg", "https://storage.example/missing.jpg"]))
+    assert images == [b"ok", None]
+
+
+def test_malformed_content_length_falls_back_to_the_streamed_count():
+    def handler(request, body=b"jpeg bytes"):
+        return httpx.Response(200, headers={"content-length": "not-a-number"}, content=body)
+
+    assert asyncio.run(_fetcher(handler)._fetch("https://storage.example/a.jpg")) == b"jpeg bytes"
+    oversized = _fetcher(lambda request: handler(request, b"x" * 2048), max_bytes=1024)
+    with pytest.raises(ImageTooLargeError):
+        asyncio.run(oversized._fetch("https://storage.example/big.jpg"))
@@ -0,0 +1,55 @@
+import asyncio
+import json
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from issue_store import IssueStore
+
+
+def _store(handler, **kwargs):
+    store = IssueStore("http://db.test/rest/v1", "key", **kwargs)
+    store._client = httpx.AsyncClient(base_url=store.rest_url, transport=httpx.MockTransport(handler))
+    return store
+
+
+def test_tier_is_not_written_unless_tracked():
+    bodies = []
+
+    def handler(request):
+        bodies.append(json.loads(request.content))
+        return httpx.Response(200, json=[{"id": "issue-1"}])
+
+    async def run():
+        for track_tier in (False, True):
+            store = _store(handler, track_tier=track_tier)
+            await store.save_assessment("issue-1", "Pothole", {"priority_score": 40, "assessment_tier": "short"})
+
+    asyncio.run(run())
+    assert bodies == [{"priority_score": 40}, {"priority_score": 40, "assessment_tier": "short"}]
+
+
+def test_status_reads_only_name_the_tier_column_when_tracked():
+    selects = []
+
+    def handler(request):
+        selects.append(request.url.params["select"])
+        return httpx.Response(200, json=[{"id": "issue-1", "status": "Assessed"}])
+
+    async def run():
+        await _store(handler)._fetch_status("issue-1")
+        await _store(handler, track_tier=True)._fetch_status("issue-1")
+
+    asyncio.run(run())
+    assert "assessment_tier" not in selects[0]
+    assert selects[1].endswith(",assessment_tier")
+
+
+def test_missing_tier_column_fails_loudly():
+    def handler(request):
+        return httpx.Response(400, json={"code": "42703", "message": "column issues.assessment_tier does not exist"})
+
+    store = _store(handler, track_tier=True)
+    with pytest.raises(RuntimeError, match="ALTER TABLE"):
+        asyncio.run(store._check_tier_column())
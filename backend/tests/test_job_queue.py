@@ -0,0 +1,169 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from job_queue import JobQueue, PermanentJobError, QueueFullError
+
+
+def _queue(tmp_path, **kwargs):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), **kwargs)
+
+
+def test_claims_earliest_deadline_first(tmp_path):
+    queue = _queue(tmp_path)
+    queue.enqueue("low", priority="low")
+    queue.enqueue("normal")
+    queue.enqueue("critical", priority="critical")
+
+    assert [queue._claim()["issue_id"] for _ in range(3)] == ["critical", "normal", "low"]
+    assert queue._claim() is None
+
+
+def test_enqueue_attaches_to_active_job_and_moves_deadline_up(tmp_path):
+    queue = _queue(tmp_path)
+    job_id, _ = queue.enqueue("issue-1", priority="low")
+    queue.enqueue("issue-2")
+
+    assert queue.enqueue("issue-1", priority="critical") == (job_id, True)
+    assert queue._claim()["issue_id"] == "issue-1"
+    # Running jobs are attached to as well
+    assert queue.enqueue("issue-1") == (job_id, True)
+    assert queue.pending_count() == 2
+
+
+def test_enqueue_refuses_work_at_capacity(tmp_path):
+    queue = _queue(tmp_path, max_pending=1)
+    queue.enqueue("issue-1")
+    with pytest.raises(QueueFullError):
+        queue.enqueue("issue-2")
+
+
+def test_failed_job_is_retried_then_given_up(tmp_path):
+    calls, failures = [], []
+
+    async def handler(issue_id):
+        calls.append(issue_id)
+        raise RuntimeError("boom")
+
+    async def on_failure(issue_id, error):
+        failures.append(issue_id)
+
+    queue = _queue(tmp_path, handler=handler, on_failure=on_failure, max_attempts=2, retry_base_seconds=0)
+    queue.enqueue("issue-1")
+
+    async def run():
+        await queue._run(queue._claim())
+        assert queue._db.execute("SELECT status FROM jobs").fetchone()[0] == "queued"
+        await queue._run(queue._claim())
+
+    asyncio.run(run())
+    assert calls == ["issue-1", "issue-1"]
+    assert failures == ["issue-1"]
+    assert (queue.retried, queue.failed) == (1, 1)
+    assert queue._db.execute("SELECT status FROM jobs").fetchone()[0] == "failed"
+
+
+def test_permanent_error_is_not_retried(tmp_path):
+    async def handler(issue_id):
+        raise PermanentJobError("no image")
+
+    queue = _queue(tmp_path, handler=handler, max_attempts=3)
+    queue.enqueue("issue-1")
+    asyncio.run(queue._run(queue._claim()))
+    assert queue.failed == 1 and queue.retried == 0
+
+
+def test_recovers_only_expired_leases(tmp_path):
+    live = _queue(tmp_path, lease_seconds=60)
+    crashed = _queue(tmp_path, lease_seconds=60)
+    live.enqueue("live")
+    crashed.enqueue("crashed")
+    assert live._claim()["issue_id"] == "live"
+    assert crashed._claim()["issue_id"] == "crashed"
+    crashed._db.execute("UPDATE jobs SET lease_expires_at = ? WHERE owner = ?", (time.time() - 1, crashed.owner))
+    crashed._db.commit()
+
+    restarted = _queue(tmp_path)
+    assert restarted.recover_expired() == 1
+    assert restarted._claim()["issue_id"] == "crashed"
+    assert restarted._claim() is None
+
+
+def test_stale_owner_cannot_finish_a_reclaimed_job(tmp_path):
+    first = _queue(tmp_path)
+    second = _queue(tmp_path)
+    job_id, _ = first.enqueue("issue-1")
+    first._claim()
+    first._db.execute("UPDATE jobs SET lease_expires_at = 0")
+    first._db.commit()
+    second.recover_expired()
+    second._claim()
+
+    first._finish(job_id, "done")
+    row = second._db.execute("SELECT status, owner FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    assert (row["status"], row["owner"]) == ("running", second.owner)
+
+
+def test_stop_hands_running_jobs_back(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+
+    async def run():
+        started = asyncio.Event()
+
+        async def handler(issue_id):
+            started.set()
+            await asyncio.sleep(3600)
+
+        queue = JobQueue(path, handler=handler, concurrency=1)
+        await queue.start()
+        queue.enqueue("issue-1")
+        await asyncio.wait_for(started.wait(), 5)
+        await queue.stop()
+
+    asyncio.run(run())
+    queue = JobQueue(path)
+    assert queue._claim()["issue_id"] == "issue-1"
+
+
+def test_active_status_follows_the_job(tmp_path):
+    queue = _queue(tmp_path)
+    job_id, _ = queue.enqueue("issue-1")
+    assert queue.active_status("issue-1") == "queued"
+    queue._claim()
+    assert queue.active_status("issue-1") == "running"
+    queue._finish(job_id, "done")
+    assert queue.active_status("issue-1") is None
+
+
+class _FailingCommit:
+    """Connection proxy whose next commit fails, as it does when another process holds the lock"""
+
+    def __init__(self, db):
+        self._db = db
+        self.fail_next_commit = True
+
+    def commit(self):
+        if self.fail_next_commit:
+            self.fail_next_commit = False
+            raise sqlite3.OperationalError("database is locked")
+        self._db.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+
+def test_failed_lease_renewal_leaves_no_open_transaction(tmp_path):
+    async def run():
+        queue = _queue(tmp_path, lease_seconds=0.03)
+        queue._db = _FailingCommit(queue._db)
+        heartbeat = asyncio.create_task(queue._renew_leases())
+        while queue._db.fail_next_commit:
+            await asyncio.sleep(0.01)
+        heartbeat.cancel()
+        await asyncio.gather(heartbeat, return_exceptions=True)
+        return queue
+
+    queue = asyncio.run(run())
+    assert queue.enqueue("issue-1")[1] is False
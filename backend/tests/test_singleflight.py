@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    calls = []
+
+    async def load(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return f"value of {key}"
+
+    async def run():
+        flights = SingleFlight("test")
+        results = await asyncio.gather(*[flights.do("a", load, "a") for _ in range(5)], flights.do("b", load, "b"))
+        # Nothing is remembered once the call finished
+        again = await flights.do("a", load, "a")
+        return flights, results, again
+
+    flights, results, again = asyncio.run(run())
+    assert results == ["value of a"] * 5 + ["value of b"]
+    assert again == "value of a"
+    assert calls == ["a", "b", "a"]
+    assert flights.stats() == {"in_flight": 0, "leaders": 3, "shared": 4}
+
+
+def test_waiters_share_the_exception():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("database down")
+
+    async def run():
+        flights = SingleFlight("test")
+        return await asyncio.gather(flights.do("a", fail), flights.do("a", fail), return_exceptions=True)
+
+    first, second = asyncio.run(run())
+    assert isinstance(first, RuntimeError) and first is second
+
+
+def test_cancelled_waiter_does_not_cancel_the_shared_call():
+    async def run():
+        flights = SingleFlight("test")
+        release = asyncio.Event()
+
+        async def load():
+            await release.wait()
+            return 42
+
+        leader = asyncio.create_task(flights.do("a", load))
+        follower = asyncio.create_task(flights.do("a", load))
+        await asyncio.sleep(0)
+        leader.cancel()
+        release.set()
+        return await follower, leader
+
+    result, leader = asyncio.run(run())
+    assert result == 42
+    with pytest.raises(asyncio.CancelledError):
+        leader.result()
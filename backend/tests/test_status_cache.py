@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+from status_cache import StatusCache
+
+
+def _status(issue_id, status):
+    return {"issue_id": issue_id, "status": status}
+
+
+def test_pending_statuses_expire_sooner_than_finished_ones(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = StatusCache(ttl_seconds=300, pending_ttl_seconds=5)
+    cache.set("queued", _status("queued", "Queued"), publish=False)
+    cache.set("assessed", _status("assessed", "Assessed"), publish=False)
+
+    now[0] += 10
+    assert cache.get("queued") is None
+    assert cache.get("assessed")["status"] == "Assessed"
+    now[0] += 300
+    assert cache.get("assessed") is None
+
+
+def test_transitions_reach_issue_and_global_subscribers():
+    async def run():
+        cache = StatusCache(subscriber_buffer=1)
+        issue_queue = cache.subscribe("issue-1")
+        all_queue = cache.subscribe()
+        cache.set("issue-1", _status("issue-1", "Processing"))
+        cache.set("issue-2", _status("issue-2", "Processing"))
+        # A full subscriber drops events instead of blocking the pipeline
+        cache.set("issue-1", _status("issue-1", "Assessed"))
+        cache.unsubscribe(issue_queue, "issue-1")
+        return issue_queue.get_nowait(), all_queue.get_nowait(), cache.stats()
+
+    issue_event, all_event, stats = asyncio.run(run())
+    assert issue_event["status"] == "Processing"
+    assert all_event["issue_id"] == "issue-1"
+    assert stats["subscribers"] == 1
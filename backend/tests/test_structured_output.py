@@ -0,0 +1,94 @@
+import gc
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from structured_output import ScoreJsonLogitsProcessor, _vocabulary_cache, parse_score_json
+
+PIECES = ["<s>", "</s>", "<image>", "<0x0A>"] + [str(digit) for digit in range(10)] + [
+    "10", ", \"", "reasoning", "\": \"", "\"}", "▁wall", "▁cracked", "▁badly", "quote\"", "back\\slash",
+]
+
+
+class FakeTokenizer:
+    """Just enough of a tokenizer: one piece per id, and the JSON fragments the processor encodes"""
+
+    eos_token_id = 1
+    all_special_ids = [0, 1]
+    added_tokens_decoder = {2: "<image>"}
+    _encodings = {', "reasoning": "': [", \"", "reasoning", "\": \""], '"}': ["\"}"]}
+
+    def __len__(self):
+        return len(PIECES)
+
+    def convert_ids_to_tokens(self, ids):
+        return [PIECES[token] for token in ids]
+
+    def encode(self, text, add_special_tokens=False):
+        return [PIECES.index(piece) for piece in self._encodings[text]]
+
+    def decode(self, ids):
+        return "".join(PIECES[token] for token in ids).replace("▁", " ")
+
+
+def _generate(processor, tokenizer, scores_for_step, prompt=(0, 5, 6), max_steps=40):
+    sequence = list(prompt)
+    for step in range(max_steps):
+        scores = processor(torch.tensor([sequence]), scores_for_step(step).unsqueeze(0))
+        token = int(scores[0].argmax())
+        if token == tokenizer.eos_token_id:
+            break
+        sequence.append(token)
+    return tokenizer.decode(sequence[len(prompt):])
+
+
+def test_output_always_parses_whatever_the_model_prefers():
+    tokenizer = FakeTokenizer()
+    processor = ScoreJsonLogitsProcessor(tokenizer, prompt_length=3, max_reasoning_tokens=4)
+    for seed in range(20):
+        generator = torch.Generator().manual_seed(seed)
+        # Boost the tokens that would break the JSON
+        bias = torch.zeros(len(PIECES))
+        bias[[PIECES.index("quote\""), PIECES.index("back\\slash"), 2, 3]] = 5
+        text = _generate(processor, tokenizer, lambda step: torch.randn(len(PIECES), generator=generator) + bias)
+
+        parsed = parse_score_json(text)
+        assert parsed is not None, text
+        assert 0 <= parsed[0] <= 100
+
+
+def test_score_digits_stay_within_range():
+    processor = ScoreJsonLogitsProcessor(FakeTokenizer(), prompt_length=0)
+    texts = lambda tokens: sorted(PIECES[token] for token in tokens)
+
+    assert "10" in texts(processor._allowed_digits(""))
+    assert texts(processor._allowed_digits("1")) == [str(digit) for digit in range(10)]
+    assert texts(processor._allowed_digits("10")) == ["0"]
+    assert processor._allowed_digits("0") == []
+    assert processor._allowed_digits("100") == []
+
+
+def test_reasoning_is_closed_at_the_token_budget():
+    tokenizer = FakeTokenizer()
+    processor = ScoreJsonLogitsProcessor(tokenizer, prompt_length=3, max_reasoning_tokens=2)
+    # A model that never wants to stop talking
+    prefers_words = torch.zeros(len(PIECES))
+    prefers_words[PIECES.index("▁wall")] = 10
+    prefers_words[PIECES.index("7")] = 5
+    prefers_words[PIECES.index(", \"")] = 6
+
+    text = _generate(processor, tokenizer, lambda step: prefers_words)
+    assert text == '7, "reasoning": " wall wall"}'
+    assert parse_score_json(text) == (7, "wall wall")
+
+
+def test_vocabulary_tables_go_with_their_tokenizer():
+    tokenizer = FakeTokenizer()
+    ScoreJsonLogitsProcessor(tokenizer, prompt_length=0)
+    assert tokenizer in _vocabulary_cache
+
+    del tokenizer
+    gc.collect()
+    assert len(_vocabulary_cache) == 0
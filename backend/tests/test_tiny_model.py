@@ -0,0 +1,27 @@
+import io
+
+import pytest
+
+for module in ("dotenv", "PIL", "torch", "transformers", "tokenizers"):
+    pytest.importorskip(module)
+
+from PIL import Image
+
+from tiny_model import build_tiny_assessor
+
+
+def _jpeg(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (120, 90, 60)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("use_prefix_cache", [True, False])
+def test_tiny_assessor_assesses_every_image_size(use_prefix_cache):
+    assessor = build_tiny_assessor(use_prefix_cache=use_prefix_cache)
+    requests = [("Pothole", "Deep hole in the road", _jpeg(width, height))
+                for width, height in [(32, 32), (64, 48), (640, 480), (2048, 1536)]]
+
+    results = assessor.assess_batch(requests, max_new_tokens=4)
+    assert [result.get("error") for result in results] == [None] * len(requests)
+    assert all(0 <= result["priority_score"] <= 100 for result in results)
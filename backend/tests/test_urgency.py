@@ -0,0 +1,55 @@
+import asyncio
+
+from urgency import UrgencyEstimator
+
+
+class FakeStore:
+    def __init__(self, scores):
+        self.scores = scores
+        self.queries = []
+        self.release = asyncio.Event()
+
+    async def fetch_reporter_scores(self, user_ids):
+        self.queries.append(list(user_ids))
+        await self.release.wait()
+        return {user_id: self.scores.get(user_id, []) for user_id in user_ids}
+
+
+def _issue(issue_id, title, user_id="reporter", latitude=None, longitude=None):
+    return {"id": issue_id, "title": title, "description": "", "user_id": user_id,
+            "latitude": latitude, "longitude": longitude}
+
+
+def test_keywords_and_clusters_set_the_class():
+    async def run():
+        estimator = UrgencyEstimator(FakeStore({}), cluster_size=3, cluster_radius_m=250)
+        first = await estimator.estimate_many([_issue("a", "Gas leak near the school")])
+        second = await estimator.estimate_many([_issue("b", "Graffiti on the wall")])
+        cluster = await estimator.estimate_many([
+            _issue(issue_id, "Pothole", latitude=51.5, longitude=-0.12 + index * 0.0005)
+            for index, issue_id in enumerate("cde")
+        ])
+        return first, second, cluster
+
+    first, second, cluster = asyncio.run(run())
+    assert first["a"][0] == "critical"
+    assert second["b"][0] == "low"
+    assert [cluster[issue_id][0] for issue_id in "cde"] == ["normal", "normal", "high"]
+
+
+def test_reporter_history_is_fetched_in_the_background_once():
+    async def run():
+        store = FakeStore({"reporter": [2, 3, 1, 90]})
+        estimator = UrgencyEstimator(store)
+        # Neither estimate waits for the history read, and the second joins the one in flight
+        cold = await estimator.estimate_many([_issue("a", "Pothole")])
+        await estimator.estimate_many([_issue("b", "Pothole")])
+        store.release.set()
+        await asyncio.gather(*estimator._refresh_tasks)
+        warm = await estimator.estimate_many([_issue("c", "Pothole")])
+        return store.queries, cold, warm
+
+    queries, cold, warm = asyncio.run(run())
+    assert queries == [["reporter"]]
+    assert cold["a"][0] == "normal"
+    assert warm["c"] == ("low", ["reporter's recent reports mostly scored below 10"])
@@ -0,0 +1,138 @@
+"""
+A tiny, randomly initialised LLaVA-Next for CPU-only benchmarks.
+
+It has the same architecture, processor, chat template and anyres tiling as
+llava-v1.6-mistral-7b-hf, only far smaller, so the whole pipeline (decode,
+preprocessing, batching, prefix cache, constrained decoding) runs without a
+GPU or network access. Its answers are noise; only timings are meaningful.
+"""
+import string
+import tempfile
+
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import (
+    CLIPVisionConfig,
+    LlavaNextConfig,
+    LlavaNextForConditionalGeneration,
+    LlavaNextImageProcessor,
+    LlavaNextProcessor,
+    MistralConfig,
+    PreTrainedTokenizerFast,
+)
+
+from img import ASSESSMENT_INSTRUCTIONS, InfrastructureDamageAssessor
+from structured_output import JSON_PREFILL
+
+TILE_SIZE = 32
+PATCH_SIZE = 8
+GRID_PINPOINTS = [[32, 64], [64, 32], [64, 64], [32, 96], [96, 32]]
+
+# Same layout as the llava-v1.6-mistral chat template: every image item is rendered
+# before all text items of a message ([INST] <image>\n<text> [/INST]), whatever their
+# order in the content list
+CHAT_TEMPLATE = (
+    "{% for message in messages %}"
+    "{% if message['role'] == 'user' %}[INST] "
+    "{% for content in message['content'] | selectattr('type', 'equalto', 'image') %}<image>\n{% endfor %}"
+    "{% for content in message['content'] | selectattr('type', 'equalto', 'text') %}"
+    "{{ content['text'] }}{% endfor %} [/INST]"
+    "{% elif message['role'] == 'assistant' %}"
+    "{% for content in message['content'] %}{{ content['text'] }}{% endfor %}</s>"
+    "{% endif %}"
+    "{% endfor %}"
+)
+
+
+def _build_tokenizer(vocab_size):
+    """Small BPE tokenizer with sentencepiece-style spaces, trained on the prompt text"""
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Metaspace()
+    tokenizer.decoder = decoders.Metaspace()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size,
+        special_tokens=["<unk>", "<s>", "</s>", "<pad>", "<image>"],
+        # Every printable character stays encodable, whatever the report text contains
+        initial_alphabet=list(string.printable.strip()) + ["▁"],
+    )
+    corpus = [ASSESSMENT_INSTRUCTIONS, JSON_PREFILL, '", "reasoning": "', '"}', "SITUATION REPORT: Heading Description"]
+    tokenizer.train_from_iterator(corpus, trainer)
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        bos_token="<s>",
+        eos_token="</s>",
+        unk_token="<unk>",
+        pad_token="<pad>",
+        additional_special_tokens=["<image>"],
+    )
+
+
+def build_tiny_processor(vocab_size=1024):
+    image_processor = LlavaNextImageProcessor(
+        size={"shortest_edge": TILE_SIZE},
+        crop_size={"height": TILE_SIZE, "width": TILE_SIZE},
+        image_grid_pinpoints=GRID_PINPOINTS,
+    )
+    return LlavaNextProcessor(
+        image_processor=image_processor,
+        tokenizer=_build_tokenizer(vocab_size),
+        patch_size=PATCH_SIZE,
+        vision_feature_select_strategy="default",
+        # The CLIP CLS token, which the "default" strategy drops again
+        num_additional_image_tokens=1,
+        chat_template=CHAT_TEMPLATE,
+        image_token="<image>",
+    )
+
+
+def build_tiny_model(processor, hidden_size=64, layers=2, seed=0):
+    tokenizer = processor.tokenizer
+    config = LlavaNextConfig(
+        vision_config=CLIPVisionConfig(
+            hidden_size=hidden_size,
+            intermediate_size=hidden_size * 2,
+            num_hidden_layers=layers,
+            num_attention_heads=4,
+            image_size=TILE_SIZE,
+            patch_size=PATCH_SIZE,
+            projection_dim=hidden_size,
+        ),
+        text_config=MistralConfig(
+            vocab_size=len(tokenizer),
+            hidden_size=hidden_size,
+            intermediate_size=hidden_size * 2,
+            num_hidden_layers=layers,
+            num_attention_heads=4,
+            num_key_value_heads=2,
+            max_position_embeddings=4096,
+            sliding_window=None,
+            bos_token_id=tokenizer.bos_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+            pad_token_id=tokenizer.pad_token_id,
+        ),
+        image_token_index=tokenizer.convert_tokens_to_ids("<image>"),
+        image_grid_pinpoints=GRID_PINPOINTS,
+        vision_feature_select_strategy="default",
+        vision_feature_layer=-1,
+    )
+    torch.manual_seed(seed)
+    model = LlavaNextForConditionalGeneration(config).eval()
+    model.generation_config.pad_token_id = tokenizer.pad_token_id
+    model.generation_config.eos_token_id = tokenizer.eos_token_id
+    return model
+
+
+def build_tiny_assessor(seed=0, **options):
+    """InfrastructureDamageAssessor wired to a tiny random model on the CPU"""
+    processor_dir = tempfile.mkdtemp(prefix="tiny-llava-next-")
+    build_tiny_processor().save_pretrained(processor_dir)
+
+    options.pop("model_path", None)
+    # An ONNX export belongs to these random weights only
+    options.setdefault("onnx_dir", processor_dir)
+    assessor = InfrastructureDamageAssessor(model_path=processor_dir, load_model=False, **options)
+    model = build_tiny_model(assessor.processor, seed=seed)
+    assessor.model = assessor.backend.optimize(model, assessor.model_id)
+    if assessor.use_prefix_cache:
+        assessor._build_prefix_cache()
+    return assessor
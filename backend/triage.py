@@ -0,0 +1,167 @@
+"""
+Zero-shot image triage in front of the 7B model.
+
+A CLIP model compares each upload with short text descriptions of three
+groups: unrelated content (games, memes, screenshots...), fake or generated
+images, and real infrastructure damage. Uploads that are confidently unrelated
+or fake get a score of 0 right away with the reason recorded; everything else
+goes on to the full assessment. CLIP ViT-B/32 answers in milliseconds where a
+LLaVA generate takes seconds.
+"""
+import io
+import logging
+import threading
+import time
+
+import torch
+from PIL import Image
+from transformers import CLIPModel, CLIPProcessor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Group -> prompts; a group's probability is the sum over its prompts
+TRIAGE_LABELS = {
+    "unrelated": [
+        "a screenshot of a video game",
+        "a meme with text",
+        "a selfie of a person",
+        "a cartoon or anime drawing",
+        "a screenshot of a phone or computer screen",
+        "a photo of food",
+        "a photo of a pet",
+        "a photo of a document or a page of text",
+    ],
+    "fake": [
+        "an AI generated image",
+        "a digital painting or 3D render",
+        "a photoshopped, edited image",
+    ],
+    "infrastructure": [
+        "a photo of a damaged road with potholes",
+        "a photo of a collapsed or cracked bridge",
+        "a photo of a fallen tree or power line on a street",
+        "a photo of a flooded street",
+        "a photo of a broken water pipe or sewer",
+        "a photo of a damaged building or wall",
+        "a photo of a street, sidewalk or public infrastructure",
+    ],
+}
+# Groups that are scored by triage alone
+GATED_GROUPS = ("unrelated", "fake")
+
+
+class ImageTriage:
+    """CLIP zero-shot classifier deciding which images need the full assessment.
+
+    ``threshold`` is the probability an image must have of belonging to a gated
+    group before it is scored 0 without the 7B model; raise it to gate less.
+    The latency saved per gated image is estimated from a running average of
+    full assessments, see ``record_full_assessment``.
+    """
+
+    def __init__(self, model_path="openai/clip-vit-base-patch32", threshold=0.85, device=None):
+        self.threshold = threshold
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.processor = CLIPProcessor.from_pretrained(model_path)
+        self.model = CLIPModel.from_pretrained(model_path).to(self.device).eval()
+        self._groups = []
+        prompts = []
+        for group, texts in TRIAGE_LABELS.items():
+            self._groups += [group] * len(texts)
+            prompts += texts
+        # The label side never changes, embed it once
+        with torch.no_grad():
+            text_inputs = self.processor(text=prompts, return_tensors="pt", padding=True).to(self.device)
+            text_embeds = self.model.get_text_features(**text_inputs)
+        self._text_embeds = text_embeds / text_embeds.norm(dim=-1, keepdim=True)
+        self._lock = threading.Lock()
+        # Classification runs on worker threads, the counters get their own lock
+        self._stats_lock = threading.Lock()
+        self.checked = 0
+        self.gated = 0
+        self.seconds = 0.0
+        self.saved_seconds = 0.0
+        self._full_assessment_seconds = None
+
+    def _probabilities(self, image):
+        inputs = self.processor(images=image, return_tensors="pt").to(self.device)
+        with self._lock, torch.no_grad():
+            image_embeds = self.model.get_image_features(**inputs)
+            image_embeds = image_embeds / image_embeds.norm(dim=-1, keepdim=True)
+            logits = self.model.logit_scale.exp() * image_embeds @ self._text_embeds.T
+            probabilities = logits.softmax(dim=-1)[0].tolist()
+        totals = dict.fromkeys(TRIAGE_LABELS, 0.0)
+        for group, probability in zip(self._groups, probabilities):
+            totals[group] += probability
+        return totals
+
+    def classify(self, image_bytes):
+        """
+        Classify one image
+
+        Returns:
+            dict: group, confidence, per-group probabilities and whether the full assessment can be skipped
+        """
+        started = time.perf_counter()
+        image = Image.open(io.BytesIO(image_bytes))
+        # CLIP looks at 224x224, let the JPEG decoder skip most of the work
+        image.draft("RGB", (224, 224))
+        totals = self._probabilities(image.convert("RGB"))
+        group = max(totals, key=totals.get)
+        gated = group in GATED_GROUPS and totals[group] >= self.threshold
+        elapsed = time.perf_counter() - started
+
+        saved = None
+        with self._stats_lock:
+            self.checked += 1
+            self.seconds += elapsed
+            if gated:
+                self.gated += 1
+                if self._full_assessment_seconds is not None:
+                    saved = max(0.0, self._full_assessment_seconds - elapsed)
+                    self.saved_seconds += saved
+        metrics.STAGE_SECONDS.observe(elapsed, stage="triage")
+        metrics.TRIAGE_DECISIONS.inc(decision=group if gated else "assess")
+        if saved is not None:
+            metrics.TRIAGE_SAVED_SECONDS.inc(saved)
+        return {
+            "group": group,
+            "confidence": round(totals[group], 3),
+            "probabilities": {name: round(value, 3) for name, value in totals.items()},
+            "gated": gated,
+        }
+
+    def gated_result(self, decision):
+        """Assessment result for an image triage has ruled out"""
+        kind = "unrelated to infrastructure" if decision["group"] == "unrelated" else "fake or AI-generated"
+        return {
+            "priority_score": 0,
+            "reasoning": f"Triage: image classified as {kind} (confidence {decision['confidence']:.0%}); "
+                         f"not sent to the full damage assessment.",
+            "triage": decision,
+        }
+
+    def record_full_assessment(self, seconds):
+        """Feed the latency of an assessment that went through the 7B model into the saving estimate"""
+        with self._stats_lock:
+            if self._full_assessment_seconds is None:
+                self._full_assessment_seconds = seconds
+            else:
+                self._full_assessment_seconds = 0.9 * self._full_assessment_seconds + 0.1 * seconds
+
+    def stats(self):
+        with self._stats_lock:
+            checked, gated, seconds = self.checked, self.gated, self.seconds
+            full_assessment_seconds, saved_seconds = self._full_assessment_seconds, self.saved_seconds
+        return {
+            "threshold": self.threshold,
+            "checked": checked,
+            "gated": gated,
+            "gating_rate": round(gated / checked, 3) if checked else 0,
+            "average_triage_ms": round(seconds / checked * 1000, 1) if checked else None,
+            "average_full_assessment_seconds": round(full_assessment_seconds, 2)
+            if full_assessment_seconds is not None else None,
+            "saved_seconds": round(saved_seconds, 1),
+        }
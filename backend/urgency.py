@@ -0,0 +1,184 @@
+"""
+Initial urgency of an assessment job from signals that cost no inference.
+
+Before the 7B model has looked at a report, its text, the number of other
+reports from the same spot and the track record of its reporter already say a
+lot about how urgent it is. The estimate only decides the queue order (see
+JobQueue deadlines); the priority score still comes from the model.
+"""
+import asyncio
+import logging
+import math
+import re
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# From most to least urgent
+PRIORITY_CLASSES = ("critical", "high", "normal", "low")
+
+# Checked in order, the first class with a matching phrase wins
+KEYWORDS = {
+    "critical": (
+        "gas leak", "gas main", "smell of gas", "live wire", "exposed wire", "downed power line", "electrocut",
+        "collapse", "sinkhole", "explosion", "on fire", "burning", "trapped", "injured", "bleeding",
+        "bridge crack", "flooding house", "sewage overflow",
+    ),
+    "high": (
+        "power line", "fallen tree", "tree fell", "burst pipe", "water main", "flood", "road blocked",
+        "blocked road", "traffic light", "traffic signal", "manhole", "open drain", "landslide", "wall broken",
+        "crack", "leaning pole", "school", "hospital",
+    ),
+    "low": (
+        "graffiti", "litter", "faded", "paint", "cosmetic", "minor", "overgrown", "dirty", "poster",
+    ),
+}
+
+EARTH_RADIUS_M = 6371000
+
+
+def _phrase_pattern(phrase):
+    # Word-start boundary so "fire" does not match "bonfire" but "electrocut" still matches "electrocuted"
+    return re.compile(r"\b" + re.escape(phrase))
+
+
+_KEYWORD_PATTERNS = {
+    priority: [(phrase, _phrase_pattern(phrase)) for phrase in phrases] for priority, phrases in KEYWORDS.items()
+}
+
+
+def _shift(priority, steps):
+    """Move a class up (negative steps) or down the urgency order, staying inside it"""
+    index = PRIORITY_CLASSES.index(priority) + steps
+    return PRIORITY_CLASSES[min(max(index, 0), len(PRIORITY_CLASSES) - 1)]
+
+
+def _distance_m(latitude_a, longitude_a, latitude_b, longitude_b):
+    """Equirectangular approximation, accurate to well under a percent at cluster distances"""
+    x = math.radians(longitude_b - longitude_a) * math.cos(math.radians((latitude_a + latitude_b) / 2))
+    y = math.radians(latitude_b - latitude_a)
+    return EARTH_RADIUS_M * math.hypot(x, y)
+
+
+class UrgencyEstimator:
+    """Priority class of a new report from keywords, report clusters and reporter history.
+
+    - keywords in the title or description set the base class
+    - ``cluster_size`` or more reports within ``cluster_radius_m`` during the
+      last ``cluster_window_seconds`` (counting this one) raise it one class
+    - a reporter whose recent reports were mostly scored very low (fake or
+      unrelated uploads) drops one class; one whose reports were mostly severe
+      rises one class
+
+    Recent report locations are kept in memory, reporter scores are read from
+    the issues table and cached for ``history_ttl_seconds``. The estimate never
+    waits for that read: a reporter missing from the cache (or stale in it) is
+    fetched in the background, one query per reporter at a time, and counts
+    from their next report on. Enqueueing therefore costs the issue read only.
+    """
+
+    def __init__(self, issue_store, cluster_radius_m=250, cluster_window_seconds=86400, cluster_size=3,
+                 history_ttl_seconds=3600, history_min_reports=3, max_recent_reports=10000,
+                 max_reporters=10000):
+        self.issue_store = issue_store
+        self.cluster_radius_m = cluster_radius_m
+        self.cluster_window_seconds = cluster_window_seconds
+        self.cluster_size = cluster_size
+        self.history_ttl_seconds = history_ttl_seconds
+        self.history_min_reports = history_min_reports
+        self.max_reporters = max_reporters
+        # (monotonic time, issue id, latitude, longitude), oldest first
+        self._recent = deque(maxlen=max_recent_reports)
+        # user id -> (monotonic time, recent scores), least recently refreshed first
+        self._history = OrderedDict()
+        # Reporters being fetched, and the fetch tasks so they are not garbage collected
+        self._refreshing = set()
+        self._refresh_tasks = set()
+
+    def keyword_priority(self, text):
+        """Base class and the phrase that decided it"""
+        text = text.lower()
+        for priority in ("critical", "high", "low"):
+            for phrase, pattern in _KEYWORD_PATTERNS[priority]:
+                if pattern.search(text):
+                    return priority, phrase
+        return "normal", None
+
+    def _cluster_count(self, issue):
+        """Reports near this one within the window, this one included; also remembers it"""
+        latitude, longitude = issue.get("latitude"), issue.get("longitude")
+        if latitude is None or longitude is None:
+            return 0
+        now = time.monotonic()
+        while self._recent and now - self._recent[0][0] > self.cluster_window_seconds:
+            self._recent.popleft()
+        nearby = {
+            issue_id for _, issue_id, other_latitude, other_longitude in self._recent
+            if _distance_m(latitude, longitude, other_latitude, other_longitude) <= self.cluster_radius_m
+        }
+        nearby.add(issue["id"])
+        self._recent.append((now, issue["id"], latitude, longitude))
+        return len(nearby)
+
+    def _reporter_scores(self, user_ids):
+        """Cached scores of the given reporters; missing and stale ones are refreshed in the background"""
+        now = time.monotonic()
+        missing = [
+            user_id for user_id in user_ids
+            if user_id not in self._refreshing
+            and (user_id not in self._history or now - self._history[user_id][0] > self.history_ttl_seconds)
+        ]
+        if missing:
+            self._refreshing.update(missing)
+            task = asyncio.create_task(self._refresh_history(missing))
+            self._refresh_tasks.add(task)
+            task.add_done_callback(self._refresh_tasks.discard)
+        return {user_id: self._history[user_id][1] for user_id in user_ids if user_id in self._history}
+
+    async def _refresh_history(self, user_ids):
+        try:
+            scores = await self.issue_store.fetch_reporter_scores(user_ids)
+        except Exception as e:
+            # History only fine-tunes the order, stale scores are better than none
+            logger.warning(f"Reading the history of {len(user_ids)} reporters failed: {str(e)}")
+            return
+        finally:
+            self._refreshing.difference_update(user_ids)
+        now = time.monotonic()
+        for user_id, user_scores in scores.items():
+            self._history.pop(user_id, None)
+            self._history[user_id] = (now, user_scores)
+        while len(self._history) > self.max_reporters:
+            self._history.popitem(last=False)
+
+    async def estimate_many(self, issues):
+        """
+        Priority class of each issue row (id, title, description, user_id, latitude, longitude)
+
+        Returns:
+            dict: issue id -> (priority class, list of reasons)
+        """
+        user_ids = sorted({issue["user_id"] for issue in issues if issue.get("user_id")})
+        history = self._reporter_scores(user_ids)
+
+        estimates = {}
+        for issue in issues:
+            priority, phrase = self.keyword_priority(f"{issue.get('title') or ''} {issue.get('description') or ''}")
+            reasons = [f"keyword '{phrase}'"] if phrase else []
+
+            cluster = self._cluster_count(issue)
+            if cluster >= self.cluster_size:
+                priority = _shift(priority, -1)
+                reasons.append(f"{cluster} reports within {self.cluster_radius_m}m")
+
+            scores = history.get(issue.get("user_id")) or []
+            if len(scores) >= self.history_min_reports:
+                if sum(score < 10 for score in scores) > len(scores) / 2:
+                    priority = _shift(priority, 1)
+                    reasons.append("reporter's recent reports mostly scored below 10")
+                elif sum(score >= 70 for score in scores) > len(scores) / 2:
+                    priority = _shift(priority, -1)
+                    reasons.append("reporter's recent reports mostly scored 70 or more")
+            estimates[issue["id"]] = (priority, reasons)
+        return estimates
@@ -0,0 +1,158 @@
+import itertools
+import logging
+import threading
+from multiprocessing.connection import Client
+from multiprocessing.shared_memory import SharedMemory
+
+import torch
+
+import metrics
+from img import InfrastructureDamageAssessor, InferenceUnavailableError
+
+logger = logging.getLogger(__name__)
+
+
+def tensor_to_shared_memory(tensor):
+    """Copy a CPU tensor into a new shared memory block; returns the block and its descriptor"""
+    tensor = tensor.contiguous()
+    block = SharedMemory(create=True, size=max(1, tensor.numel() * tensor.element_size()))
+    view = torch.frombuffer(block.buf, dtype=tensor.dtype, count=tensor.numel()).view(tensor.shape)
+    view.copy_(tensor)
+    # The block cannot be closed while a tensor still points into its buffer
+    del view
+    return block, (block.name, tuple(tensor.shape), str(tensor.dtype).replace("torch.", ""))
+
+
+def tensor_from_shared_memory(block, shape, dtype):
+    """Copy a tensor back out of an attached shared memory block"""
+    count = 1
+    for size in shape:
+        count *= size
+    view = torch.frombuffer(block.buf, dtype=getattr(torch, dtype), count=count).view(shape)
+    tensor = view.clone()
+    del view
+    return tensor
+
+
+class _WorkerClient:
+    """Connection to one inference_server.py worker, used by one batch at a time"""
+
+    def __init__(self, address, authkey):
+        host, port = address.rsplit(":", 1)
+        self.address = (host, int(port))
+        self.authkey = authkey
+        self.lock = threading.Lock()
+        self.connection = None
+        self.healthy = True
+        self.requests = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_stats = None
+
+    def call(self, message, timeout):
+        """Send one message and wait for the reply; raises ConnectionError if the worker is unreachable"""
+        try:
+            if self.connection is None:
+                self.connection = Client(self.address, authkey=self.authkey)
+            self.connection.send(message)
+            if not self.connection.poll(timeout):
+                raise TimeoutError(f"No reply within {timeout}s")
+            reply = self.connection.recv()
+        except (OSError, EOFError, TimeoutError) as e:
+            # A late reply would be read as the answer to the next request, so start over
+            self.disconnect()
+            self.healthy = False
+            self.failures += 1
+            self.last_error = str(e) or type(e).__name__
+            raise ConnectionError(f"Inference worker {self.address[0]}:{self.address[1]} unavailable: {self.last_error}")
+
+        if not self.healthy:
+            logger.info(f"Inference worker {self.address[0]}:{self.address[1]} is reachable again")
+        self.healthy = True
+        self.requests += 1
+        self.last_stats = reply.get("stats")
+        return reply
+
+    def disconnect(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except OSError:
+                pass
+            self.connection = None
+
+    def health(self):
+        return {
+            "address": f"{self.address[0]}:{self.address[1]}",
+            "healthy": self.healthy,
+            "busy": self.lock.locked(),
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "worker": self.last_stats,
+        }
+
+
+class RemoteAssessor(InfrastructureDamageAssessor):
+    """Assessor that preprocesses locally and generates in inference_server.py workers.
+
+    Only the processor is loaded in the API process. Each batch's pixel tensor is
+    copied once into shared memory and the worker maps it by name, so the
+    largest part of the batch is never pickled; token ids and options travel over
+    an authenticated multiprocessing connection. Batches go to an idle worker if
+    there is one, and to the next worker when one cannot be reached. When no
+    worker answers, InferenceUnavailableError is raised so the job is retried.
+    Workers must run on the same host, shared memory does not cross machines.
+    """
+
+    def __init__(self, addresses, authkey, request_timeout=600, **options):
+        if not authkey:
+            raise ValueError("Inference workers need an authkey, their connections carry pickles")
+        self.request_timeout = request_timeout
+        self._workers = [_WorkerClient(address, authkey.encode("utf-8")) for address in addresses]
+        self._next_worker = itertools.count()
+        options["load_model"] = False
+        super().__init__(**options)
+
+    def _worker_order(self):
+        """Workers to try for a batch: idle healthy ones first, starting from the round-robin position"""
+        start = next(self._next_worker) % len(self._workers)
+        rotated = self._workers[start:] + self._workers[:start]
+        return sorted(rotated, key=lambda worker: (not worker.healthy, worker.lock.locked()))
+
+    def _generate(self, batch, mode, max_new_tokens, output_mode):
+        block, pixel_values = tensor_to_shared_memory(batch["pixel_values"])
+        message = {
+            "op": "generate",
+            "pixel_values": pixel_values,
+            "tensors": {key: value for key, value in batch.items() if key != "pixel_values"},
+            "resolution_mode": mode,
+            "max_new_tokens": max_new_tokens,
+            "output_mode": output_mode,
+        }
+        try:
+            reply = self._dispatch(message)
+        finally:
+            block.close()
+            block.unlink()
+
+        if "error" in reply:
+            raise RuntimeError(f"Inference worker failed: {reply['error']}")
+        # Prefill and decode happen in the worker, it reports their timings with the answers
+        metrics.observe_generation(reply.get("timings"))
+        return reply["answers"]
+
+    def _dispatch(self, message):
+        errors = []
+        for worker in self._worker_order():
+            with worker.lock:
+                try:
+                    return worker.call(message, self.request_timeout)
+                except ConnectionError as e:
+                    logger.warning(str(e))
+                    errors.append(str(e))
+        raise InferenceUnavailableError("; ".join(errors) or "No inference workers configured")
+
+    def worker_health(self):
+        """Per-worker state as last seen by this process"""
+        return [worker.health() for worker in self._workers]